@@ -4,16 +4,24 @@ import sys
 import time
 import argparse
 import os.path
-import json
 
+import numpy
 from picamera2 import Picamera2
 
 from libcamera import controls, Transform
 
+from capture_metrics import CaptureMetrics
+from compress_pool import CompressPool
+from frame_writer import POLICIES, Frame, FrameWriter
+from rate_control import RateController
+import raw_pack
+from segment import SegmentWriter
+from status import StatusWriter
+
 ready_line = None
 
 class CameraStill:
-    def __init__(self, ordinal, frame_rate, tuning_file, file_type, output_dir, sync_mode_server):
+    def __init__(self, ordinal, rate_control, tuning_file, file_type, output_dir, sync_mode_server, writer, status, metrics):
         tuning = Picamera2.load_tuning_file(tuning_file)
         self._cam = Picamera2(ordinal, tuning=tuning)
 
@@ -24,6 +32,11 @@ class CameraStill:
         self._ordinal = ordinal
         self._file_type = file_type
         self._output_dir = output_dir
+        self._writer = writer
+        self._rate_control = rate_control
+        self._status = status
+        self._metrics = metrics
+        self._dropped = 0
         self._sync_mode = controls.rpi.SyncModeEnum.Server if sync_mode_server else controls.rpi.SyncModeEnum.Client
 
         sensor_size = (4056, 3040)
@@ -69,7 +82,8 @@ class CameraStill:
             "ExposureTime": 1_000,  # Microseconds
             "ExposureValue": 0, # 0: "normal" exposure
 
-            "FrameRate": frame_rate,
+            # Fixed while capturing, to keep the SyncMode lock; see RateController.
+            "FrameRate": rate_control.rate,
 
             "HdrMode": controls.HdrModeEnum.Off,
 
@@ -82,8 +96,9 @@ class CameraStill:
         })
 
     def run(self):
+        # One capture thread; the writing happens on the FrameWriter's threads.
         from concurrent.futures import ThreadPoolExecutor
-        executor = ThreadPoolExecutor(max_workers=10)
+        executor = ThreadPoolExecutor(max_workers=1)
 
         self._cam.start()
 
@@ -97,13 +112,28 @@ class CameraStill:
             print(repr(sys.exception()))
 
         self._cam.stop()
+        self._writer.close()
+        self._status.close()
+        self._metrics.close()
 
     def await_request(self):
         return self._cam.capture_request()
 
     def resolve(self, request):
+        # Copy the frame out of the libcamera buffer and give the buffer back
+        # at once; the copy is written by the FrameWriter.
+        received = time.monotonic()
         metadata = request.get_metadata()
+        # SensorTimestamp is on the kernel's monotonic clock.
+        latency = (time.monotonic_ns() - metadata["SensorTimestamp"]) / 1e9
         frame_wallclock = metadata["FrameWallClock"] / 1e6
+        sync_ready = "SyncReady" in metadata and metadata["SyncReady"] == True
+        save = sync_ready and self._rate_control.should_save(metadata["SensorTimestamp"])
+        copy_start = time.monotonic()
+        raw = request.make_buffer("raw") if save else None
+        copy = time.monotonic() - copy_start
+        request.release()
+        hold = time.monotonic() - received
 
         # if "FocusFoM" in metadata:
         #     print(f"c{self._ordinal} FoM: {metadata['FocusFoM']}")
@@ -111,26 +141,42 @@ class CameraStill:
         # from pprint import pprint
         # pprint(metadata)
 
-        if "SyncReady" in metadata and metadata["SyncReady"] == True:
+        if save:
             file_path = os.path.join(self._output_dir, f"{frame_wallclock:.3f}_c{self._ordinal}")
 
-            request.make_buffer("raw").tofile(file_path + ".srggb16")
+            raw = numpy.frombuffer(raw, dtype=numpy.uint16).reshape(raw_pack.SENSOR_HEIGHT, -1)
+            self._writer.submit(Frame(file_path, raw, metadata))
+
+            change = self._rate_control.update(self._writer.stats)
+            if change is not None:
+                print(f"c{self._ordinal}: {change}")
 
+        if sync_ready:
             if self._sync_mode == controls.rpi.SyncModeEnum.Server:
                 ready_line.set_value(1)  # Active, or 0 V
 
-            with open(file_path + ".json", "w") as f:
-                f.write(json.dumps(metadata))
-
         dropped_frame_str = " "
         if self._last_frame_wallclock is not None:
+            # More than half a frame period off means a frame went missing.
             frame_delta = frame_wallclock - self._last_frame_wallclock
-            frame_round = round(frame_delta * 10) / 10
-            if frame_delta != 1.0:
+            if abs(frame_delta * self._rate_control.rate - 1.0) > 0.5:
                 dropped_frame_str = "*"
-        print(f"{frame_wallclock:.3f} {dropped_frame_str}")
-
-        request.release()
+                self._dropped += max(0, round(frame_delta * self._rate_control.rate) - 1)
+        self._last_frame_wallclock = frame_wallclock
+        saved_str = "s" if save else " "
+        stats = self._writer.stats
+        print(f"{frame_wallclock:.3f} {dropped_frame_str}{saved_str} {stats.summary()}")
+        self._metrics.capture(metadata["FrameWallClock"], metadata["SensorTimestamp"], latency, hold, copy,
+                              sync_ready, save, self._dropped, stats.depth)
+
+        # The heartbeat follows frames captured, saved or not: with save
+        # decimation (--max-divisor), saves can be further apart than
+        # led_monitor.py's timeout. The counters are of frames written.
+        written = stats.written != self._status.items
+        self._status.items = stats.written
+        self._status.bytes = stats.bytes_written
+        self._status.errors = stats.dropped + stats.failed
+        self._status.publish(force=written)
 
     def _camera_thread(self):
         self._last_frame_wallclock = None
@@ -156,6 +202,14 @@ parser = argparse.ArgumentParser(
 )
 parser.add_argument("-o", "--ordinal", type=int, help="camera number")
 parser.add_argument("-s", "--server", action='store_true', default=False, help="act as synchronization server")
+parser.add_argument("-r", "--rate", type=float, default=1.0, help="sensor frame rate, frames/s")
+parser.add_argument("--max-divisor", type=int, default=1, help="when storage falls behind, save as few as 1 in this many frames (a power of two)")
+parser.add_argument("--write-threads", type=int, default=2, help="number of threads writing frames to storage")
+parser.add_argument("--queue-depth", type=int, default=4, help="frames that may wait to be written (about 25 MB each)")
+parser.add_argument("--queue-policy", choices=POLICIES, default="block", help="what to do when the write queue is full")
+parser.add_argument("--segment-size", type=int, default=0, help="write frames into preallocated segment files of this many MB, instead of a file per frame")
+parser.add_argument("-f", "--format", choices=("srggb16", "srggb12p", "srggb12z"), default="srggb16", help="raw file format: as captured, cropped and packed to 12 bits, or cropped and compressed losslessly")
+parser.add_argument("--compress-workers", type=int, default=3, help="processes compressing srggb12z frames (0: on the writer threads)")
 args = parser.parse_args()
 
 if args.server:
@@ -172,7 +226,15 @@ try:
         # Wait a bit, since starting both camera 0 and 1 at the same time can cause conflicts in the camera stack...?
         time.sleep(5.0)
 
-    camera = CameraStill(args.ordinal, 1.0, tuning_file, "srggb16", "/home/drone/out", args.server)
+    output_dir = "/home/drone/out"
+    # Before the camera and the writer threads start; see CompressPool.
+    pool = CompressPool(args.compress_workers) if args.format == "srggb12z" and args.compress_workers else None
+    segments = SegmentWriter(output_dir, args.segment_size * 1_000_000) if args.segment_size else None
+    metrics = CaptureMetrics(args.ordinal, output_dir, time.time())
+    writer = FrameWriter(args.format, args.write_threads, args.queue_depth, args.queue_policy, segments, pool, metrics)
+    rate_control = RateController(args.rate, args.max_divisor, args.queue_depth, writer.threads)
+    status = StatusWriter(f"c{args.ordinal}")
+    camera = CameraStill(args.ordinal, rate_control, tuning_file, args.format, output_dir, args.server, writer, status, metrics)
     camera.run()
 except:
     print(repr(sys.exception()))
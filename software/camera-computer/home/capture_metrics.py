@@ -0,0 +1,165 @@
+import os
+import os.path
+import select
+import socket
+import threading
+import time
+
+# Per-frame capture metrics from c.py, for finding where the capture path
+# loses time under load.
+#
+# The capture and writer threads only add a record to a fixed-size ring, under
+# a lock. Twice a second, an exporter thread takes the new records out of the
+# ring under the lock, then, with the lock released, formats them as InfluxDB
+# line protocol, appends them to "<ts>_c<cam>.metrics" in the output
+# directory and sends them to clients of a Unix socket,
+# "/tmp/drone-c<cam>.metrics.sock". A client first gets the records still in
+# the ring, then new ones as they come:
+#
+#   socat - UNIX-CONNECT:/tmp/drone-c0.metrics.sock
+#
+# Two measurements, both tagged with the camera and timestamped with the
+# frame's FrameWallClock, so the lines of a frame join up:
+#
+#   capture  from CameraStill.resolve(), for every frame
+#     sensor_ts   SensorTimestamp, ns
+#     latency     SensorTimestamp to the completed request reaching c.py, s
+#     hold        time the request's buffers were held by c.py, s
+#     copy        time to copy the raw buffer, s (part of hold)
+#     sync        SyncReady
+#     saved       whether the frame was queued for writing
+#     dropped     frames missed by c.py so far
+#     queue       write queue depth after the frame
+#
+#   write    from FrameWriter, for every saved frame
+#     wait        time queued before a writer thread took the frame, s
+#     encode      packing or compression time, s
+#     raw         time to write the raw data (the whole record, for segments), s
+#     json        time to write the metadata JSON, s
+#     bytes       bytes written
+#     rate        bytes/s of the raw write
+#     failed      whether the write failed
+
+RING_SIZE = 1024
+EXPORT_INTERVAL = 0.5
+SOCKET_DIR = "/tmp"
+CLIENT_TIMEOUT = 0.1
+
+def _field(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    return f"{value:.6f}"
+
+class CaptureMetrics:
+    def __init__(self, ordinal: int, output_dir: str, start_time: float, size: int = RING_SIZE):
+        self._tags = f"cam=c{ordinal}"
+        self._ring = [None] * size
+        self._count = 0
+        self._exported = 0
+        self._lost = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self._file = open(os.path.join(output_dir, f"{start_time:.3f}_c{ordinal}.metrics"), "a")
+
+        self._socket_path = os.path.join(SOCKET_DIR, f"drone-c{ordinal}.metrics.sock")
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self._socket_path)
+        self._listener.listen()
+        self._clients = []
+
+        self._thread = threading.Thread(target=self._export_thread, name="metrics", daemon=True)
+        self._thread.start()
+
+    @property
+    def lost(self) -> int:
+        # Records overwritten in the ring before they were exported.
+        return self._lost
+
+    def capture(self, frame_wallclock_us: int, sensor_ts: int, latency: float, hold: float, copy: float,
+                sync: bool, saved: bool, dropped: int, queue: int):
+        self._add("capture", frame_wallclock_us, (("sensor_ts", sensor_ts), ("latency", latency), ("hold", hold),
+                  ("copy", copy), ("sync", sync), ("saved", saved), ("dropped", dropped), ("queue", queue)))
+
+    def write(self, frame_wallclock_us: int, wait: float, encode: float, raw: float, json: float, bytes: int,
+              failed: bool = False):
+        rate = int(bytes / raw) if raw > 0 else 0
+        self._add("write", frame_wallclock_us, (("wait", wait), ("encode", encode), ("raw", raw), ("json", json),
+                  ("bytes", bytes), ("rate", rate), ("failed", failed)))
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self._export()
+        for client in self._clients:
+            client.close()
+        self._listener.close()
+        os.unlink(self._socket_path)
+        self._file.close()
+
+    def _add(self, measurement: str, frame_wallclock_us: int, fields: tuple):
+        with self._lock:
+            self._ring[self._count % len(self._ring)] = (measurement, frame_wallclock_us, fields)
+            self._count += 1
+
+    def _records(self, first: int, last: int) -> list:
+        # Records [first, last) of the ring; the caller holds the lock. The
+        # records are tuples, so copying the references is enough.
+        return [self._ring[i % len(self._ring)] for i in range(first, last)]
+
+    def _lines(self, records: list) -> str:
+        # Formatted without the lock, so capture and writer threads don't
+        # wait on it.
+        lines = []
+        for measurement, frame_wallclock_us, fields in records:
+            values = ",".join(f"{name}={_field(value)}" for name, value in fields)
+            lines.append(f"{measurement},{self._tags} {values} {frame_wallclock_us * 1000}\n")
+        return "".join(lines)
+
+    def _export(self):
+        with self._lock:
+            first = max(self._exported, self._count - len(self._ring))
+            self._lost += first - self._exported
+            records = self._records(first, self._count)
+            self._exported = self._count
+        if not records:
+            return
+        text = self._lines(records)
+        self._file.write(text)
+        self._file.flush()
+        self._send(text.encode("ascii"))
+
+    def _send(self, data: bytes):
+        # Clients too slow to take a batch within CLIENT_TIMEOUT are dropped.
+        for client in list(self._clients):
+            try:
+                client.sendall(data)
+            except OSError:
+                client.close()
+                self._clients.remove(client)
+
+    def _accept(self):
+        client, _ = self._listener.accept()
+        client.settimeout(CLIENT_TIMEOUT)
+        with self._lock:
+            history = self._records(max(0, self._count - len(self._ring)), self._exported)
+        try:
+            client.sendall(self._lines(history).encode("ascii"))
+        except OSError:
+            client.close()
+            return
+        self._clients.append(client)
+
+    def _export_thread(self):
+        deadline = time.monotonic() + EXPORT_INTERVAL
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._listener], [], [], max(0.0, deadline - time.monotonic()))
+            if readable:
+                self._accept()
+            if time.monotonic() >= deadline:
+                self._export()
+                deadline = time.monotonic() + EXPORT_INTERVAL
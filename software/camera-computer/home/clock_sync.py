@@ -0,0 +1,80 @@
+import struct
+from collections import deque
+
+# Online estimate of the flight computer clock against the Pi clock, from
+# MAVLink TIMESYNC exchanges (see mavlink_record.py).
+#
+# The Pi sends TIMESYNC with tc1 = 0 and ts1 = its wall clock, ns. The flight
+# computer answers with tc1 = its clock (ArduPilot: ns since boot, the clock
+# of DataFlash TimeUS) and ts1 echoed. The flight computer read its clock
+# somewhere within the round trip; taking the midpoint errs by at most half
+# the round trip time, so only exchanges with a round trip close to the
+# shortest recent one are used.
+#
+# Every exchange is appended to "<ts>_fc.timesync" as a SAMPLE, whether used
+# here or not; lib/time_map.py in post-processing reads these files.
+
+SAMPLE = struct.Struct("<qqq")      # Pi wall clock at the midpoint, flight computer clock, round trip; all ns
+
+# Exchanges are used while their round trip is within this factor of the
+# shortest among the last WINDOW exchanges.
+RTT_FACTOR = 1.5
+WINDOW = 64
+
+class ClockEstimator:
+    def __init__(self):
+        self._rtts = deque(maxlen=WINDOW)
+        self._pi = deque(maxlen=WINDOW)
+        self._offsets = deque(maxlen=WINDOW)
+        self._offset = None
+        self._drift = 0.0
+        self._count = 0
+        self._accepted = 0
+
+    @property
+    def offset(self) -> float | None:
+        # Flight computer clock minus Pi clock, seconds, at the latest sample.
+        return self._offset
+
+    @property
+    def accepted(self) -> int:
+        # Samples used so far.
+        return self._accepted
+
+    @property
+    def drift(self) -> float:
+        # Rate of the flight computer clock against the Pi clock, s/s.
+        return self._drift
+
+    def add(self, pi_ns: int, fc_ns: int, rtt_ns: int) -> bool:
+        # True if the sample was used.
+        self._count += 1
+        self._rtts.append(rtt_ns)
+        if rtt_ns > RTT_FACTOR * min(self._rtts):
+            return False
+        self._accepted += 1
+
+        # Least squares line through the recent offsets, relative to this
+        # sample, so the sums stay small. Plain Python: mavlink_record.py's
+        # venv has no numpy.
+        self._pi.append(pi_ns)
+        self._offsets.append(fc_ns - pi_ns)
+        x = [(pi - pi_ns) * 1e-9 for pi in self._pi]
+        y = [(offset - self._offsets[-1]) * 1e-9 for offset in self._offsets]
+        n = len(x)
+        x_mean = sum(x) / n
+        y_mean = sum(y) / n
+        sxx = sum((xi - x_mean) ** 2 for xi in x)
+        if sxx > 0.0:
+            self._drift = sum((xi - x_mean) * (yi - y_mean) for xi, yi in zip(x, y)) / sxx
+            intercept = y_mean - self._drift * x_mean
+        else:
+            intercept = 0.0
+        self._offset = self._offsets[-1] * 1e-9 + intercept
+        return True
+
+    def summary(self) -> str:
+        if self._offset is None:
+            return f"timesync: {self._count} exchanges, none used"
+        return (f"timesync: {self._accepted}/{self._count} exchanges used, rtt min {min(self._rtts) * 1e-6:.2f} ms,"
+                f" offset {self._offset:+.6f} s, drift {self._drift * 1e6:+.2f} ppm")
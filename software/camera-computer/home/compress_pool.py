@@ -0,0 +1,115 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import queue
+import signal
+import time
+
+import numpy
+
+import raw_codec
+
+# Worker processes that compress frames (raw_codec.py), so that compression
+# runs on the Pi's otherwise idle cores instead of in c.py's GIL.
+#
+# Frames are not pickled. Each worker owns two shared memory blocks: the
+# caller copies a frame into the worker's input block and sends it the
+# frame's shape over a pipe; the worker encodes the frame into its output
+# block and replies with the encoded size and the time it took. The caller
+# copies the encoded frame out and the worker goes back to the pool, so it can
+# take the next frame while the caller writes this one.
+#
+# A worker that dies is dropped from the pool, and the frame it had fails
+# with a ChildProcessError. Workers are not replaced: forking c.py once its
+# threads are running is not safe. Once none are left, compress() raises
+# straight away.
+
+# Largest frame accepted, and the room left for the encoded frame, which may
+# be slightly larger than its 12-bit samples when nothing compresses.
+MAX_FRAME_BYTES = 3040 * 4096 * 2
+MAX_ENCODED_BYTES = MAX_FRAME_BYTES + (1 << 20)
+
+def _worker(conn, input_name: str, output_name: str):
+    # Ctrl-C goes to c.py, which stops the workers in turn.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    input_block = shared_memory.SharedMemory(name=input_name)
+    output_block = shared_memory.SharedMemory(name=output_name)
+    try:
+        while (shape := conn.recv()) is not None:
+            start = time.perf_counter()
+            raw = numpy.ndarray(shape, dtype=numpy.uint16, buffer=input_block.buf)
+            frame = raw_codec.encode(raw)
+            del raw
+            output_block.buf[:len(frame)] = frame
+            conn.send((len(frame), time.perf_counter() - start))
+    finally:
+        input_block.close()
+        output_block.close()
+
+class _Worker:
+    def __init__(self, context, index: int):
+        self.input = shared_memory.SharedMemory(create=True, size=MAX_FRAME_BYTES)
+        self.output = shared_memory.SharedMemory(create=True, size=MAX_ENCODED_BYTES)
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker, args=(child_conn, self.input.name, self.output.name),
+                                       name=f"compress-{index}", daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5.0)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+        for block in (self.input, self.output):
+            block.close()
+            block.unlink()
+
+class CompressPool:
+    # Create the pool before starting the camera or any threads: workers are
+    # forked, since a spawned child would re-run c.py from the top.
+    def __init__(self, workers: int):
+        context = multiprocessing.get_context("fork")
+        self._workers = [_Worker(context, i) for i in range(workers)]
+        self._idle = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+
+    @property
+    def workers(self) -> int:
+        # Workers still running.
+        return len(self._workers)
+
+    def compress(self, raw: numpy.ndarray) -> tuple[bytes, float]:
+        # Encode a (height, stride) uint16 frame on the next idle worker.
+        # Returns the encoded frame and the encode time in seconds.
+        if raw.nbytes > MAX_FRAME_BYTES:
+            raise ValueError(f"frame too large to compress: {raw.nbytes} bytes")
+        worker = self._idle.get()
+        if worker is None:
+            self._idle.put(None)
+            raise ChildProcessError("no compression workers left")
+        try:
+            numpy.copyto(numpy.ndarray(raw.shape, dtype=numpy.uint16, buffer=worker.input.buf), raw)
+            worker.conn.send(raw.shape)
+            size, seconds = worker.conn.recv()
+            frame = bytes(worker.output.buf[:size])
+        except (EOFError, OSError, ValueError) as e:
+            self._drop(worker)
+            raise ChildProcessError(f"{worker.process.name} died: {e!r}") from e
+        self._idle.put(worker)
+        return frame, seconds
+
+    def close(self):
+        for worker in self._workers:
+            worker.close()
+
+    def _drop(self, worker: _Worker):
+        worker.close()
+        self._workers.remove(worker)
+        if not self._workers:
+            # Wakes any thread waiting for an idle worker.
+            self._idle.put(None)
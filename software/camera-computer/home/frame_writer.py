@@ -0,0 +1,218 @@
+import json
+import os.path
+import threading
+import time
+from collections import deque
+
+from capture_metrics import CaptureMetrics
+from compress_pool import CompressPool
+import raw_codec
+import raw_pack
+from segment import SegmentWriter
+
+# Writes captured frames to storage off the capture thread.
+#
+# The capture thread copies a frame out of its libcamera buffer, hands it to
+# FrameWriter.submit() and releases the request straight away. Writer threads
+# take frames from a bounded queue and write the raw file and the metadata
+# JSON. When the queue is full, the policy decides what gives:
+#
+# * "block": submit() waits for a free slot. Nothing queued is lost, but the
+#   capture thread stalls, and libcamera drops frames once its buffers run out.
+# * "drop-newest": the frame being submitted is dropped.
+# * "drop-oldest": the oldest queued frame is dropped to make room.
+#
+# Frames go to a raw file and a JSON file each, or, given a SegmentWriter,
+# into segment files (see segment.py). "srggb12z" frames are compressed on
+# the CompressPool's worker processes if there is one, otherwise on the
+# writer thread. Given CaptureMetrics, the timing of each write is recorded
+# there.
+
+POLICIES = ("block", "drop-newest", "drop-oldest")
+
+class Frame:
+    def __init__(self, file_path: str, raw, metadata: dict):
+        self.file_path = file_path
+        self.raw = raw
+        self.metadata = metadata
+        self.submitted = time.monotonic()
+
+class WriterStats:
+    def __init__(self):
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.depth = 0
+        self.depth_max = 0
+        self.write_last = 0.0
+        self.write_max = 0.0
+        self.write_total = 0.0
+        self.latency_max = 0.0
+        self.bytes_raw = 0
+        self.bytes_written = 0
+        self.encode_total = 0.0
+
+    @property
+    def write_mean(self) -> float:
+        return self.write_total / self.written if self.written else 0.0
+
+    @property
+    def ratio(self) -> float:
+        # Raw frame bytes per byte written.
+        return self.bytes_raw / self.bytes_written if self.bytes_written else 0.0
+
+    @property
+    def encode_rate(self) -> float:
+        # Raw MB/s through one compression worker.
+        return self.bytes_raw / self.encode_total / 1e6 if self.encode_total else 0.0
+
+    def summary(self) -> str:
+        summary = (f"q={self.depth}/{self.depth_max} w={self.write_last * 1e3:.0f}/{self.write_max * 1e3:.0f}ms"
+                   f" lat={self.latency_max * 1e3:.0f}ms drop={self.dropped} fail={self.failed}")
+        if self.encode_total:
+            summary += f" z={self.ratio:.2f}x@{self.encode_rate:.0f}MB/s"
+        return summary
+
+class FrameWriter:
+    # `file_type` is "srggb16" (the buffer as captured) or "srggb12p" (see
+    # raw_pack.py); packing happens on the writer threads.
+    def __init__(self, file_type: str, threads: int = 2, depth: int = 4, policy: str = "block",
+                 segments: SegmentWriter | None = None, pool: CompressPool | None = None,
+                 metrics: CaptureMetrics | None = None):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown queue policy: {policy}")
+        self._file_type = file_type
+        self._segments = segments
+        self._pool = pool
+        self._metrics = metrics
+        self._depth = depth
+        self._policy = policy
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+        self._stats = WriterStats()
+
+        # With a CompressPool, each writer thread keeps one worker busy, so
+        # there are at least as many threads as workers.
+        if pool is not None:
+            threads = max(threads, pool.workers)
+        self._threads = [threading.Thread(target=self._writer_thread, name=f"writer-{i}", daemon=True) for i in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def stats(self) -> WriterStats:
+        return self._stats
+
+    @property
+    def threads(self) -> int:
+        return len(self._threads)
+
+    def submit(self, frame: Frame) -> bool:
+        # Queue a frame for writing. False if a frame was dropped to do so
+        # (this one with "drop-newest", an older one with "drop-oldest").
+        with self._lock:
+            stats = self._stats
+            stats.submitted += 1
+            accepted = True
+            if len(self._queue) >= self._depth:
+                if self._policy == "block":
+                    while len(self._queue) >= self._depth and not self._closed:
+                        self._not_full.wait()
+                elif self._policy == "drop-newest":
+                    stats.dropped += 1
+                    return False
+                else:
+                    self._queue.popleft()
+                    stats.dropped += 1
+                    accepted = False
+            self._queue.append(frame)
+            stats.depth = len(self._queue)
+            stats.depth_max = max(stats.depth_max, stats.depth)
+            self._not_empty.notify()
+            return accepted
+
+    def close(self):
+        # Write out what is queued, then stop the writer threads.
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        for thread in self._threads:
+            thread.join()
+        if self._segments is not None:
+            self._segments.close()
+        if self._pool is not None:
+            self._pool.close()
+
+    def _next(self) -> Frame | None:
+        with self._lock:
+            while not self._queue and not self._closed:
+                self._not_empty.wait()
+            if not self._queue:
+                return None
+            frame = self._queue.popleft()
+            self._stats.depth = len(self._queue)
+            self._not_full.notify()
+            return frame
+
+    def _write(self, frame: Frame, data) -> tuple[float, float]:
+        # Seconds spent writing the raw data and the JSON.
+        start = time.monotonic()
+        if self._segments is not None:
+            self._segments.append(os.path.basename(frame.file_path), self._file_type, data, json.dumps(frame.metadata))
+            return time.monotonic() - start, 0.0
+        with open(frame.file_path + "." + self._file_type, "wb") as f:
+            f.write(data)
+        raw_end = time.monotonic()
+        with open(frame.file_path + ".json", "w") as f:
+            f.write(json.dumps(frame.metadata))
+        return raw_end - start, time.monotonic() - raw_end
+
+    def _writer_thread(self):
+        packed = None
+        while (frame := self._next()) is not None:
+            start = time.monotonic()
+            encode = 0.0
+            try:
+                if self._file_type == "srggb12z" and self._pool is not None:
+                    data, encode = self._pool.compress(frame.raw)
+                elif self._file_type in ("srggb12z", "srggb12p"):
+                    if self._file_type == "srggb12z":
+                        data = raw_codec.encode(frame.raw)
+                    else:
+                        packed = raw_pack.pack12(frame.raw, packed)
+                        data = packed
+                    encode = time.monotonic() - start
+                else:
+                    data = frame.raw
+                size = memoryview(data).nbytes
+                raw_seconds, json_seconds = self._write(frame, data)
+            except OSError as e:
+                # Includes a compression worker dying (ChildProcessError).
+                print(f"{frame.file_path}: write failed: {e}")
+                with self._lock:
+                    self._stats.failed += 1
+                if self._metrics is not None:
+                    self._metrics.write(frame.metadata["FrameWallClock"], start - frame.submitted, encode,
+                                        time.monotonic() - start, 0.0, 0, failed=True)
+                continue
+            end = time.monotonic()
+            if self._metrics is not None:
+                self._metrics.write(frame.metadata["FrameWallClock"], start - frame.submitted, encode,
+                                    raw_seconds, json_seconds, size)
+
+            with self._lock:
+                stats = self._stats
+                stats.written += 1
+                stats.bytes_raw += frame.raw.nbytes
+                stats.bytes_written += size
+                if self._file_type == "srggb12z":
+                    stats.encode_total += encode
+                stats.write_last = end - start
+                stats.write_max = max(stats.write_max, stats.write_last)
+                stats.write_total += stats.write_last
+                stats.latency_max = max(stats.latency_max, end - frame.submitted)
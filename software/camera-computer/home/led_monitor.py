@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 
 import time
-import os
 import platform
 
+from status import read_status
+
 def led_trigger_set(name: str, mode: str):
     path = f"/sys/class/leds/{name}/trigger"
     with open(path, "w") as f:
@@ -34,56 +35,38 @@ def led_set_both():
     led_brightness_set("ACT", 1)
     led_brightness_set("PWR", 0)
 
-def files_are_recent(path, has_two_cameras=False) -> bool:
-    camera_0_metadata_mtime = 0
-    camera_0_image_mtime = 0
-    camera_1_metadata_mtime = 0
-    camera_1_image_mtime = 0
-    sensors_mtime = 0
-    fc_time_mtime = 0
-    with os.scandir(path) as it:
-        for entry in it:
-            stat = entry.stat()
-            if has_two_cameras:
-                if entry.name.endswith('_c1.json'):
-                    if stat.st_mtime > camera_1_metadata_mtime:
-                        camera_1_metadata_mtime = stat.st_mtime
-                elif entry.name.endswith('_c1.srggb16'):
-                    if stat.st_mtime > camera_1_image_mtime:
-                        camera_1_image_mtime = stat.st_mtime
-                elif entry.name.endswith('_sensors.dat'):
-                    if stat.st_mtime > sensors_mtime:
-                        sensors_mtime = stat.st_mtime
-                elif entry.name.endswith('_fc.txt'):
-                    if stat.st_mtime > fc_time_mtime:
-                        fc_time_mtime = stat.st_mtime
-
-            if entry.name.endswith('_c0.json'):
-                if stat.st_mtime > camera_0_metadata_mtime:
-                    camera_0_metadata_mtime = stat.st_mtime
-            elif entry.name.endswith('_c0.srggb16'):
-                if stat.st_mtime > camera_0_image_mtime:
-                    camera_0_image_mtime = stat.st_mtime
-
-    time_now = time.time()
+# Seconds without a heartbeat before a stream counts as stopped.
+HEARTBEAT_TIMEOUT = 5
 
-    camera_0_metadata_recent = (time_now - camera_0_metadata_mtime) < 5
-    camera_0_image_recent = (time_now - camera_0_image_mtime) < 5
-    camera_1_metadata_recent = (time_now - camera_1_metadata_mtime) < 5
-    camera_1_image_recent = (time_now - camera_1_image_mtime) < 5
-    sensors_recent = (time_now - sensors_mtime) < 5
-    fc_time_recent = (time_now - fc_time_mtime) < 20    # Significant buffer delays flush to filesystem.
+# Last reading of each stream, for rates between polls.
+last_status = {}
 
-    print(f"{camera_0_metadata_recent}:{camera_0_image_recent} {camera_1_metadata_recent}:{camera_1_image_recent} {sensors_recent} {fc_time_recent}")
+def stream_is_recent(stream: str) -> bool:
+    # Reads the stream's status record (status.py): a few bytes in tmpfs,
+    # however many files the stream has written.
+    status = read_status(stream)
+    if status is None:
+        print(f"{stream}: no status")
+        return False
 
-    camera_0_recent = camera_0_metadata_recent and camera_0_image_recent
-    camera_1_recent = camera_1_metadata_recent and camera_1_image_recent
+    time_now = time.time()
+    recent = (time_now - status.heartbeat) < HEARTBEAT_TIMEOUT
 
-    all_recent = camera_0_recent and camera_1_recent and sensors_recent and fc_time_recent if has_two_cameras else camera_0_recent
+    rates = ""
+    last = last_status.get(stream)
+    if last is not None and last.pid == status.pid and status.heartbeat > last.heartbeat:
+        interval = status.heartbeat - last.heartbeat
+        rates = (f" {(status.items - last.items) / interval:.1f}/s"
+                 f" {(status.bytes - last.bytes) / interval / 1e6:.2f}MB/s")
+    last_status[stream] = status
 
-    return all_recent
+    print(f"{stream}: {recent}{rates} n={status.items} err={status.errors}")
+    return recent
 
-path_out = "/home/drone/out"
+def streams_are_recent(has_two_cameras=False) -> bool:
+    streams = ["c0", "c1", "sensors", "fc"] if has_two_cameras else ["c0"]
+    recent = [stream_is_recent(stream) for stream in streams]
+    return all(recent)
 
 led_init()
 led_set_off()
@@ -99,7 +82,7 @@ while True:
         time.sleep(0.25)
         fn_state()
 
-    if files_are_recent(path_out, has_two_cameras):
+    if streams_are_recent(has_two_cameras):
         fn_state = led_set_green
     else:
         fn_state = led_set_red
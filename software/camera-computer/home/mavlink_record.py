@@ -10,11 +10,38 @@
 #
 # And of course, be sure to start with created venv.
 
+import argparse
+import struct
 import time
 import os.path
 
 from pymavlink import mavutil
 
+from clock_sync import SAMPLE, ClockEstimator
+from status import StatusWriter
+
+# With --tlog, each message is written as received, after its receive time in
+# microseconds as a big-endian uint64: the tlog format read by MAVProxy and
+# lib/tlog.py in post-processing. No message is formatted as text, and the
+# file is written in large chunks.
+TLOG_TIMESTAMP = struct.Struct(">Q")
+TLOG_BUFFER_SIZE = 1 << 16
+
+# TIMESYNC exchanges with the flight computer, to measure its clock against
+# the Pi's (see clock_sync.py). Answers later than TIMESYNC_TIMEOUT are
+# ignored.
+TIMESYNC_INTERVAL = 1.0
+TIMESYNC_TIMEOUT = 5.0
+TIMESYNC_SUMMARY_EVERY = 30
+
+parser = argparse.ArgumentParser(
+    prog="mavlink_record",
+    description="Record MAVLink messages from the flight computer",
+)
+parser.add_argument("--timesync-interval", type=float, default=TIMESYNC_INTERVAL, help="seconds between TIMESYNC exchanges (0: none)")
+parser.add_argument("--tlog", action="store_true", default=False, help="write binary \"<ts>_fc.tlog\" instead of text \"<ts>_fc.txt\"")
+args = parser.parse_args()
+
 connection = mavutil.mavlink_connection("/dev/ttyAMA0", 921600, source_system=255, notimestamps=False, robust_parsing=True)
 
 def set_message_interval(master, message_id: int, interval_usec: int):
@@ -38,10 +65,65 @@ set_message_interval(connection, mavutil.mavlink.MAVLINK_MSG_ID_GPS_RAW_INT, 1_0
 
 path_out = "/home/drone/out"
 start_time = time.time()
-filename_out = os.path.join(path_out, f"{start_time:.3f}_fc.txt")
-f = open(filename_out, 'w')
+status = StatusWriter("fc")
+
+if args.tlog:
+    filename_out = os.path.join(path_out, f"{start_time:.3f}_fc.tlog")
+    f = open(filename_out, 'wb', buffering=TLOG_BUFFER_SIZE)
+else:
+    filename_out = os.path.join(path_out, f"{start_time:.3f}_fc.txt")
+    f = open(filename_out, 'w')
+
+timesync_file = open(os.path.join(path_out, f"{start_time:.3f}_fc.timesync"), 'ab') if args.timesync_interval > 0 else None
+clock = ClockEstimator()
+timesync_pending = {}   # ts1 sent -> monotonic ns when sent
+timesync_next = time.monotonic()
+
+def timesync_send():
+    now = time.monotonic_ns()
+    for ts1, sent in list(timesync_pending.items()):
+        if now - sent > TIMESYNC_TIMEOUT * 1e9:
+            del timesync_pending[ts1]
+    ts1 = time.time_ns()
+    timesync_pending[ts1] = time.monotonic_ns()
+    connection.mav.timesync_send(0, ts1)
+
+def timesync_receive(d, received: int):
+    # `received`: monotonic ns. The flight computer also sends requests of
+    # its own (tc1 = 0); only answers to ours are used.
+    sent = timesync_pending.pop(d.ts1, None) if d.tc1 != 0 else None
+    if sent is None:
+        return
+    rtt = received - sent
+    pi = d.ts1 + rtt // 2
+    timesync_file.write(SAMPLE.pack(pi, d.tc1, rtt))
+    timesync_file.flush()
+    if clock.add(pi, d.tc1, rtt) and clock.accepted % TIMESYNC_SUMMARY_EVERY == 1:
+        print(clock.summary())
 
 while True:
-    d = connection.recv_match(blocking=True)
+    if timesync_file is not None and time.monotonic() >= timesync_next:
+        timesync_send()
+        timesync_next = time.monotonic() + args.timesync_interval
+    d = connection.recv_match(blocking=True, timeout=args.timesync_interval or None)
+    if d is None:
+        continue
+    received = time.monotonic_ns()
     recv_time = time.time()
-    f.write(f"{recv_time:.3f} {d}\n")
+    if timesync_file is not None and d.get_type() == "TIMESYNC":
+        timesync_receive(d, received)
+    if args.tlog:
+        if d.get_type() == "BAD_DATA":
+            status.errors += 1
+            continue
+        frame = d.get_msgbuf()
+        f.write(TLOG_TIMESTAMP.pack(int(recv_time * 1e6)))
+        f.write(frame)
+        size = TLOG_TIMESTAMP.size + len(frame)
+    else:
+        line = f"{recv_time:.3f} {d}\n"
+        f.write(line)
+        size = len(line)
+    status.items += 1
+    status.bytes += size
+    status.publish()
@@ -0,0 +1,106 @@
+import math
+
+from frame_writer import WriterStats
+
+# Storage-aware save rate for c.py.
+#
+# The sensor frame rate is never changed while capturing: in SyncMode the
+# client Pi locks its frame timing to the server's, and both must run at the
+# same rate. Instead, the camera runs at the target rate and only every
+# `divisor`-th frame is saved. When storage falls behind, the divisor doubles
+# (the saved rate halves); when it has room to spare, the divisor halves
+# again, down to 1.
+#
+# Frames are picked by their index counted from the first SyncReady frame,
+# which SyncMode makes the same frame on both cameras. The index advances by
+# the number of frame periods between sensor timestamps, so a dropped frame
+# still counts. The wall clock is not used: the Pis' clocks differ by a
+# fraction of a frame, enough for round(t * rate) to pick neighbouring frames.
+# Synchronized cameras therefore save the same frames when their divisors are
+# equal. Divisors are powers of two, so a camera at a larger divisor saves a
+# subset of the frames saved by one at a smaller divisor.
+#
+# Each camera adapts its divisor to its own storage, and the cameras do not
+# share it. While one is at a larger divisor than the other, the other saves
+# frames that have no partner, which post-processing reports as incomplete
+# frame sets.
+
+# Step down when the write queue is this full, or when writing takes this
+# share of the writer threads' time.
+QUEUE_HIGH = 0.75
+BUSY_HIGH = 0.9
+
+# Step up only when the queue is empty and writing at twice the current rate
+# would take at most this share of the writers' time.
+BUSY_LOW = 0.6
+
+# Saved frames per measurement window. The statistics are taken over each
+# window on its own, so the controller follows the current load, and a window
+# starts afresh after a change, so it reflects the new rate.
+HOLD_FRAMES = 10
+
+class RateController:
+    def __init__(self, rate: float, max_divisor: int, queue_depth: int, threads: int):
+        self._rate = rate
+        self._max_divisor = 1 << int(math.log2(max(1, max_divisor)))
+        self._queue_depth = queue_depth
+        self._threads = threads
+        self._divisor = 1
+        self._hold = HOLD_FRAMES
+        self._written = 0
+        self._write_total = 0.0
+        self._dropped = 0
+        self._index = 0
+        self._last_timestamp = None
+
+    @property
+    def rate(self) -> float:
+        # Sensor frame rate, frames/s.
+        return self._rate
+
+    @property
+    def divisor(self) -> int:
+        return self._divisor
+
+    @property
+    def save_rate(self) -> float:
+        return self._rate / self._divisor
+
+    def should_save(self, sensor_timestamp: int) -> bool:
+        # Call for every frame from the first SyncReady one on; the timestamp
+        # is SensorTimestamp, in ns.
+        if self._last_timestamp is not None:
+            self._index += max(1, round((sensor_timestamp - self._last_timestamp) / 1e9 * self._rate))
+        self._last_timestamp = sensor_timestamp
+        return self._index % self._divisor == 0
+
+    def update(self, stats: WriterStats) -> str | None:
+        # Call after each saved frame. Returns a description of the change,
+        # if the divisor changed.
+        self._hold -= 1
+        if self._hold > 0:
+            return None
+        written = stats.written - self._written
+        write_total = stats.write_total - self._write_total
+        dropped = stats.dropped - self._dropped
+        self._hold = HOLD_FRAMES
+        self._written = stats.written
+        self._write_total = stats.write_total
+        self._dropped = stats.dropped
+        if written <= 0 and not dropped:
+            return None
+
+        # Share of the writer threads' time spent writing, at the current rate.
+        busy = write_total / written * self.save_rate / self._threads if written > 0 else 0.0
+        full = stats.depth >= QUEUE_HIGH * self._queue_depth
+
+        reason = None
+        if (full or dropped or busy > BUSY_HIGH) and self._divisor < self._max_divisor:
+            self._divisor *= 2
+            reason = "queue full" if full else "frames dropped" if dropped else f"writers {busy:.0%} busy"
+        elif stats.depth == 0 and not dropped and 2 * busy <= BUSY_LOW and self._divisor > 1:
+            self._divisor //= 2
+            reason = f"writers {busy:.0%} busy"
+        if reason is None:
+            return None
+        return f"save rate {self.save_rate:g} fps (1 in {self._divisor} of {self._rate:g} fps): {reason}"
@@ -0,0 +1,44 @@
+import struct
+import zlib
+
+import numpy
+
+import raw_pack
+
+# Lossless compressed raw frame format, "*.srggb12z".
+#
+# The black strip is cropped and samples are reduced to 12 bits, as for
+# "*.srggb12p". Then each sample is replaced by its difference from the
+# previous sample of the same colour: two columns to the left, or two rows
+# up in the first two columns. Differences are small where the image is
+# smooth. They are zigzag-coded (0, -1, 1, -2, ... -> 0, 1, 2, 3, ...), split
+# into a plane of low bytes and a plane of high bytes, which are nearly all
+# zero, and deflated with zlib at its fastest level.
+#
+#   HEADER  magic, height, width, size of the zlib stream
+#   zlib stream of the low byte plane, then the high byte plane
+#
+# lib/raw.py in post-processing decodes these frames.
+
+MAGIC = b"GDZ1"
+HEADER = struct.Struct("<4sHHI")
+ZLIB_LEVEL = 1
+
+def encode(raw: numpy.ndarray, width: int = raw_pack.SENSOR_WIDTH) -> bytes:
+    # `raw` is a (height, stride) uint16 SRGGB16 frame. 12-bit samples and
+    # their differences both fit in int16, so no wider copies are made.
+    samples = (raw[:, :width] >> 4).view(numpy.int16)
+
+    residuals = numpy.empty_like(samples)
+    numpy.subtract(samples[:, 2:], samples[:, :-2], out=residuals[:, 2:])
+    numpy.subtract(samples[2:, :2], samples[:-2, :2], out=residuals[2:, :2])
+    residuals[:2, :2] = samples[:2, :2]
+
+    zigzag = ((residuals << 1) ^ (residuals >> 15)).view(numpy.uint16)
+    pairs = zigzag.reshape(-1).view(numpy.uint8)
+    planes = numpy.empty((2, zigzag.size), dtype=numpy.uint8)
+    planes[0] = pairs[0::2]
+    planes[1] = pairs[1::2]
+    payload = zlib.compress(planes, ZLIB_LEVEL)
+
+    return HEADER.pack(MAGIC, raw.shape[0], width, len(payload)) + payload
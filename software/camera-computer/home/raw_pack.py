@@ -0,0 +1,34 @@
+import numpy
+
+# Compact raw frame format, "*.srggb12p".
+#
+# libcamera hands c.py SRGGB16 frames: 3040 rows of 4064 uint16 samples, the
+# 12-bit sensor values left-aligned, and the last 8 samples of each row a
+# black strip. The packed format drops the strip and the 4 unused bits: each
+# row is 4056 samples, two samples to three bytes, most significant bits
+# first (the TIFF/DNG bit order). That is 18.5 MB per frame instead of 24.7.
+#
+# lib/raw.py in post-processing reads these files back.
+
+SENSOR_WIDTH = 4056
+SENSOR_HEIGHT = 3040
+
+def packed_shape(height: int = SENSOR_HEIGHT, width: int = SENSOR_WIDTH) -> tuple[int, int]:
+    return height, width // 2 * 3
+
+def pack12(raw: numpy.ndarray, out: numpy.ndarray | None = None, width: int = SENSOR_WIDTH) -> numpy.ndarray:
+    # `raw` is a (height, stride) uint16 SRGGB16 frame; returns the packed
+    # (height, width // 2 * 3) uint8 frame. Pass `out` to reuse a buffer from
+    # frame to frame.
+    height = raw.shape[0]
+    if out is None:
+        out = numpy.empty(packed_shape(height, width), dtype=numpy.uint8)
+
+    even = raw[:, 0:width:2] >> 4
+    odd = raw[:, 1:width:2] >> 4
+
+    out[:, 0::3] = even >> 4
+    out[:, 1::3] = ((even & 0x0F) << 4) | (odd >> 8)
+    out[:, 2::3] = odd & 0xFF
+
+    return out
@@ -0,0 +1,108 @@
+import errno
+import os
+import struct
+import threading
+
+# Segment files: many frames of one camera in one large, preallocated file.
+#
+# Creating two new files per frame fragments the SD card over a flight, and
+# write speed drops unless the card is cleaned and filled beforehand (see
+# bin/capture-clean). A segment is allocated up front in one piece, and
+# frames are appended with large sequential writes, each starting on a
+# SEGMENT_ALIGN boundary.
+#
+# Layout of "<ts>_c<cam>.seg", named after its first frame:
+#
+#   offset 0        file header, SEGMENT_ALIGN bytes
+#   per frame       record header: RECORD, then the metadata JSON, padded to
+#                   SEGMENT_ALIGN; then the frame data, padded likewise
+#
+# The record header holds the frame's file name base (what c.py would have
+# named its files, e.g. "1755721200.000_c0"), the raw format, and the offset
+# and size of the data. The unused, preallocated tail of a segment reads as
+# zeros, so a reader stops at the first record without a valid header, or one
+# whose data would run past the end of the file. lib/segment.py in
+# post-processing reads segments.
+#
+# Frame data is written before its header, but without a sync in between, so
+# nothing orders the two on the card. After a power cut, the last records'
+# headers may be valid while their data is still zeros; a clean stop (close())
+# leaves every record complete.
+
+SEGMENT_ALIGN = 4096
+SEGMENT_MAGIC = b"GDSEGMNT"
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct("<8sII")             # magic, version, alignment
+
+RECORD_MAGIC = b"GDFRAME\x00"
+RECORD = struct.Struct("<8s32s16sQQI")              # magic, name, format, data offset, data size, metadata size
+
+def _align(n: int) -> int:
+    return (n + SEGMENT_ALIGN - 1) // SEGMENT_ALIGN * SEGMENT_ALIGN
+
+class SegmentWriter:
+    # Appends frames of one camera to segments of `size` bytes in
+    # `output_dir`, starting a new segment when a frame doesn't fit. A frame
+    # too large for an empty segment is refused with EFBIG, which FrameWriter
+    # counts as a failed write, rather than given a segment of its own. Safe
+    # to call from several writer threads; writes are serialized.
+    def __init__(self, output_dir: str, size: int):
+        self._output_dir = output_dir
+        self._size = size
+        self._lock = threading.Lock()
+        self._fd = None
+        self._path = None
+        self._end = 0
+
+    @property
+    def path(self) -> str | None:
+        return self._path
+
+    def append(self, name: str, format: str, data, metadata_text: str):
+        # `data` is any buffer, e.g. a numpy array.
+        data = memoryview(data).cast("B")
+        metadata = metadata_text.encode("utf-8")
+        header_size = _align(RECORD.size + len(metadata))
+        if SEGMENT_ALIGN + header_size + _align(len(data)) > self._size:
+            raise OSError(errno.EFBIG, f"{len(data)} byte frame does not fit a {self._size} byte segment")
+
+        with self._lock:
+            if self._fd is None or self._end + header_size + _align(len(data)) > self._size:
+                self._open(name)
+
+            record_offset = self._end
+            data_offset = record_offset + header_size
+            header = bytearray(header_size)
+            RECORD.pack_into(header, 0, RECORD_MAGIC, name.encode("ascii"), format.encode("ascii"),
+                             data_offset, len(data), len(metadata))
+            header[RECORD.size:RECORD.size + len(metadata)] = metadata
+
+            os.pwrite(self._fd, data, data_offset)
+            os.pwrite(self._fd, header, record_offset)
+            self._end = _align(data_offset + len(data))
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _open(self, name: str):
+        self._close()
+        self._path = os.path.join(self._output_dir, name + ".seg")
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.posix_fallocate(self._fd, 0, self._size)
+        except OSError as e:
+            print(f"{self._path}: unable to preallocate: {e}")
+
+        header = bytearray(SEGMENT_ALIGN)
+        SEGMENT_HEADER.pack_into(header, 0, SEGMENT_MAGIC, SEGMENT_VERSION, SEGMENT_ALIGN)
+        os.pwrite(self._fd, header, 0)
+        self._end = SEGMENT_ALIGN
+
+    def _close(self):
+        if self._fd is None:
+            return
+        # Give back the unused preallocated tail.
+        os.ftruncate(self._fd, self._end)
+        os.close(self._fd)
+        self._fd = None
@@ -0,0 +1,119 @@
+import mmap
+import os
+import struct
+import time
+
+# Heartbeat and counters of each capture process, for led_monitor.py.
+#
+# Each producer (c.py, usb_rx.py, mavlink_record.py) owns one small record in
+# tmpfs, "/dev/shm/drone-<stream>.status", mapped into memory and rewritten
+# in place. Nothing touches the SD card, and led_monitor.py reads a fixed
+# number of bytes per stream however many files a flight has written.
+#
+#   RECORD  magic, version, sequence, pid, start time, heartbeat time,
+#           items, bytes, errors
+#
+# The sequence number is odd while the record is being rewritten, so a
+# reader that sees an odd or changed sequence number reads again.
+
+STATUS_DIR = "/dev/shm"
+MAGIC = b"GDST"
+VERSION = 1
+RECORD = struct.Struct("<4sHHIddQQQ")
+SEQUENCE = struct.Struct("<H")
+SEQUENCE_OFFSET = 6
+
+# Publishing is skipped if the record was rewritten more recently than this,
+# so producers can call publish() on every item.
+PUBLISH_INTERVAL = 0.25
+
+def status_path(stream: str) -> str:
+    return os.path.join(STATUS_DIR, f"drone-{stream}.status")
+
+class StatusWriter:
+    # Producers count into `items` (frames, transfers, messages), `bytes`
+    # and `errors`, then call publish().
+    def __init__(self, stream: str):
+        fd = os.open(status_path(stream), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, RECORD.size)
+            self._map = mmap.mmap(fd, RECORD.size)
+        finally:
+            os.close(fd)
+        self._sequence = 0
+        self._started = time.time()
+        self._published = None
+        self.items = 0
+        self.bytes = 0
+        self.errors = 0
+        self.publish(force=True)
+
+    def publish(self, force: bool = False):
+        now = time.monotonic()
+        if not force and self._published is not None and now - self._published < PUBLISH_INTERVAL:
+            return
+        self._published = now
+        writing = (self._sequence + 1) & 0xffff
+        SEQUENCE.pack_into(self._map, SEQUENCE_OFFSET, writing)
+        RECORD.pack_into(self._map, 0, MAGIC, VERSION, writing, os.getpid(), self._started, time.time(),
+                         self.items, self.bytes, self.errors)
+        self._sequence = (self._sequence + 2) & 0xffff
+        SEQUENCE.pack_into(self._map, SEQUENCE_OFFSET, self._sequence)
+
+    def close(self):
+        self.publish(force=True)
+        self._map.close()
+
+class Status:
+    def __init__(self, pid: int, started: float, heartbeat: float, items: int, bytes: int, errors: int):
+        self._pid = pid
+        self._started = started
+        self._heartbeat = heartbeat
+        self._items = items
+        self._bytes = bytes
+        self._errors = errors
+
+    @property
+    def pid(self) -> int:
+        return self._pid
+
+    @property
+    def started(self) -> float:
+        return self._started
+
+    @property
+    def heartbeat(self) -> float:
+        # Wall clock time of the last publish().
+        return self._heartbeat
+
+    @property
+    def items(self) -> int:
+        return self._items
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    @property
+    def errors(self) -> int:
+        return self._errors
+
+def read_status(stream: str) -> Status | None:
+    # None if the stream has never run since boot, or its record can't be
+    # read consistently.
+    try:
+        with open(status_path(stream), "rb", buffering=0) as f:
+            for _ in range(10):
+                f.seek(0)
+                data = f.read(RECORD.size)
+                if len(data) < RECORD.size:
+                    return None
+                magic, version, sequence, pid, started, heartbeat, items, bytes, errors = RECORD.unpack(data)
+                if magic != MAGIC or version != VERSION:
+                    return None
+                f.seek(SEQUENCE_OFFSET)
+                if sequence % 2 == 0 and SEQUENCE.unpack(f.read(SEQUENCE.size))[0] == sequence:
+                    return Status(pid, started, heartbeat, items, bytes, errors)
+    except FileNotFoundError:
+        pass
+    return None
@@ -0,0 +1,102 @@
+import threading
+import time
+
+# Writes a byte stream to a file off the thread that receives it.
+#
+# Used by usb_rx.py, whose libusb callbacks must return quickly: a callback
+# that waits on the SD card holds up handleEvents(), and with it every other
+# transfer, so the device's data backs up. write() only copies the data into
+# one of two preallocated buffers. A writer thread takes the other buffer
+# when the first fills, or every FLUSH_INTERVAL, and writes it to the file.
+#
+# If the writer is still busy with one buffer when the other fills, the data
+# is dropped and counted as an overrun; write() never waits.
+
+BUFFER_SIZE = 1 << 20
+FLUSH_INTERVAL = 1.0
+
+class StreamWriter:
+    def __init__(self, file, buffer_size: int = BUFFER_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self._file = file
+        self._buffers = [bytearray(buffer_size), bytearray(buffer_size)]
+        self._flush_interval = flush_interval
+        self._active = 0            # buffer write() copies into
+        self._fill = 0
+        self._pending = None        # (buffer, length) handed to the writer thread
+        self._stop = False
+        self._condition = threading.Condition()
+
+        self.bytes_written = 0
+        self.bytes_dropped = 0
+        self.overruns = 0
+        self.errors = 0
+        self.write_max = 0.0
+
+        self._thread = threading.Thread(target=self._writer_thread, name="stream-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, data) -> bool:
+        # False if the data was dropped.
+        length = len(data)
+        with self._condition:
+            if self._fill + length > len(self._buffers[self._active]):
+                if self._pending is not None or length > len(self._buffers[self._active]):
+                    self.overruns += 1
+                    self.bytes_dropped += length
+                    return False
+                self._swap()
+            self._buffers[self._active][self._fill:self._fill + length] = data
+            self._fill += length
+        return True
+
+    def close(self):
+        # Writes out what is buffered, and stops the writer thread; the file
+        # is left open.
+        with self._condition:
+            self._stop = True
+            self._condition.notify()
+        self._thread.join()
+
+    def summary(self) -> str:
+        return (f"written {self.bytes_written / 1e6:.1f} MB, write max {self.write_max * 1e3:.0f} ms,"
+                f" overruns {self.overruns} ({self.bytes_dropped} bytes), errors {self.errors}")
+
+    def _swap(self):
+        # Hands the active buffer to the writer thread; the caller holds the
+        # lock and has checked that the writer is free.
+        self._pending = (self._buffers[self._active], self._fill)
+        self._active ^= 1
+        self._fill = 0
+        self._condition.notify()
+
+    def _writer_thread(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or self._stop, timeout=self._flush_interval)
+                if self._pending is None:
+                    if self._fill:
+                        self._swap()
+                    elif self._stop:
+                        return
+                    else:
+                        continue
+                buffer, length = self._pending
+
+            start = time.monotonic()
+            try:
+                self._file.write(memoryview(buffer)[:length])
+                self._file.flush()
+                failed = False
+            except OSError as e:
+                print(f"{self._file.name}: {e}")
+                failed = True
+            elapsed = time.monotonic() - start
+
+            with self._condition:
+                self._pending = None
+                if failed:
+                    self.errors += 1
+                    self.bytes_dropped += length
+                else:
+                    self.bytes_written += length
+                self.write_max = max(self.write_max, elapsed)
@@ -1,17 +1,37 @@
 #!/usr/bin/env python3
 
+import sys
 import time
 import usb1
 import asyncio
 import struct
 import os.path
 
+from status import StatusWriter
+from stream_writer import StreamWriter
+
+# The data logger sends 64-byte bulk packets (full speed). A transfer of
+# several packets completes when its buffer is full or on a short packet, so
+# larger transfers mean fewer callbacks for the same data. The callbacks only
+# resubmit the transfer and copy the data into a StreamWriter, which writes
+# the file from its own thread.
+#
+# The current firmware's records carry no timestamps, so each transfer also
+# appends a TIMES record to "<ts>_sensors.times": the Pi wall clock when the
+# callback ran, and the length of "<ts>_sensors.dat" with the transfer's data.
+# lib/sensors.py in post-processing fits the sample rate to these, and finds
+# gaps where data was lost.
+
 VENDOR_ID = 0xc0de
 PRODUCT_ID = 0xcafe
 INTERFACE = 0
 ENDPOINT = 1
+PACKET_SIZE = 64
 TRANSFER_COUNT = 32
-BUFFER_SIZE = 64
+TRANSFER_SIZE = 16 * PACKET_SIZE
+STATS_INTERVAL = 10.0
+TIMES = struct.Struct("<dQ")        # Pi wall clock, s; bytes received so far
+TIMES_BUFFER_SIZE = 1 << 16
 
 import platform
 pc = 'x86' in platform.platform()
@@ -27,17 +47,47 @@ if not pc:
     sync_line.request(consumer="SYNC", type=gpiod.LINE_REQ_DIR_OUT, flags=gpiod.LINE_REQ_FLAG_ACTIVE_LOW | gpiod.LINE_REQ_FLAG_OPEN_DRAIN | gpiod.LINE_REQ_FLAG_BIAS_DISABLE)
     sync_line.set_value(0)  # Inactive, or 3.3 V
 
-f = None
+class ReceiveStats:
+    def __init__(self):
+        self.transfers = 0
+        self.callback_max = 0.0
+        self.callback_total = 0.0
+
+    def summary(self) -> str:
+        mean = self.callback_total / self.transfers if self.transfers else 0.0
+        return f"{self.transfers} transfers, callback mean {mean * 1e6:.0f} us, max {self.callback_max * 1e6:.0f} us"
+
+writer = None
+times_writer = None
+received = 0
+status = StatusWriter("sensors")
+stats = ReceiveStats()
 
 def received_data_callback(transfer):
+    global received
+    start = time.monotonic()
     if transfer.getStatus() != usb1.TRANSFER_COMPLETED:
+        status.errors += 1
+        status.publish()
         return
 
     data = transfer.getBuffer()[:transfer.getActualLength()]
     transfer.submit()
 
-    if f is not None:
-        f.write(data)
+    if writer is not None:
+        if writer.write(data):
+            received += len(data)
+            times_writer.write(TIMES.pack(time.time(), received))
+            status.items += 1
+            status.bytes += len(data)
+        else:
+            status.errors += 1
+        status.publish()
+
+    elapsed = time.monotonic() - start
+    stats.transfers += 1
+    stats.callback_total += elapsed
+    stats.callback_max = max(stats.callback_max, elapsed)
 
 with usb1.USBContext() as context:
     handle = context.openByVendorIDAndProductID(
@@ -59,12 +109,15 @@ with usb1.USBContext() as context:
         path_out = "/tmp" if pc else "/home/drone/out"
         filename_out = os.path.join(path_out, f"{start_time:.3f}_sensors.dat")
         f = open(filename_out, 'wb')
+        f_times = open(os.path.join(path_out, f"{start_time:.3f}_sensors.times"), 'wb')
+        times_writer = StreamWriter(f_times, TIMES_BUFFER_SIZE)
+        writer = StreamWriter(f)
 
         for i in range(TRANSFER_COUNT):
             transfer = handle.getTransfer()
             transfer.setBulk(
                 usb1.ENDPOINT_IN | ENDPOINT,
-                BUFFER_SIZE,
+                TRANSFER_SIZE,
                 callback=received_data_callback,
             )
             transfer.submit()
@@ -74,9 +127,13 @@ with usb1.USBContext() as context:
         handle.controlWrite(usb1.REQUEST_TYPE_VENDOR | usb1.RECIPIENT_INTERFACE, 0, 1, 0, [])
 
         try:
+            stats_time = time.monotonic()
             while any(x.isSubmitted() for x in transfer_list):
+                if time.monotonic() - stats_time >= STATS_INTERVAL:
+                    print(f"{stats.summary()}; {writer.summary()}")
+                    stats_time = time.monotonic()
                 try:
-                    context.handleEvents()
+                    context.handleEventsTimeout(1)
                 except KeyboardInterrupt:
                     break
                 except:
@@ -90,5 +147,13 @@ with usb1.USBContext() as context:
 
     handle.close()
 
+    writer.close()
+    f.close()
+    times_writer.close()
+    f_times.close()
+    print(f"{stats.summary()}; {writer.summary()}")
+
     if sync_line is not None:
         sync_line.set_value(0)  # Inctive, or 3.3 V
+
+status.close()
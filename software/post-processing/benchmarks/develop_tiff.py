@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+# Throughput of the raw -> 16-bit TIFF stage (lib/develop.py, lib/tiff.py), in
+# frames per second on one core. Runs in a single process, so multiply by the
+# number of --workers to estimate log_extract.py --tif.
+#
+# Usage, from the post-processing directory:
+#   python -m benchmarks.develop_tiff [raw_file metadata_file] [--frames N]
+#
+# Without a raw file, a synthetic IMX477 frame is used.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.develop import DevelopParams, develop_bands
+from lib.raw import IMX477_HEIGHT, IMX477_STRIDE, IMX477_WIDTH, imx477_raw_read
+from lib.tiff import write_tiff
+
+SYNTHETIC_METADATA = {
+    "SensorBlackLevels": [4096, 4096, 4096, 4096],
+    "ColourGains": [2.0, 1.5],
+    "ColourCorrectionMatrix": [1.5, -0.3, -0.2, -0.2, 1.4, -0.2, 0.0, -0.5, 1.5],
+}
+
+def synthetic_frame() -> numpy.ndarray:
+    rng = numpy.random.default_rng(0)
+    data = rng.integers(4096, 65520, size=(IMX477_HEIGHT, IMX477_WIDTH), dtype=numpy.uint16)
+    return data & 0xFFF0
+
+def main():
+    parser = argparse.ArgumentParser(description="raw -> TIFF throughput")
+    parser.add_argument("raw_file", nargs="?")
+    parser.add_argument("metadata_file", nargs="?")
+    parser.add_argument("--frames", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.raw_file:
+        data = numpy.array(imx477_raw_read(args.raw_file, (IMX477_STRIDE, IMX477_HEIGHT)))
+        with open(args.metadata_file, "r") as f:
+            metadata = json.load(f)
+    else:
+        data = synthetic_frame()
+        metadata = SYNTHETIC_METADATA
+    params = DevelopParams.from_metadata(metadata, "SRGGB12")
+    height, width = data.shape
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "frame.tif")
+        for method in ("bilinear", "malvar"):
+            start = time.perf_counter()
+            for _ in range(args.frames):
+                for _band in develop_bands(data, params, method):
+                    pass
+            develop = (time.perf_counter() - start) / args.frames
+
+            start = time.perf_counter()
+            for _ in range(args.frames):
+                write_tiff(path, width, height, develop_bands(data, params, method))
+            total = (time.perf_counter() - start) / args.frames
+
+            print(f"{method:8s}  develop {develop * 1e3:7.1f} ms  develop+write {total * 1e3:7.1f} ms"
+                  f"  {1 / total:5.2f} frames/s/core  {os.path.getsize(path) / 1e6:.1f} MB/frame")
+
+if __name__ == "__main__":
+    main()
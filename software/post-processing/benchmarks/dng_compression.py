@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Size and speed of compressed (LJ92 tiles) vs uncompressed (12-bit strips)
+# DNG output from lib/dng.py: bytes per frame, encode time (write_dng, to a
+# temporary file) and decode time (read_dng_data), per frame. Compressed
+# encoding is timed on one thread and on --threads threads.
+#
+# Usage, from the post-processing directory:
+#   python -m benchmarks.dng_compression [raw_file metadata_file] [--frames N] [--threads N]
+#
+# Without a raw file, a synthetic IMX477 frame is used: a smooth scene plus
+# sensor noise. Compression depends on the scene, so prefer a real frame.
+
+import argparse
+from datetime import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.dng import read_dng_data, write_dng
+from lib.raw import IMX477_HEIGHT, IMX477_STRIDE, IMX477_WIDTH, imx477_raw_read
+
+SYNTHETIC_METADATA = {
+    "SensorTimestamp": 0,
+    "SensorBlackLevels": [4096, 4096, 4096, 4096],
+    "ColourGains": [2.0, 1.5],
+    "ColourCorrectionMatrix": [1.5, -0.3, -0.2, -0.2, 1.4, -0.2, 0.0, -0.5, 1.5],
+}
+
+class _Metadata:
+    # Stands in for lib.path.MetadataFile.
+    def __init__(self, data: dict):
+        self.data = data
+
+def synthetic_frame() -> numpy.ndarray:
+    rng = numpy.random.default_rng(0)
+    y, x = numpy.mgrid[0:IMX477_HEIGHT, 0:IMX477_WIDTH].astype(numpy.float32)
+    scene = 1800 + 1000 * numpy.sin(x / 97) * numpy.cos(y / 61) + 600 * numpy.sin((x + y) / 23)
+    scene[0::2, 0::2] *= 0.6
+    scene[1::2, 1::2] *= 0.8
+    scene += 256 + rng.normal(0, 1, scene.shape) * numpy.sqrt(scene)
+    return numpy.clip(scene, 0, 4095).astype(numpy.uint16) << 4
+
+def main():
+    parser = argparse.ArgumentParser(description="compressed vs uncompressed DNG")
+    parser.add_argument("raw_file", nargs="?")
+    parser.add_argument("metadata_file", nargs="?")
+    parser.add_argument("--frames", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    if args.raw_file:
+        data = numpy.array(imx477_raw_read(args.raw_file, (IMX477_STRIDE, IMX477_HEIGHT)))
+        with open(args.metadata_file, "r") as f:
+            metadata = _Metadata(json.load(f))
+    else:
+        data = synthetic_frame()
+        metadata = _Metadata(SYNTHETIC_METADATA)
+    ts = datetime.now()
+
+    modes = [("strips", False, 1), ("lj92", True, 1)]
+    if args.threads > 1:
+        modes.append((f"lj92 x{args.threads}", True, args.threads))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "frame.dng")
+        for name, compress, threads in modes:
+            start = time.perf_counter()
+            for _ in range(args.frames):
+                write_dng(ts, 0, data, "SRGGB12", path, metadata, compress=compress, threads=threads)
+            encode = (time.perf_counter() - start) / args.frames
+
+            start = time.perf_counter()
+            for _ in range(args.frames):
+                decoded = read_dng_data(path)
+            decode = (time.perf_counter() - start) / args.frames
+
+            if not numpy.array_equal(decoded, data >> 4):
+                print(f"{name}: decoded image differs from the raw frame")
+            size = os.path.getsize(path)
+            print(f"{name:10s}  {size / 1e6:6.1f} MB/frame ({size / (data.size * 2):4.0%} of raw)"
+                  f"  encode {encode * 1e3:7.1f} ms  decode {decode * 1e3:7.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# Throughput of the 12-bit raw packing kernels: pack12() from camera-computer
+# home/raw_pack.py, which c.py runs on the Raspberry Pi for every frame, and
+# lib.raw.unpack12(), which post-processing runs on every packed frame.
+#
+# Frames are split into row bands packed on 1 to --threads threads, to show
+# how far the kernels scale on a 4-core Pi. The "budget" column is the share
+# of those cores that packing takes at --fps frames per second from each of
+# --cameras cameras (two cameras on drone-1).
+#
+# Usage, from the post-processing directory (also works on the Pi, with the
+# repository checked out there):
+#   python -m benchmarks.raw_pack [--frames N] [--threads N] [--fps F] [--cameras N]
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "camera-computer", "home"))
+
+import raw_pack
+from lib.raw import IMX477_HEIGHT, IMX477_STRIDE, unpack12
+
+BUDGET_CORES = 4
+
+def _banded(executor: ThreadPoolExecutor | None, threads: int, kernel, src: numpy.ndarray, dst: numpy.ndarray):
+    # Run kernel(src band, dst band) over `threads` equal row bands.
+    if executor is None:
+        kernel(src, dst)
+        return
+    step = (src.shape[0] + threads - 1) // threads
+    step += step % 2
+    bands = [(src[row:row + step], dst[row:row + step]) for row in range(0, src.shape[0], step)]
+    list(executor.map(lambda band: kernel(*band), bands))
+
+def main():
+    parser = argparse.ArgumentParser(description="12-bit raw pack/unpack throughput")
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=BUDGET_CORES)
+    parser.add_argument("--fps", type=float, default=1.0)
+    parser.add_argument("--cameras", type=int, default=2)
+    args = parser.parse_args()
+
+    rng = numpy.random.default_rng(0)
+    raw = rng.integers(0, 4096, size=(IMX477_HEIGHT, IMX477_STRIDE), dtype=numpy.uint16) << 4
+    packed = numpy.empty(raw_pack.packed_shape(), dtype=numpy.uint8)
+    unpacked = numpy.empty((IMX477_HEIGHT, raw_pack.SENSOR_WIDTH), dtype=numpy.uint16)
+
+    kernels = {
+        "pack": (lambda src, dst: raw_pack.pack12(src, dst), raw, packed),
+        "unpack": (lambda src, dst: unpack12(src, 4, dst), packed, unpacked),
+    }
+    frame_mb = raw.nbytes / 1e6
+
+    for threads in sorted({1, *range(2, args.threads + 1)}):
+        executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        for name, (kernel, src, dst) in kernels.items():
+            start = time.perf_counter()
+            for _ in range(args.frames):
+                _banded(executor, threads, kernel, src, dst)
+            per_frame = (time.perf_counter() - start) / args.frames
+            budget = per_frame * threads * args.fps * args.cameras / BUDGET_CORES
+            print(f"{name:6s} x{threads}  {per_frame * 1e3:7.1f} ms/frame  {frame_mb / per_frame:7.0f} MB/s"
+                  f"  budget {budget:5.1%} of {BUDGET_CORES} cores")
+        if executor is not None:
+            executor.shutdown()
+
+    if not numpy.array_equal(unpacked, raw[:, :raw_pack.SENSOR_WIDTH]):
+        print("unpacked frame differs from the raw frame")
+    print(f"packed {packed.nbytes / 1e6:.1f} MB/frame, {packed.nbytes / raw.nbytes:.0%} of SRGGB16")
+
+if __name__ == "__main__":
+    main()
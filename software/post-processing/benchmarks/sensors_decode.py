@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Decode time of lib.sensors.read_sensors() for a synthetic flight of
+# --minutes minutes, in both layouts the data logger firmware has sent: raw
+# ICM-20948 FIFO records, with usb_rx.py's .times file, and tagged records
+# with BMP390 pressure and SYNC edges mixed in. Each file ends with a record
+# cut short, as when usb_rx.py is stopped mid-packet. The FIFO file also loses
+# a few bytes once, as on a FIFO overflow, so it is realigned.
+#
+# Usage, from the post-processing directory:
+#   python -m benchmarks.sensors_decode [--minutes N] [--repeat N]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.sensors import ACCEL_SCALE, FIFO_RATE, GYRO_SCALE, TAG_PAYLOAD_LENGTHS, TIMES_DTYPE, read_sensors
+
+PRESSURE_RATE = 50.0
+SYNC_RATE = 1.0
+
+TRANSFER_SIZE = 1024
+OVERFLOW_LOST = 3000 * 12 + 5       # bytes
+
+def fifo_stream(rng: numpy.random.Generator, count: int, path: str) -> bytes:
+    # Samples of a vibrating, slowly turning IMU; writes the .times file
+    # next to `path`.
+    accel = rng.normal([0.1, -0.1, 1.0], 0.3, size=(count, 3)) / ACCEL_SCALE
+    gyro = rng.normal(0.0, 0.5, size=(count, 3)) / GYRO_SCALE
+    stream = numpy.round(numpy.hstack([accel, gyro])).astype(">i2").tobytes()
+    lost_at = len(stream) // 3 // 12 * 12
+    stream = stream[:lost_at] + stream[lost_at + OVERFLOW_LOST:] + b"\x01\x02\x03"
+
+    ends = numpy.arange(TRANSFER_SIZE, len(stream) + 1, TRANSFER_SIZE)
+    sent = numpy.where(ends <= lost_at, ends, ends + OVERFLOW_LOST)
+    times = numpy.zeros(len(ends), dtype=TIMES_DTYPE)
+    times["ts"] = 1755721000.1 + sent / 12 / FIFO_RATE + rng.exponential(0.002, len(ends))
+    times["bytes"] = ends
+    times.tofile(path.replace(".dat", ".times"))
+    return stream
+
+def tagged_stream(rng: numpy.random.Generator, count: int, path: str) -> bytes:
+    # IMU records at FIFO_RATE, with pressure records and SYNC edges between.
+    seconds = count / FIFO_RATE
+    tags = numpy.full(count, ord("I"), dtype=numpy.uint8)
+    times = numpy.arange(count) / FIFO_RATE
+    extra_times = numpy.concatenate([numpy.arange(0.0, seconds, 1.0 / PRESSURE_RATE),
+                                     numpy.arange(0.0, seconds, 1.0 / SYNC_RATE)])
+    extra_tags = numpy.concatenate([numpy.full(int(numpy.ceil(seconds * PRESSURE_RATE)), ord("P")),
+                                    numpy.where(numpy.arange(int(numpy.ceil(seconds * SYNC_RATE))) % 2, ord("1"), ord("0"))])
+    times = numpy.concatenate([times, extra_times[:len(extra_tags)]])
+    tags = numpy.concatenate([tags, extra_tags[:len(extra_times)].astype(numpy.uint8)])
+    order = numpy.argsort(times, kind="stable")
+    times = times[order]
+    tags = tags[order]
+
+    # Pressure payloads are plausible floats; random bytes would include NaNs.
+    pressure = numpy.column_stack([rng.normal(101325.0, 10.0, len(tags)),
+                                   rng.normal(20.0, 0.1, len(tags))]).astype(">f4")
+    chunks = []
+    ticks = (numpy.round(times * 1e6).astype(numpy.int64) & 0xFFFFFF).astype(">u4").view(numpy.uint8).reshape(-1, 4)
+    for i in range(len(tags)):
+        tag = bytes([tags[i]])
+        payload = pressure[i].tobytes() if tag == b"P" else rng.bytes(TAG_PAYLOAD_LENGTHS[tag])
+        chunks.append(tag + ticks[i, 1:].tobytes() + payload)
+    return b"".join(chunks) + b"I\x00\x01"
+
+def main():
+    parser = argparse.ArgumentParser(description="sensors.dat decode time")
+    parser.add_argument("--minutes", type=float, default=20.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = numpy.random.default_rng(0)
+    count = int(args.minutes * 60 * FIFO_RATE)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for format, stream in (("fifo", fifo_stream), ("tagged", tagged_stream)):
+            path = os.path.join(directory, "1755721000.000_sensors.dat")
+            with open(path, "wb") as f:
+                f.write(stream(rng, count, path))
+            size = os.path.getsize(path)
+
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                columns = read_sensors(path)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{format:6s} {size / 1e6:6.1f} MB  {len(columns['imu_ts']):8d} IMU  {int(columns['imu_gap'].sum()):2d} gaps"
+                  f"  {len(columns['pressure_ts']):6d} pressure"
+                  f"  {len(columns['sync_ts']):5d} sync  {best:.3f} s  {size / best / 1e6:6.0f} MB/s")
+
+if __name__ == "__main__":
+    main()
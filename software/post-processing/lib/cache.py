@@ -0,0 +1,79 @@
+import hashlib
+import os
+import os.path
+
+import numpy
+
+# Sidecar cache of named numpy columns derived from one source file, e.g. the
+# parsed contents of a flight computer log, stored next to it as "<source>.npz".
+#
+# The cache records the source file's size, mtime and content hash, plus a
+# caller-supplied tag describing how the columns were derived. On load, an
+# unchanged size and mtime is trusted as-is, so a warm start costs a stat() and
+# an .npz read. If only the mtime moved (copied or touched file), the content
+# hash decides, and a match is saved with the new mtime, so only that one load
+# hashes the file. A different tag always forces a rebuild.
+
+HASH_CHUNK_SIZE = 1 << 20
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def cache_path_for(source_path: str) -> str:
+    return source_path + ".npz"
+
+def columns_load(source_path: str, tag: str, cache_path: str | None = None) -> dict[str, numpy.ndarray] | None:
+    if cache_path is None:
+        cache_path = cache_path_for(source_path)
+
+    try:
+        stat = os.stat(source_path)
+        with numpy.load(cache_path, allow_pickle=False) as npz:
+            columns = {name: npz[name] for name in npz.files}
+    except (OSError, ValueError):
+        return None
+
+    key = columns.pop("__key__", None)
+    if key is None:
+        return None
+    cached_tag, cached_size, cached_mtime_ns, cached_hash = key.tolist()
+
+    if cached_tag != tag or int(cached_size) != stat.st_size:
+        return None
+    if int(cached_mtime_ns) != stat.st_mtime_ns:
+        try:
+            if cached_hash != file_hash(source_path):
+                return None
+        except OSError:
+            return None
+        _write(cache_path, numpy.array([tag, str(stat.st_size), str(stat.st_mtime_ns), cached_hash]), columns)
+
+    return columns
+
+def columns_save(source_path: str, tag: str, columns: dict[str, numpy.ndarray], cache_path: str | None = None):
+    if cache_path is None:
+        cache_path = cache_path_for(source_path)
+
+    stat = os.stat(source_path)
+    key = numpy.array([tag, str(stat.st_size), str(stat.st_mtime_ns), file_hash(source_path)])
+    _write(cache_path, key, columns)
+
+def _write(cache_path: str, key: numpy.ndarray, columns: dict[str, numpy.ndarray]):
+    # Write to a temporary file and rename, so an interrupted run never leaves
+    # a truncated cache behind.
+    path_tmp = cache_path + ".tmp"
+    try:
+        with open(path_tmp, "wb") as f:
+            numpy.savez(f, __key__=key, **columns)
+        os.replace(path_tmp, cache_path)
+    except OSError as e:
+        print(f"{cache_path}: unable to write cache: {e}")
+        if os.path.exists(path_tmp):
+            os.remove(path_tmp)
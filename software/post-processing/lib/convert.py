@@ -0,0 +1,151 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import traceback
+
+from lib.develop import DevelopParams, develop_bands
+from lib.dng import write_dng
+from lib.exif import ImageTags
+from lib.path import MetadataFile, RawFile
+from lib.tiff import write_tiff
+
+# Frame conversion engine. The parent process decides *what* to convert (time
+# mapping, pose lookup, filtering, CSV rows); this module only does the heavy,
+# per-frame raw -> image work, fanned out over a process pool.
+
+class FrameJob:
+    def __init__(self, raw_file: RawFile, shape: tuple, format: str, out_path: str, dt: datetime, cam: int, metadata_file: MetadataFile,
+                 image_tags: ImageTags | None = None, demosaic: str = "bilinear", compress: bool = False, threads: int = 1):
+        self._raw_file = raw_file
+        self._shape = shape
+        self._format = format
+        self._out_path = out_path
+        self._dt = dt
+        self._cam = cam
+        self._metadata_file = metadata_file
+        self._image_tags = image_tags
+        self._demosaic = demosaic
+        self._compress = compress
+        self._threads = threads
+
+    @property
+    def raw_file(self) -> RawFile:
+        return self._raw_file
+
+    @property
+    def raw_path(self) -> str:
+        return self._raw_file.path
+
+    @property
+    def shape(self) -> tuple:
+        return self._shape
+
+    @property
+    def format(self) -> str:
+        return self._format
+
+    @property
+    def out_path(self) -> str:
+        return self._out_path
+
+    @property
+    def datetime(self) -> datetime:
+        return self._dt
+
+    @property
+    def cam(self) -> int:
+        return self._cam
+
+    @property
+    def metadata_file(self) -> MetadataFile:
+        return self._metadata_file
+
+    @property
+    def image_tags(self) -> ImageTags | None:
+        return self._image_tags
+
+    @property
+    def demosaic(self) -> str:
+        return self._demosaic
+
+    @property
+    def compress(self) -> bool:
+        return self._compress
+
+    @property
+    def threads(self) -> int:
+        return self._threads
+
+class FrameResult:
+    def __init__(self, index: int, job: FrameJob, error: str | None = None):
+        self._index = index
+        self._job = job
+        self._error = error
+
+    @property
+    def index(self) -> int:
+        return self._index
+
+    @property
+    def job(self) -> FrameJob:
+        return self._job
+
+    @property
+    def ok(self) -> bool:
+        return self._error is None
+
+    @property
+    def error(self) -> str | None:
+        return self._error
+
+def _convert_frame(index: int, job: FrameJob) -> FrameResult:
+    # Runs in a worker process. Never raises: a bad frame is reported back to
+    # the parent instead of tearing down the pool.
+    try:
+        data = job.raw_file.read(job.shape)
+        if job.out_path.endswith(".dng"):
+            write_dng(job.datetime, job.cam, data, job.format, job.out_path, job.metadata_file, job.image_tags,
+                      job.compress, job.threads)
+        else:
+            # Developed 16-bit RGB TIFF.
+            params = DevelopParams.from_metadata(job.metadata_file.data, job.format)
+            bands = develop_bands(data, params, job.demosaic)
+            write_tiff(job.out_path, data.shape[1], data.shape[0], bands, job.image_tags)
+    except Exception:
+        return FrameResult(index, job, traceback.format_exc())
+    return FrameResult(index, job)
+
+def convert_frames(jobs: list[FrameJob], workers: int, max_in_flight: int | None = None):
+    # Yields one FrameResult per job, in job order, regardless of the order in
+    # which the workers finish.
+    #
+    # At most `max_in_flight` jobs are submitted to the pool at any time. Each
+    # worker holds one frame, so memory is bounded by the number of workers,
+    # and the submission window keeps the result backlog bounded too.
+    if workers <= 1:
+        for index, job in enumerate(jobs):
+            yield _convert_frame(index, job)
+        return
+
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+    max_in_flight = max(max_in_flight, workers)
+
+    pending = deque()
+
+    def collect():
+        index, job, future = pending.popleft()
+        try:
+            return future.result()
+        except Exception:
+            # The worker itself died (e.g. killed by the OOM killer).
+            return FrameResult(index, job, traceback.format_exc())
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for index, job in enumerate(jobs):
+            pending.append((index, job, executor.submit(_convert_frame, index, job)))
+            if len(pending) >= max_in_flight:
+                yield collect()
+
+        while pending:
+            yield collect()
@@ -0,0 +1,309 @@
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Vectorized ArduPilot DataFlash (.bin) decoder.
+#
+# A DataFlash log is a stream of messages, each "A3 95 <type>" followed by a
+# fixed-length payload described by an FMT message. Rather than decoding every
+# message in Python, we:
+#
+# 1. find every "A3 95" header candidate in the file with numpy,
+# 2. read the FMT messages and build a numpy structured dtype per type,
+# 3. walk the chain of messages from the start of the file, in O(n log n)
+#    vectorized steps, which discards header lookalikes inside payloads,
+# 4. gather only the requested types into typed arrays.
+#
+# Timestamps follow pymavlink's DFReader for "TimeUS" logs: the first GPS
+# message with a valid week fixes the offset between TimeUS and UNIX time.
+
+HEADER_0 = 0xA3
+HEADER_1 = 0x95
+HEADER_LENGTH = 3
+
+FMT_TYPE = 0x80
+FMT_LENGTH = 89
+FMT_DTYPE = numpy.dtype([
+    ("header", "u1", (HEADER_LENGTH,)),
+    ("type", "u1"),
+    ("length", "u1"),
+    ("name", "S4"),
+    ("format", "S16"),
+    ("columns", "S64"),
+])
+
+# DataFlash format characters, as in pymavlink.DFReader.FORMAT_TO_STRUCT.
+FORMAT_TO_DTYPE = {
+    "a": ("<i2", (32,)),
+    "b": "i1",
+    "B": "u1",
+    "g": "<f2",
+    "h": "<i2",
+    "H": "<u2",
+    "i": "<i4",
+    "I": "<u4",
+    "f": "<f4",
+    "d": "<f8",
+    "n": "S4",
+    "N": "S16",
+    "Z": "S64",
+    "c": "<i2",
+    "C": "<u2",
+    "e": "<i4",
+    "E": "<u4",
+    "L": "<i4",
+    "M": "i1",
+    "q": "<i8",
+    "Q": "<u8",
+}
+
+FORMAT_TO_SCALE = {
+    "c": 0.01,
+    "C": 0.01,
+    "e": 0.01,
+    "E": 0.01,
+    "L": 1.0e-7,
+}
+
+# Header candidates are searched for in chunks, to keep the temporary boolean
+# arrays small on large logs.
+SCAN_CHUNK_SIZE = 1 << 24
+
+def gps_time_to_unix(week, msec):
+    # Same as pymavlink.DFReader.DFReaderClock._gpsTimeToTime().
+    epoch = 86400 * (10 * 365 + int((1980 - 1969) / 4) + 1 + 6 - 2)
+    return epoch + 86400 * 7 * week + msec * 0.001 - 18
+
+class MessageFormat:
+    def __init__(self, type: int, length: int, name: str, format: str, columns: list[str]):
+        self._type = type
+        self._length = length
+        self._name = name
+        self._format = format
+        self._columns = columns
+
+        names = []
+        formats = []
+        offsets = []
+        offset = HEADER_LENGTH
+        for column, c in zip(columns, format):
+            dtype = numpy.dtype(FORMAT_TO_DTYPE[c])
+            names.append(column)
+            formats.append(dtype)
+            offsets.append(offset)
+            offset += dtype.itemsize
+
+        self._dtype = numpy.dtype({
+            "names": names,
+            "formats": formats,
+            "offsets": offsets,
+            "itemsize": max(offset, length),
+        })
+        self._payload_length = offset
+
+    @property
+    def type(self) -> int:
+        return self._type
+
+    @property
+    def length(self) -> int:
+        return self._length
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def format(self) -> str:
+        return self._format
+
+    @property
+    def columns(self) -> list[str]:
+        return self._columns
+
+    @property
+    def dtype(self) -> numpy.dtype:
+        return self._dtype
+
+    @property
+    def is_consistent(self) -> bool:
+        return self._payload_length == self._length
+
+    def scale(self, column: str) -> float | None:
+        return FORMAT_TO_SCALE.get(self._format[self._columns.index(column)], None)
+
+def follow_chain(next_index: numpy.ndarray) -> numpy.ndarray:
+    # `next_index[i]` is the node following node i; node `len(next_index)` is
+    # the end. Returns a mask of the nodes reachable from node 0, using pointer
+    # doubling: after k rounds `reached` holds the first 2**k nodes of the chain.
+    n = len(next_index)
+    jump = numpy.append(next_index, n)
+    reached = numpy.zeros(n + 1, dtype=bool)
+    if n == 0:
+        return reached[:0]
+    reached[0] = True
+
+    while True:
+        step = numpy.zeros(n + 1, dtype=bool)
+        step[jump[reached]] = True
+        if not (step & ~reached).any():
+            break
+        reached |= step
+        jump = jump[jump]
+
+    return reached[:n]
+
+def _is_identifier(text: str) -> bool:
+    # Message and column names are letters, digits and underscores.
+    return text != "" and all(c.isascii() and (c.isalnum() or c == "_") for c in text)
+
+class DataFlashLog:
+    def __init__(self, log_path: str):
+        self._path = log_path
+        self._data = numpy.memmap(log_path, dtype=numpy.uint8, mode="r")
+
+        candidates = self._scan_headers()
+        self._formats = self._read_formats(candidates)
+        self._offsets, self._types = self._follow_messages(candidates)
+        self._timebase = self._find_timebase()
+
+    def _scan_headers(self) -> numpy.ndarray:
+        data = self._data
+        size = len(data)
+        found = []
+        for start in range(0, max(size - 1, 0), SCAN_CHUNK_SIZE):
+            chunk = data[start:start + SCAN_CHUNK_SIZE + 1]
+            found.append(numpy.flatnonzero((chunk[:-1] == HEADER_0) & (chunk[1:] == HEADER_1)) + start)
+        if not found:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return numpy.concatenate(found).astype(numpy.int64)
+
+    def _read_formats(self, candidates: numpy.ndarray) -> dict[int, MessageFormat]:
+        # A type may have several FMT records: lookalikes inside payloads,
+        # records mangled by a corrupt write, and the real one, possibly
+        # repeated. Only records that parse, whose length matches their format
+        # and whose name and columns are plain names count. Of those, a record
+        # followed by another header (or the end of the file) is preferred,
+        # then the definition given most often, then the last one, as
+        # pymavlink keeps the last FMT it reads.
+        data = self._data
+        offsets = candidates[candidates + FMT_LENGTH <= len(data)]
+        offsets = offsets[data[offsets + 2] == FMT_TYPE]
+
+        formats = {}
+        if len(offsets) == 0:
+            return formats
+
+        records = sliding_window_view(data, FMT_LENGTH)[offsets].copy().view(FMT_DTYPE).reshape(-1)
+        ends = offsets + FMT_LENGTH
+        followed = numpy.isin(ends, candidates) | (ends == len(data))
+
+        definitions = {}                # type -> {definition: [followed, count, last, MessageFormat]}
+        for index, record in enumerate(records):
+            try:
+                name = record["name"].decode("ascii")
+                format = record["format"].decode("ascii")
+                columns = record["columns"].decode("ascii").split(",")
+                message_format = MessageFormat(int(record["type"]), int(record["length"]), name, format, columns)
+            except (UnicodeDecodeError, KeyError, TypeError, ValueError):
+                # A header lookalike inside some other payload.
+                continue
+            if not (message_format.is_consistent and len(columns) == len(format)
+                    and all(_is_identifier(text) for text in [name] + columns)):
+                continue
+            key = (message_format.length, name, format, tuple(columns))
+            seen = definitions.setdefault(message_format.type, {}).setdefault(key, [False, 0, 0, message_format])
+            seen[0] |= bool(followed[index])
+            seen[1] += 1
+            seen[2] = index
+
+        for type, seen in definitions.items():
+            formats[type] = max(seen.values(), key=lambda s: s[:3])[3]
+        return formats
+
+    def _follow_messages(self, candidates: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+        data = self._data
+
+        lengths = numpy.zeros(256, dtype=numpy.int64)
+        for type, message_format in self._formats.items():
+            lengths[type] = message_format.length
+
+        # Keep candidates with a known type that fit inside the file.
+        candidates = candidates[candidates + HEADER_LENGTH <= len(data)]
+        types = data[candidates + 2]
+        ends = candidates + lengths[types]
+        keep = (lengths[types] > 0) & (ends <= len(data))
+        candidates = candidates[keep]
+        types = types[keep]
+        ends = ends[keep]
+
+        # Like pymavlink, after a message the reader continues at the next
+        # header at or after its end, skipping any bad bytes in between.
+        next_index = numpy.searchsorted(candidates, ends)
+        on_chain = follow_chain(next_index)
+
+        return candidates[on_chain], types[on_chain]
+
+    def _find_timebase(self) -> float:
+        gps = self.messages("GPS", ("TimeUS", "GWk", "GMS"))
+        if gps is None:
+            return 0.0
+        valid = numpy.flatnonzero(gps["GWk"] > 0)
+        if len(valid) == 0:
+            return 0.0
+        first = gps[valid[0]]
+        return gps_time_to_unix(int(first["GWk"]), int(first["GMS"])) - int(first["TimeUS"]) * 1.0e-6
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def formats(self) -> dict[str, MessageFormat]:
+        return {f.name: f for f in self._formats.values()}
+
+    @property
+    def timebase(self) -> float:
+        return self._timebase
+
+    @property
+    def type_counts(self) -> dict[str, int]:
+        counts = numpy.bincount(self._types, minlength=256)
+        return {f.name: int(counts[t]) for t, f in self._formats.items() if counts[t]}
+
+    def messages(self, name: str, columns: tuple[str, ...] | None = None) -> numpy.ndarray | None:
+        # All messages of one type, as a numpy structured array with the raw
+        # (unscaled) field values. Only the rows of this type are copied.
+        message_format = self.formats.get(name, None)
+        if message_format is None:
+            return None
+
+        offsets = self._offsets[self._types == message_format.type]
+        rows = sliding_window_view(self._data, message_format.length)[offsets]
+        records = rows.view(message_format.dtype).reshape(-1)
+
+        if columns is not None:
+            records = records[list(columns)]
+        return records
+
+    def columns(self, name: str, columns: tuple[str, ...]) -> dict[str, numpy.ndarray] | None:
+        # Selected fields of one message type as float64 columns, with the
+        # DataFlash multipliers applied, plus "ts" in seconds since the UNIX
+        # epoch, computed from TimeUS.
+        message_format = self.formats.get(name, None)
+        if message_format is None:
+            return None
+
+        records = self.messages(name, tuple(dict.fromkeys(("TimeUS",) + tuple(columns))))
+        result = {
+            "ts": self._timebase + records["TimeUS"].astype(numpy.float64) * 1.0e-6,
+        }
+        for column in columns:
+            values = records[column].astype(numpy.float64)
+            scale = message_format.scale(column)
+            if scale is not None:
+                values *= scale
+            result[column] = values
+        return result
+
+    def timestamps(self, time_us: numpy.ndarray) -> numpy.ndarray:
+        return self._timebase + time_us.astype(numpy.float64) * 1.0e-6
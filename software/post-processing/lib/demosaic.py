@@ -0,0 +1,118 @@
+import numpy
+
+# Vectorized Bayer demosaicing with numpy.
+#
+# Each output channel is computed only where it is missing, one CFA site at a
+# time: for site (y0, x0), a kernel is a list of (dy, dx, weight) taps, and its
+# response at every such site is a weighted sum of strided views of the padded
+# mosaic. Nothing is computed at sites where the answer is simply the sample.
+#
+# Two methods:
+# * "bilinear": average of the nearest samples of the missing colour.
+# * "malvar": Malvar, He & Cutler, "High-quality linear interpolation for
+#   demosaicing of Bayer-patterned color images" (ICASSP 2004). Bilinear plus
+#   a gradient correction from the known channel; 5x5 kernels.
+
+# Rows/columns of context needed on each side of a band.
+DEMOSAIC_HALO = 2
+
+def _taps(kernel: dict[tuple[int, int], float], scale: float) -> list[tuple[int, int, float]]:
+    # Expand a kernel given for one quadrant and its axes into all symmetric
+    # positions. Keys are (dy, dx) with dy, dx >= 0.
+    taps = {}
+    for (dy, dx), weight in kernel.items():
+        for sy in (1, -1):
+            for sx in (1, -1):
+                taps[(sy * dy, sx * dx)] = weight / scale
+    return [(dy, dx, w) for (dy, dx), w in taps.items()]
+
+def _transpose(taps: list[tuple[int, int, float]]) -> list[tuple[int, int, float]]:
+    return [(dx, dy, w) for dy, dx, w in taps]
+
+# Kernels by what they interpolate:
+# * "green": green at a red or blue site,
+# * "row": red (blue) at a green site with red (blue) neighbours left and right,
+# * "col": the same with neighbours above and below,
+# * "diag": red at a blue site, or blue at a red site.
+KERNELS = {
+    "bilinear": {
+        "green": _taps({(1, 0): 1, (0, 1): 1}, 4),
+        "row": _taps({(0, 1): 1}, 2),
+        "col": _taps({(1, 0): 1}, 2),
+        "diag": _taps({(1, 1): 1}, 4),
+    },
+    "malvar": {
+        "green": _taps({(0, 0): 4, (1, 0): 2, (0, 1): 2, (2, 0): -1, (0, 2): -1}, 8),
+        "row": _taps({(0, 0): 5, (0, 1): 4, (0, 2): -1, (1, 1): -1, (2, 0): 0.5}, 8),
+        "col": _transpose(_taps({(0, 0): 5, (0, 1): 4, (0, 2): -1, (1, 1): -1, (2, 0): 0.5}, 8)),
+        "diag": _taps({(0, 0): 6, (1, 1): 2, (2, 0): -1.5, (0, 2): -1.5}, 8),
+    },
+}
+
+CHANNELS = "RGB"
+
+def _sites(pattern: str) -> dict[str, list[tuple[int, int]]]:
+    # CFA sites of each colour, e.g. "RGGB" -> R: (0, 0), G: (0, 1) and (1, 0).
+    sites = {c: [] for c in CHANNELS}
+    for i, c in enumerate(pattern):
+        sites[c].append((i // 2, i % 2))
+    return sites
+
+def _response(padded: numpy.ndarray, pad: int, y0: int, x0: int, height: int, width: int,
+              taps: list[tuple[int, int, float]], out: numpy.ndarray):
+    # out = sum of weight * mosaic[y + dy, x + dx], over the sites (y0, x0).
+    out.fill(0.0)
+    for dy, dx, w in taps:
+        y = pad + y0 + dy
+        x = pad + x0 + dx
+        view = padded[y:y + height - y0:2, x:x + width - x0:2]
+        if w == 1.0:
+            out += view
+        else:
+            out += w * view
+
+def demosaic(mosaic: numpy.ndarray, pattern: str = "RGGB", method: str = "bilinear", halo: int = 0) -> numpy.ndarray:
+    # Demosaic a float32 (rows, width) mosaic into (rows - 2 * halo, width, 3).
+    # The first and last `halo` rows are context only, e.g. from neighbouring
+    # bands; an even number so the CFA phase is unchanged. With halo=0 the top
+    # and bottom edges are mirrored; the left and right edges always are.
+    kernels = KERNELS[method]
+    pad = DEMOSAIC_HALO
+
+    if halo == 0:
+        rows = (pad, pad)
+    elif halo >= pad and halo % 2 == 0:
+        mosaic = mosaic[halo - pad:mosaic.shape[0] - (halo - pad)]
+        rows = (0, 0)
+        halo = pad
+    else:
+        raise ValueError(f"halo must be 0, or even and at least {pad}")
+    # Mirror ("reflect") padding keeps the CFA phase.
+    padded = numpy.pad(mosaic, (rows, (pad, pad)), mode="reflect")
+    height = mosaic.shape[0] - 2 * halo
+    width = mosaic.shape[1]
+
+    rgb = numpy.empty((height, width, 3), dtype=numpy.float32)
+    sites = _sites(pattern)
+    colour_at = {site: c for c, ss in sites.items() for site in ss}
+
+    for (y0, x0), here in colour_at.items():
+        h = (height - y0 + 1) // 2
+        w = (width - x0 + 1) // 2
+        tmp = numpy.empty((h, w), dtype=numpy.float32)
+        for channel, c in enumerate(CHANNELS):
+            out = rgb[y0::2, x0::2, channel]
+            if c == here:
+                out[...] = padded[pad + y0:pad + height:2, pad + x0:pad + width:2]
+                continue
+            if c == "G":
+                kernel = kernels["green"]
+            elif here == "G":
+                # Is colour c left/right of this green site, or above/below?
+                kernel = kernels["row"] if colour_at[(y0, x0 ^ 1)] == c else kernels["col"]
+            else:
+                kernel = kernels["diag"]
+            _response(padded, pad, y0, x0, height, width, kernel, tmp)
+            out[...] = tmp
+
+    return rgb
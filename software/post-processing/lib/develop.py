@@ -0,0 +1,104 @@
+import numpy
+
+from lib.demosaic import DEMOSAIC_HALO, demosaic
+
+# Raw frame -> 16-bit RGB, band by band:
+#
+# 1. subtract the per-site black level and normalize to [0, 1],
+# 2. apply the white balance (ColourGains) to the red and blue sites,
+# 3. demosaic,
+# 4. apply the colour correction matrix (camera RGB -> linear sRGB),
+# 5. clip and encode, with the sRGB transfer curve unless linear output is
+#    asked for.
+#
+# All parameters come from the frame's picamera2 metadata, the same fields
+# lib/dng.py writes into DNG tags.
+
+# Rows per band. Keep it even, so every band starts on the same CFA phase.
+DEVELOP_BAND_ROWS = 256
+
+def _srgb_lut() -> numpy.ndarray:
+    # sRGB transfer curve, linear 16-bit in, encoded 16-bit out.
+    x = numpy.arange(65536, dtype=numpy.float64) / 65535
+    y = numpy.where(x <= 0.0031308, 12.92 * x, 1.055 * numpy.power(x, 1 / 2.4) - 0.055)
+    return numpy.round(y * 65535).astype(numpy.uint16)
+
+_SRGB_LUT = None
+
+class DevelopParams:
+    def __init__(self, black_levels, white_level: float, gains: tuple[float, float], ccm, pattern: str = "RGGB"):
+        self._black_levels = numpy.asarray(black_levels, dtype=numpy.float32).reshape(2, 2)
+        self._white_level = float(white_level)
+        self._gains = gains
+        self._ccm = numpy.asarray(ccm, dtype=numpy.float32).reshape(3, 3)
+        self._pattern = pattern
+
+        # Per-site scale: normalization and white balance in one multiply.
+        site_gain = {"R": gains[0], "G": 1.0, "B": gains[1]}
+        scale = numpy.empty((2, 2), dtype=numpy.float32)
+        for i, c in enumerate(pattern):
+            y, x = i // 2, i % 2
+            scale[y, x] = site_gain[c] / (self._white_level - self._black_levels[y, x])
+        self._scale = scale
+
+    @classmethod
+    def from_metadata(cls, metadata: dict, format: str) -> "DevelopParams":
+        # `format` is the raw format, e.g. "SRGGB12": samples are left-aligned
+        # in 16 bits, so the white level is the largest 12-bit value, shifted.
+        fmt_str = format.split("_")[0]
+        bpp = int("".join(ch for ch in fmt_str if ch.isdigit()))
+        pattern = fmt_str[1:5]
+        white_level = ((1 << bpp) - 1) << (16 - bpp)
+        black_levels = metadata.get("SensorBlackLevels", (0, 0, 0, 0))
+        gains = tuple(metadata.get("ColourGains", (1.0, 1.0)))
+        ccm = metadata.get("ColourCorrectionMatrix", (1, 0, 0, 0, 1, 0, 0, 0, 1))
+        return cls(black_levels, white_level, gains, ccm, pattern)
+
+    @property
+    def pattern(self) -> str:
+        return self._pattern
+
+    @property
+    def ccm(self) -> numpy.ndarray:
+        return self._ccm
+
+    def normalize(self, band: numpy.ndarray, row: int) -> numpy.ndarray:
+        # Black level and white balance of a raw band whose first row is image
+        # row `row`, as float32.
+        out = band.astype(numpy.float32)
+        for y in range(2):
+            for x in range(2):
+                sy = (row + y) % 2
+                site = out[y::2, x::2]
+                site -= self._black_levels[sy, x]
+                site *= self._scale[sy, x]
+        return out
+
+def develop_bands(data: numpy.ndarray, params: DevelopParams, method: str = "bilinear",
+                  linear: bool = False, rows: int = DEVELOP_BAND_ROWS):
+    # Yields (row, rgb) for consecutive bands of `data`, a (height, width)
+    # raw view such as lib.raw.imx477_raw_map(); rgb is (rows, width, 3)
+    # uint16. Each band reads DEMOSAIC_HALO rows of its neighbours for context.
+    global _SRGB_LUT
+    if not linear and _SRGB_LUT is None:
+        _SRGB_LUT = _srgb_lut()
+
+    height = data.shape[0]
+    halo = DEMOSAIC_HALO
+    ccm_t = params.ccm.T.copy()
+
+    for row in range(0, height, rows):
+        top = max(row - halo, 0)
+        bottom = min(row + rows + halo, height)
+        mosaic = params.normalize(data[top:bottom], top)
+        # Mirror the missing context rows at the top and bottom of the image.
+        mosaic = numpy.pad(mosaic, ((halo - (row - top), halo - (bottom - min(row + rows, height))), (0, 0)), mode="reflect")
+
+        rgb = demosaic(mosaic, params.pattern, method, halo=halo)
+        rgb = rgb.reshape(-1, 3) @ ccm_t
+        numpy.clip(rgb, 0.0, 1.0, out=rgb)
+        rgb *= 65535.0
+        out = (rgb + 0.5).astype(numpy.uint16)
+        if not linear:
+            out = _SRGB_LUT[out]
+        yield row, out.reshape(-1, data.shape[1], 3)
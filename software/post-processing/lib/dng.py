@@ -1,168 +1,370 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import functools
 import re
+import struct
 
 import numpy
 
-from pidng.core import RAW2DNG, DNGTags, Tag
+from pidng.core import DNGTags, Tag
 from pidng.defs import *
-from pidng.dng import Type
+from pidng.dng import Type, dngIFD, dngTag
+from pidng.packing import pack10, pack14
 
+from .exif import ExifTag, ImageTags, read_ifd_values, sub_ifds
 from .metadata import MetadataFile
-
-class ExtraTag:
-    GPSLatitudeRef  = (0x0001, Type.Ascii)
-    GPSLatitude     = (0x0002, Type.Rational)
-    GPSLongitudeRef = (0x0003, Type.Ascii)
-    GPSLongitude    = (0x0004, Type.Rational)
-    GPSAltitudeRef  = (0x0005, Type.Ascii)
-    GPSAltitude     = (0x0006, Type.Rational)
-
-def write_dng(ts: datetime, cam: int, data: numpy.ndarray, format: str, file_path: str, metadata_file: MetadataFile):
+from .raw import pack12, unpack12
+
+# Rows per DNG strip. Frames are shifted, packed and written one strip at a
+# time, so this also bounds the working memory of write_dng.
+DNG_ROWS_PER_STRIP = 64
+
+# Tile size of compressed DNGs. Tiles are compressed independently, so they
+# are also the unit of parallelism. TIFF wants a multiple of 16.
+DNG_TILE_SIZE = 256
+
+# DNG profiles kept per process. A flight needs one per camera and colour
+# setting; auto white balance can make many more, hence LRU eviction.
+DNG_PROFILE_CACHE_SIZE = 32
+
+def _pack_strip(data: numpy.ndarray, bpp: int) -> numpy.ndarray:
+    shift = 16 - bpp
+    if bpp == 12:
+        return pack12(data, shift).reshape(-1)
+    if bpp == 16:
+        return numpy.ascontiguousarray(data).reshape(-1).view(numpy.uint8)
+
+    data = data >> shift
+    if bpp == 8:
+        return data.astype(numpy.uint8).reshape(-1)
+    elif bpp == 10:
+        return pack10(data).reshape(-1)
+    elif bpp == 14:
+        return pack14(data).reshape(-1)
+    raise ValueError(f"unsupported bits per sample: {bpp}")
+
+def _compress_tile(data: numpy.ndarray, row: int, col: int, tile: int, bpp: int) -> bytes:
+    # Lossless JPEG (LJ92) of one tile. Like pidng, each pair of rows is coded
+    # as one JPEG row twice as wide, so the sample above is of the same colour.
+    # Edge tiles are padded by repeating the last row/column.
+    import imagecodecs
+
+    block = data[row:row + tile, col:col + tile] >> (16 - bpp)
+    if block.shape != (tile, tile):
+        block = numpy.pad(block, ((0, tile - block.shape[0]), (0, tile - block.shape[1])), mode="edge")
+    return imagecodecs.ljpeg_encode(block.reshape(tile // 2, tile * 2), bitspersample=bpp)
+
+def _write_dng_file(file_path: str, tags: list[dngTag], layout: list[dngTag], tiled: bool, sizes: list[int], chunks,
+                    image_tags: ImageTags | None = None):
+    # Lay out header, IFD, EXIF/GPS IFDs and strip (or tile) offsets up front,
+    # then write the chunks as they are produced. `layout` holds the tags that
+    # describe the chunks: RowsPerStrip or TileWidth/TileLength, Compression.
+    ifd = dngIFD()
+    tag_offsets = dngTag(Tag.TileOffsets if tiled else Tag.StripOffsets, [0] * len(sizes))
+    ifd.tags.append(tag_offsets)
+    ifd.tags.append(dngTag(Tag.NewSubfileType, [0]))
+    ifd.tags.append(dngTag(Tag.TileByteCounts if tiled else Tag.StripByteCounts, sizes))
+    ifd.tags.extend(layout)
+    ifd.tags.append(dngTag(Tag.Software, "PiDNG"))
+    ifd.tags.extend(tags)
+
+    tag_exif_ifd = tag_gps_ifd = None
+    if image_tags is not None and image_tags.exif:
+        tag_exif_ifd = dngTag(ExifTag.ExifIFD, [0])
+        ifd.tags.append(tag_exif_ifd)
+    if image_tags is not None and image_tags.gps:
+        tag_gps_ifd = dngTag(ExifTag.GPSIFD, [0])
+        ifd.tags.append(tag_gps_ifd)
+
+    header_len = 8 + ifd.dataLen()
+
+    sub_ifds_block = b""
+    if image_tags is not None:
+        sub_ifds_block, exif_offset, gps_offset = sub_ifds(image_tags, header_len)
+        if tag_exif_ifd is not None:
+            tag_exif_ifd.setValue([exif_offset])
+        if tag_gps_ifd is not None:
+            tag_gps_ifd.setValue([gps_offset])
+
+    offsets = []
+    offset = header_len + len(sub_ifds_block)
+    for size in sizes:
+        offsets.append(offset)
+        offset += (size + 3) & ~3
+    tag_offsets.setValue(offsets)
+
+    header = bytearray(header_len)
+    struct.pack_into("<ccbbI", header, 0, b'I', b'I', 0x2A, 0x00, 8)
+    ifd.setBuffer(header, 8)
+    ifd.write()
+
+    with open(file_path, "wb") as f:
+        f.write(header)
+        f.write(sub_ifds_block)
+        for chunk, size in zip(chunks, sizes):
+            f.write(chunk)
+            f.write(bytes(((size + 3) & ~3) - size))
+
+def read_dng_data(file_path: str) -> numpy.ndarray:
+    # The (height, width) samples of a DNG written by write_dng(), at its bit
+    # depth (not left-aligned). For checking and benchmarking what was written;
+    # only 12-bit strips and LJ92 tiles are understood.
+    ifd0 = read_ifd_values(file_path)
+
+    dtypes = {Type.Byte[0]: "u1", Type.Short[0]: "<u2", Type.Long[0]: "<u4"}
+
+    def values(tag: Tag) -> list[int]:
+        type_id, count, value = ifd0[tag[0]]
+        if type_id not in dtypes:
+            raise ValueError(f"{file_path}: tag {tag[0]} has unsupported type {type_id}")
+        return numpy.frombuffer(value, dtype=dtypes[type_id], count=count).tolist()
+
+    width, = values(Tag.ImageWidth)
+    height, = values(Tag.ImageLength)
+    bpp, = values(Tag.BitsPerSample)
+    compression, = values(Tag.Compression)
+
+    with open(file_path, "rb") as f:
+        def read(offset: int, size: int) -> bytes:
+            f.seek(offset)
+            return f.read(size)
+
+        if compression == Compression.LJ92:
+            import imagecodecs
+
+            tile, = values(Tag.TileWidth)
+            across = (width + tile - 1) // tile
+            down = (height + tile - 1) // tile
+            out = numpy.empty((down * tile, across * tile), dtype=numpy.uint16)
+            chunks = zip(values(Tag.TileOffsets), values(Tag.TileByteCounts))
+            for i, (offset, size) in enumerate(chunks):
+                row, col = i // across * tile, i % across * tile
+                out[row:row + tile, col:col + tile] = imagecodecs.ljpeg_decode(read(offset, size)).reshape(tile, tile)
+            return out[:height, :width]
+
+        if compression != Compression.Uncompressed or bpp != 12:
+            raise ValueError(f"{file_path}: unsupported DNG layout ({bpp} bits, compression {compression})")
+        data = b"".join(read(offset, size) for offset, size in zip(values(Tag.StripOffsets), values(Tag.StripByteCounts)))
+        return unpack12(numpy.frombuffer(data, dtype=numpy.uint8).reshape(height, -1))
+
+def _frozen(value):
+    # A tag value with its lists made tuples, so a cached profile can't be
+    # changed through it.
+    if isinstance(value, list):
+        return tuple(_frozen(item) for item in value)
+    return value
+
+class DngProfile:
+    # Everything in a DNG that depends only on the camera, raw format, frame
+    # size and colour metadata: colour matrices, white balance, black levels,
+    # CFA layout and the strip layout. These change rarely across a flight, so
+    # profiles are cached (see dng_profile()) and each frame only adds its own
+    # timestamp, RawDataUniqueID and EXIF/GPS tags. Only the tag values are
+    # kept: pidng's writer stores buffer offsets in each dngTag, so every
+    # file gets tag objects of its own.
+    def __init__(self, cam: int, format: str, width: int, height: int,
+                 ccm: tuple, gains: tuple, black_levels: tuple):
+        fmt_str = format.split("_")[0]
+        bpp = int(re.search(r'\d+', fmt_str).group())
+
+        # print(f"using bpp: {bpp}")
+
+        black_levels = [val >> (16 - bpp) for val in black_levels]
+        # print(f"black levels: {black_levels}")
+
+        camera_calibration = [[1, 1], [0, 1], [0, 1],
+                              [0, 1], [1, 1], [0, 1],
+                              [0, 1], [0, 1], [1, 1]]
+
+        color_gain_div = 10000
+        gain_r, gain_b = gains
+        gain_matrix = numpy.array([[gain_r, 0.0, 0.0   ],
+                                   [0.0,    1.0, 0.0   ],
+                                   [0.0,    0.0, gain_b]])
+        gain_r = int(gain_r * color_gain_div)
+        gain_b = int(gain_b * color_gain_div)
+        as_shot_neutral = [[color_gain_div, gain_r], [color_gain_div, color_gain_div], [color_gain_div, gain_b]]
+        # print(f"as shot neutral: {as_shot_neutral}")
+
+        ccm1 = list()
+        # This maxtrix from http://www.brucelindbloom.com/index.html?Eqn_RGB_XYZ_Matrix.html
+        rgb_to_xyz = numpy.array([[0.4124564, 0.3575761, 0.1804375],
+                                  [0.2126729, 0.7151522, 0.0721750],
+                                  [0.0193339, 0.1191920, 0.9503041]])
+        ccm_matrix = numpy.array(ccm).reshape((3, 3))
+        ccm = numpy.linalg.inv(rgb_to_xyz.dot(ccm_matrix).dot(gain_matrix))
+
+        for color in ccm.flatten().tolist():
+            ccm1.append((int(color*color_gain_div), color_gain_div))
+
+        ci1 = CalibrationIlluminant.D65
+
+        baseline_exp = 1
+
+        make = "Sony"
+        model = "IMX477"
+
+        # profile_name = "PiDNG / PiCamera2 Profile"
+        # profile_embed = 3
+
+        # TODO: Use correct orientation value per camera.
+        # TODO: Or just sort it out at the end of processing. That might be simpler. Otherwise, you risk double-rotation (or more!).
+        orientation = Orientation.Horizontal
+        # if cam == 2:
+        #     orientation = 8
+
+        cfaPattern = None
+        if "BGGR" in fmt_str:
+            cfaPattern = CFAPattern.BGGR
+        elif "GBRG" in fmt_str:
+            cfaPattern = CFAPattern.GBRG
+        elif "GRBG" in fmt_str:
+            cfaPattern = CFAPattern.GRBG
+        elif "RGGB" in fmt_str:
+            cfaPattern = CFAPattern.RGGB
+
+        sensor_image_area = (6.287, 4.712)
+        sensor_pixel_size = (4056, 3040)
+
+        focal_plane_x_resolution = [int(round(sensor_pixel_size[0] * 10 * 1000)), int(round(sensor_image_area[0] * 1000)) ]
+        focal_plane_y_resolution = [int(round(sensor_pixel_size[1] * 10 * 1000)), int(round(sensor_image_area[1] * 1000)) ]
+
+        # f_number = 2.8
+        # f_number = [int(round(f_number * 10)), 10]
+
+        # focal_length = 3.9 # mm
+        # focal_length = [int(round(focal_length * 10)), 10]
+
+        tags = DNGTags()
+        # tags.set(Tag.PhotographicSensitivity, [iso])
+        # tags.set(Tag.ExposureTime, [exposure_time_rational])
+        # tags.set(Tag.FNumber, [f_number])
+        # tags.set(Tag.FocalLength, [focal_length])
+        tags.set(Tag.ImageWidth, width)
+        tags.set(Tag.ImageLength, height)
+        tags.set(Tag.Orientation, orientation)
+        tags.set(Tag.SamplesPerPixel, 1)
+        tags.set(Tag.BitsPerSample, bpp)
+        tags.set(Tag.WhiteLevel, (1 << bpp) - 1 )
+        tags.set(Tag.BaselineExposure, [[baseline_exp, 1]])
+        # tags.set(Tag.BaselineExposure, [[-150, 100]])
+        tags.set(Tag.Make, make)
+        tags.set(Tag.Model, model)
+        tags.set(Tag.FocalPlaneXResolution, [focal_plane_x_resolution])
+        tags.set(Tag.FocalPlaneYResolution, [focal_plane_y_resolution])
+        # tags.set(Tag.ProfileName, profile_name)
+        # tags.set(Tag.ProfileEmbedPolicy, [profile_embed])
+
+        # For colour Bayer sensors
+        tags.set(Tag.BlackLevelRepeatDim, [2,2])
+        tags.set(Tag.BlackLevel, black_levels)
+        tags.set(Tag.PhotometricInterpretation, PhotometricInterpretation.Color_Filter_Array)
+        tags.set(Tag.CFARepeatPatternDim, [2,2])
+        tags.set(Tag.CFAPattern, cfaPattern)
+        tags.set(Tag.ColorMatrix1, ccm1)
+        tags.set(Tag.CameraCalibration1, camera_calibration)
+        tags.set(Tag.CameraCalibration2, camera_calibration)
+        tags.set(Tag.CalibrationIlluminant1, ci1)
+        tags.set(Tag.AsShotNeutral, as_shot_neutral)
+
+        # tags.set(Tag.TileWidth, data.shape[0])
+        # tags.set(Tag.TileLength, data.shape[1])
+        # tags.set(Tag.AsShotNeutral, [[1,1],[1,1],[1,1]])
+        tags.set(Tag.DNGVersion, DNGVersion.V1_4)
+        tags.set(Tag.DNGBackwardVersion, DNGVersion.V1_2)
+        tags.set(Tag.PreviewColorSpace, PreviewColorSpace.sRGB)
+
+        self._cam = cam
+        self._bpp = bpp
+        self._width = width
+        self._height = height
+        self._values = {tag.Type: _frozen(tag.rawValue) for tag in tags.list()}
+
+        self._rows_per_strip = DNG_ROWS_PER_STRIP
+        strip_rows = [min(self._rows_per_strip, height - row) for row in range(0, height, self._rows_per_strip)]
+        self._strip_sizes = [rows * width * bpp // 8 for rows in strip_rows]
+
+    @property
+    def bpp(self) -> int:
+        return self._bpp
+
+    @property
+    def rows_per_strip(self) -> int:
+        return self._rows_per_strip
+
+    @property
+    def strip_sizes(self) -> list[int]:
+        return self._strip_sizes
+
+    def frame_tags(self, ts: datetime, sensor_timestamp: int, image_tags: ImageTags | None = None) -> list[dngTag]:
+        # New dngTag objects for the profile's values and this frame's own.
+        date_time_str = ts.strftime("%Y:%m:%d %H:%M:%S")
+        date_time_subsec_str = ts.strftime("%f")[:3]
+
+        values = dict(self._values)
+        frame = [
+            (Tag.DateTime, date_time_str),
+            (Tag.SubsecTime, date_time_subsec_str),
+            (Tag.DateTimeOriginal, date_time_str),
+            (Tag.SubsecTimeOriginal, date_time_subsec_str),
+            (Tag.RawDataUniqueID, f"{sensor_timestamp:014d}c{self._cam:1d}".encode("ascii")),
+        ]
+        if image_tags is not None:
+            frame.extend(image_tags.ifd0.items())
+        for tag, value in frame:
+            values[tag] = [value] if isinstance(value, int) else value
+        return [dngTag(tag, value) for tag, value in values.items()]
+
+@functools.lru_cache(maxsize=DNG_PROFILE_CACHE_SIZE)
+def dng_profile(cam: int, format: str, width: int, height: int,
+                ccm: tuple, gains: tuple, black_levels: tuple) -> DngProfile:
+    return DngProfile(cam, format, width, height, ccm, gains, black_levels)
+
+def dng_profile_for(cam: int, format: str, width: int, height: int, metadata: dict) -> DngProfile:
+    return dng_profile(
+        cam, format, width, height,
+        tuple(metadata.get("ColourCorrectionMatrix", (1, 0, 0, 0, 1, 0, 0, 0, 1))),
+        tuple(metadata.get("ColourGains", (1.0, 1.0))),
+        tuple(metadata.get("SensorBlackLevels", (0, 0, 0, 0))),
+    )
+
+def write_dng(ts: datetime, cam: int, data: numpy.ndarray, format: str, file_path: str, metadata_file: MetadataFile,
+              image_tags: ImageTags | None = None, compress: bool = False, threads: int = 1):
+    # `data` is never modified, so it may be a read-only memory-mapped view,
+    # e.g. from lib.raw.imx477_raw_map(). `image_tags` (see lib.exif) are
+    # written along with the image: IFD0 tags override the profile's, EXIF and
+    # GPS tags go into their own IFDs.
+    #
+    # With `compress`, the image is written as LJ92-compressed tiles, encoded
+    # on `threads` threads; this needs the imagecodecs package. Files are
+    # about 25-30% smaller. Otherwise it is written as uncompressed strips.
     height, stride = data.shape
-
-    fmt_str = format.split("_")[0]
-    bpp = int(re.search(r'\d+', fmt_str).group())
-
-    data >>= (16 - bpp)
-
-    # print(f"using bpp: {bpp}")
-
     metadata = metadata_file.data
 
-    black_levels = list()
-    for val in metadata.get("SensorBlackLevels", (0)):
-        black_levels.append((val >> (16 - bpp)))
-    # print(f"black levels: {black_levels}")
-
-    camera_calibration = [[1, 1], [0, 1], [0, 1],
-                          [0, 1], [1, 1], [0, 1],
-                          [0, 1], [0, 1], [1, 1]]
-
-    color_gain_div = 10000
-    gain_r, gain_b = metadata.get("ColourGains",(1.0, 1.0))
-    gain_matrix = numpy.array([[gain_r, 0.0, 0.0   ],
-                               [0.0,    1.0, 0.0   ],
-                               [0.0,    0.0, gain_b]])
-    gain_r = int(gain_r * color_gain_div)
-    gain_b = int(gain_b * color_gain_div)
-    as_shot_neutral = [[color_gain_div, gain_r], [color_gain_div, color_gain_div], [color_gain_div, gain_b]]
-    # print(f"as shot neutral: {as_shot_neutral}")
-
-    ccm1 = list()
-    ccm = metadata.get("ColourCorrectionMatrix", (1, 0, 0, 0, 1, 0, 0, 0, 1))
-    # This maxtrix from http://www.brucelindbloom.com/index.html?Eqn_RGB_XYZ_Matrix.html
-    rgb_to_xyz = numpy.array([[0.4124564, 0.3575761, 0.1804375],
-                              [0.2126729, 0.7151522, 0.0721750],
-                              [0.0193339, 0.1191920, 0.9503041]])
-    ccm_matrix = numpy.array(ccm).reshape((3, 3))
-    ccm = numpy.linalg.inv(rgb_to_xyz.dot(ccm_matrix).dot(gain_matrix))
-
-    for color in ccm.flatten().tolist():
-        ccm1.append((int(color*color_gain_div), color_gain_div))
-
-    ci1 = CalibrationIlluminant.D65
-
-    baseline_exp = 1
-
-    make = "Sony"
-    model = "IMX477"
-
-    # profile_name = "PiDNG / PiCamera2 Profile"
-    # profile_embed = 3
-
-    # TODO: Use correct orientation value per camera.
-    # TODO: Or just sort it out at the end of processing. That might be simpler. Otherwise, you risk double-rotation (or more!).
-    orientation = Orientation.Horizontal
-    # if cam == 2:
-    #     orientation = 8
-
-    cfaPattern = None
-    if "BGGR" in fmt_str:
-        cfaPattern = CFAPattern.BGGR
-    elif "GBRG" in fmt_str:
-        cfaPattern = CFAPattern.GBRG
-    elif "GRBG" in fmt_str:
-        cfaPattern = CFAPattern.GRBG
-    elif "RGGB" in fmt_str:
-        cfaPattern = CFAPattern.RGGB
-
-    total_gain = metadata["AnalogueGain"] * metadata["DigitalGain"]
-    # iso = int(round(total_gain * 100))
-
-    sensor_image_area = (6.287, 4.712)
-    sensor_pixel_size = (4056, 3040)
-
-    focal_plane_x_resolution = [int(round(sensor_pixel_size[0] * 10 * 1000)), int(round(sensor_image_area[0] * 1000)) ]
-    focal_plane_y_resolution = [int(round(sensor_pixel_size[1] * 10 * 1000)), int(round(sensor_image_area[1] * 1000)) ]
-
-    # f_number = 2.8
-    # f_number = [int(round(f_number * 10)), 10]
-
-    # focal_length = 3.9 # mm
-    # focal_length = [int(round(focal_length * 10)), 10]
-
-    exposure_time_us = metadata["ExposureTime"]
-    exposure_time_s = exposure_time_us * 1e-6
-    exposure_time_s_fraction = 1 / exposure_time_s
-    exposure_time_rational = [1, int(round(exposure_time_s_fraction))]
-    # print(f"exposure time: 1/{exposure_time_s_fraction} == {1/exposure_time_s_fraction}")
-
-    date_time_str = ts.strftime("%Y:%m:%d %H:%M:%S")
-    date_time_subsec_str = ts.strftime("%f")[:3]
-
-    tags = DNGTags()
-    tags.set(Tag.DateTime, date_time_str)
-    tags.set(Tag.SubsecTime, date_time_subsec_str)
-    tags.set(Tag.DateTimeOriginal, date_time_str)
-    tags.set(Tag.SubsecTimeOriginal, date_time_subsec_str)
-
-    # tags.set(ExtraTag.GPSLatitudeRef,  "N")
-    # tags.set(ExtraTag.GPSLatitude, )
-    # tags.set(ExtraTag.GPSLongitudeRef, "W")
-    # tags.set(ExtraTag.GPSLongitude, )
-    # tags.set(ExtraTag.GPSAltitudeRef, )
-    # tags.set(ExtraTag.GPSAltitude, )
-
-    # tags.set(Tag.PhotographicSensitivity, [iso])
-    # tags.set(Tag.ExposureTime, [exposure_time_rational])
-    # tags.set(Tag.FNumber, [f_number])
-    # tags.set(Tag.FocalLength, [focal_length])
-    tags.set(Tag.RawDataUniqueID, f"{metadata['SensorTimestamp']:014d}c{cam:1d}".encode("ascii"))
-    tags.set(Tag.ImageWidth, stride)
-    tags.set(Tag.ImageLength, height)
-    tags.set(Tag.Orientation, orientation)
-    tags.set(Tag.SamplesPerPixel, 1)
-    tags.set(Tag.BitsPerSample, bpp)
-    tags.set(Tag.WhiteLevel, (1 << bpp) - 1 )
-    tags.set(Tag.BaselineExposure, [[baseline_exp, 1]])
-    # tags.set(Tag.BaselineExposure, [[-150, 100]])
-    tags.set(Tag.Make, make)
-    tags.set(Tag.Model, model)
-    tags.set(Tag.FocalPlaneXResolution, [focal_plane_x_resolution])
-    tags.set(Tag.FocalPlaneYResolution, [focal_plane_y_resolution])
-    # tags.set(Tag.DateTimeOriginal)
-    # tags.set(Tag.ProfileName, profile_name)
-    # tags.set(Tag.ProfileEmbedPolicy, [profile_embed])
-
-    # For colour Bayer sensors
-    tags.set(Tag.BlackLevelRepeatDim, [2,2])
-    tags.set(Tag.BlackLevel, black_levels)
-    tags.set(Tag.PhotometricInterpretation, PhotometricInterpretation.Color_Filter_Array)
-    tags.set(Tag.CFARepeatPatternDim, [2,2])
-    tags.set(Tag.CFAPattern, cfaPattern)
-    tags.set(Tag.ColorMatrix1, ccm1)
-    tags.set(Tag.CameraCalibration1, camera_calibration)
-    tags.set(Tag.CameraCalibration2, camera_calibration)
-    tags.set(Tag.CalibrationIlluminant1, ci1)
-    tags.set(Tag.AsShotNeutral, as_shot_neutral)
-
-    # tags.set(Tag.TileWidth, data.shape[0])
-    # tags.set(Tag.TileLength, data.shape[1])
-    # tags.set(Tag.AsShotNeutral, [[1,1],[1,1],[1,1]])
-    tags.set(Tag.DNGVersion, DNGVersion.V1_4)
-    tags.set(Tag.DNGBackwardVersion, DNGVersion.V1_2)
-    tags.set(Tag.PreviewColorSpace, PreviewColorSpace.sRGB)
-
-    r = RAW2DNG()
-    r.options(tags, path="", compress=False)
-    r.convert(data, filename=file_path)
+    profile = dng_profile_for(cam, format, stride, height, metadata)
+    tags = profile.frame_tags(ts, metadata["SensorTimestamp"], image_tags)
+
+    bpp = profile.bpp
+    if compress:
+        tile = DNG_TILE_SIZE
+        origins = [(row, col) for row in range(0, height, tile) for col in range(0, stride, tile)]
+        if threads > 1:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                tiles = list(executor.map(lambda origin: _compress_tile(data, *origin, tile, bpp), origins))
+        else:
+            tiles = [_compress_tile(data, *origin, tile, bpp) for origin in origins]
+        layout = [
+            dngTag(Tag.TileWidth, [tile]),
+            dngTag(Tag.TileLength, [tile]),
+            dngTag(Tag.Compression, [Compression.LJ92]),
+        ]
+        _write_dng_file(file_path, tags, layout, True, [len(t) for t in tiles], tiles, image_tags)
+        return
+
+    rows_per_strip = profile.rows_per_strip
+    strips = (_pack_strip(data[row:row + rows_per_strip], bpp) for row in range(0, height, rows_per_strip))
+    layout = [
+        dngTag(Tag.RowsPerStrip, [rows_per_strip]),
+        dngTag(Tag.Compression, [Compression.Uncompressed]),
+    ]
+    _write_dng_file(file_path, tags, layout, False, profile.strip_sizes, strips, image_tags)
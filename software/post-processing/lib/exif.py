@@ -0,0 +1,340 @@
+from concurrent.futures import ThreadPoolExecutor
+import math
+import os
+import struct
+import traceback
+
+from pidng.core import Tag
+from pidng.dng import Type, dngTag
+
+# EXIF and GPS tagging of TIFF/DNG images, without exiftool.
+#
+# Tags are held per IFD as {tag: value}, with tags and values in pidng's form
+# (e.g. Tag.Make, "Sony"), so the same ImageTags can go into a DNG as it is
+# written (lib/dng.py) or be patched into an existing little-endian TIFF or
+# DNG file. Patching never rewrites image data: the new IFD0, EXIF and GPS IFDs
+# are appended to the end of the file, then the 4-byte IFD0 pointer in the
+# header is switched over to them. The old IFD0 is left behind, unreferenced.
+#
+# The appended block ends with a TRAILER holding the file's original length
+# and IFD0 offset. Patching the file again starts from the original IFDs and
+# replaces the block, so repeated runs don't grow the file; a patch that would
+# write the same bytes is skipped.
+
+class ExifTag:
+    ExifIFD             = (34665, Type.Long)
+    GPSIFD              = (34853, Type.Long)
+    OffsetTime          = (36880, Type.Ascii)
+    OffsetTimeOriginal  = (36881, Type.Ascii)
+    PixelXDimension     = (40962, Type.Long)
+    PixelYDimension     = (40963, Type.Long)
+
+class GPSTag:
+    GPSVersionID    = (0x0000, Type.Byte)
+    GPSLatitudeRef  = (0x0001, Type.Ascii)
+    GPSLatitude     = (0x0002, Type.Rational)
+    GPSLongitudeRef = (0x0003, Type.Ascii)
+    GPSLongitude    = (0x0004, Type.Rational)
+    GPSAltitudeRef  = (0x0005, Type.Byte)
+    GPSAltitude     = (0x0006, Type.Rational)
+
+# EXIF Orientation values, by their exiftool names.
+ORIENTATIONS = {
+    "Horizontal (normal)": 1,
+    "Mirror horizontal": 2,
+    "Rotate 180": 3,
+    "Mirror vertical": 4,
+    "Mirror horizontal and rotate 270 CW": 5,
+    "Rotate 90 CW": 6,
+    "Mirror horizontal and rotate 90 CW": 7,
+    "Rotate 270 CW": 8,
+}
+
+TIFF_HEADER = b"II*\x00"
+IFD_ENTRY_LENGTH = 12
+
+TRAILER = struct.Struct("<4sII")    # magic, original file length, original IFD0 offset
+TRAILER_MAGIC = b"GDEX"
+
+class ImageTags:
+    def __init__(self):
+        self.ifd0 = {}
+        self.exif = {}
+        self.gps = {}
+
+def _rational(value: float, denominator: int) -> list[int]:
+    return [int(round(value * denominator)), denominator]
+
+def _degrees_rational(value: float) -> list[list[int]]:
+    # Rounded to 1/10000 s before splitting, so seconds never round up to 60.
+    ticks = int(round(value * 3600 * 10000))
+    degrees, ticks = divmod(ticks, 3600 * 10000)
+    minutes, ticks = divmod(ticks, 60 * 10000)
+    return [[degrees, 1], [minutes, 1], [ticks, 10000]]
+
+def _fraction(value) -> tuple[int, int]:
+    # "1/1000" or a number, as a (numerator, denominator) pair.
+    if isinstance(value, str) and "/" in value:
+        numerator, denominator = value.split("/")
+        return int(numerator), int(denominator)
+    return _rational(float(value), 1000000)
+
+def image_tags_from_exiftool_row(row: dict) -> ImageTags:
+    # The tags of one exiftool CSV row (see EXIFTOOL_COLUMN_NAMES in
+    # log_extract.py), so images carry exactly what the CSV records.
+    tags = ImageTags()
+
+    if "DateTime" in row:
+        tags.ifd0[Tag.DateTime] = row["DateTime"]
+    if "Make" in row:
+        tags.ifd0[Tag.Make] = row["Make"]
+    if "Model" in row:
+        tags.ifd0[Tag.Model] = row["Model"]
+    if "Orientation" in row:
+        tags.ifd0[Tag.Orientation] = [ORIENTATIONS[row["Orientation"]]]
+
+    tags.exif[Tag.ExifVersion] = list(b"0231")
+    if "DateTimeOriginal" in row:
+        tags.exif[Tag.DateTimeOriginal] = row["DateTimeOriginal"]
+    if "SubSecTime" in row:
+        tags.exif[Tag.SubsecTime] = row["SubSecTime"]
+    if "SubSecTimeOriginal" in row:
+        tags.exif[Tag.SubsecTimeOriginal] = row["SubSecTimeOriginal"]
+    if "OffsetTime" in row:
+        tags.exif[ExifTag.OffsetTime] = row["OffsetTime"]
+    if "OffsetTimeOriginal" in row:
+        tags.exif[ExifTag.OffsetTimeOriginal] = row["OffsetTimeOriginal"]
+    if "ExposureTime" in row:
+        tags.exif[Tag.ExposureTime] = [list(_fraction(row["ExposureTime"]))]
+    if "ShutterSpeedValue" in row:
+        # APEX: -log2(exposure time).
+        numerator, denominator = _fraction(row["ShutterSpeedValue"])
+        tags.exif[Tag.ShutterSpeedValue] = [_rational(-math.log2(numerator / denominator), 1000)]
+    if "FNumber" in row:
+        tags.exif[Tag.FNumber] = [_rational(float(row["FNumber"]), 10)]
+    if "Aperture" in row:
+        # APEX: 2 log2(f-number).
+        tags.exif[Tag.ApertureValue] = [_rational(2 * math.log2(float(row["Aperture"])), 1000)]
+    if "FocalLength" in row:
+        tags.exif[Tag.FocalLength] = [_rational(float(str(row["FocalLength"]).split()[0]), 10)]
+    if "ISO" in row:
+        tags.exif[Tag.PhotographicSensitivity] = [int(row["ISO"])]
+    if "ExifImageWidth" in row:
+        tags.exif[ExifTag.PixelXDimension] = [int(row["ExifImageWidth"])]
+    if "ExifImageHeight" in row:
+        tags.exif[ExifTag.PixelYDimension] = [int(row["ExifImageHeight"])]
+
+    if "GPSLatitude" in row:
+        tags.gps[GPSTag.GPSVersionID] = [2, 3, 0, 0]
+        tags.gps[GPSTag.GPSLatitudeRef] = row["GPSLatitudeRef"][0]
+        tags.gps[GPSTag.GPSLatitude] = _degrees_rational(float(row["GPSLatitude"]))
+        tags.gps[GPSTag.GPSLongitudeRef] = row["GPSLongitudeRef"][0]
+        tags.gps[GPSTag.GPSLongitude] = _degrees_rational(float(row["GPSLongitude"]))
+    if "GPSAltitude" in row:
+        below = row.get("GPSAltitudeRef", "Above Sea Level") == "Below Sea Level"
+        tags.gps[GPSTag.GPSAltitudeRef] = [1 if below else 0]
+        tags.gps[GPSTag.GPSAltitude] = [_rational(abs(float(row["GPSAltitude"])), 1000)]
+
+    return tags
+
+def dng_tags(tags: dict) -> list[dngTag]:
+    return [dngTag(tag, [value] if isinstance(value, int) else value) for tag, value in tags.items()]
+
+class _Entry:
+    # One IFD entry: either a new tag, or the raw 12 bytes of an entry copied
+    # from an existing IFD. Copied entries keep pointing at their old data,
+    # which stays where it is in the file.
+    def __init__(self, tag_id: int, tag: dngTag | None = None, raw: bytes | None = None):
+        self.tag_id = tag_id
+        self.tag = tag
+        self.raw = raw
+
+    def data_length(self) -> int:
+        if self.tag is None or len(self.tag.Value) <= 4:
+            return 0
+        return (len(self.tag.Value) + 3) & ~3
+
+def _ifd_length(entries: list[_Entry]) -> int:
+    return 2 + IFD_ENTRY_LENGTH * len(entries) + 4 + sum(e.data_length() for e in entries)
+
+def _write_ifd(entries: list[_Entry], offset: int, next_offset: int = 0) -> bytes:
+    # An IFD laid out at `offset` in the file: the entries, sorted by tag as
+    # TIFF requires, then the values that don't fit inline.
+    entries = sorted(entries, key=lambda e: e.tag_id)
+    buf = bytearray(_ifd_length(entries))
+    struct.pack_into("<H", buf, 0, len(entries))
+    data_offset = 2 + IFD_ENTRY_LENGTH * len(entries) + 4
+    for i, e in enumerate(entries):
+        entry_offset = 2 + IFD_ENTRY_LENGTH * i
+        if e.raw is not None:
+            buf[entry_offset:entry_offset + IFD_ENTRY_LENGTH] = e.raw
+            continue
+        value = e.tag.Value
+        if len(value) <= 4:
+            struct.pack_into("<HHI4s", buf, entry_offset, e.tag.TagId, e.tag.DataType[0], e.tag.DataCount, value)
+        else:
+            struct.pack_into("<HHII", buf, entry_offset, e.tag.TagId, e.tag.DataType[0], e.tag.DataCount, offset + data_offset)
+            buf[data_offset:data_offset + len(value)] = value
+            data_offset += e.data_length()
+    struct.pack_into("<I", buf, 2 + IFD_ENTRY_LENGTH * len(entries), next_offset)
+    return bytes(buf)
+
+def _entries(tags: dict) -> list[_Entry]:
+    return [_Entry(t.TagId, tag=t) for t in dng_tags(tags)]
+
+def _merge(entries: list[_Entry], new: list[_Entry]) -> list[_Entry]:
+    ids = {e.tag_id for e in new}
+    return [e for e in entries if e.tag_id not in ids] + new
+
+def sub_ifds(tags: ImageTags, offset: int, exif_entries: list[_Entry] | None = None,
+             gps_entries: list[_Entry] | None = None) -> tuple[bytes, int | None, int | None]:
+    # The EXIF and GPS IFDs of `tags`, laid out from `offset` on. Returns the
+    # bytes and the offsets of the two IFDs (None when empty), for the
+    # ExifIFD/GPSIFD pointers of IFD0.
+    exif = _merge(exif_entries or [], _entries(tags.exif))
+    gps = _merge(gps_entries or [], _entries(tags.gps))
+
+    block = b""
+    exif_offset = gps_offset = None
+    if exif:
+        exif_offset = offset
+        block += _write_ifd(exif, exif_offset)
+    if gps:
+        gps_offset = offset + len(block)
+        block += _write_ifd(gps, gps_offset)
+    return block, exif_offset, gps_offset
+
+def _layout(ifd0: list[_Entry], tags: ImageTags, offset: int, exif: list[_Entry] | None = None,
+            gps: list[_Entry] | None = None, next_offset: int = 0) -> bytes:
+    # IFD0, with `tags` merged in, followed by its EXIF and GPS IFDs.
+    ifd0 = _merge(ifd0, _entries(tags.ifd0))
+    # Placeholder pointers first, so the length of IFD0 is known before the
+    # offsets of the sub-IFDs that follow it are.
+    pointers = {}
+    if exif or tags.exif:
+        pointers[ExifTag.ExifIFD] = 0
+    if gps or tags.gps:
+        pointers[ExifTag.GPSIFD] = 0
+    ifd0 = _merge(ifd0, _entries(pointers))
+
+    block, exif_offset, gps_offset = sub_ifds(tags, offset + _ifd_length(ifd0), exif, gps)
+
+    pointers = {}
+    if exif_offset is not None:
+        pointers[ExifTag.ExifIFD] = exif_offset
+    if gps_offset is not None:
+        pointers[ExifTag.GPSIFD] = gps_offset
+    ifd0 = _merge(ifd0, _entries(pointers))
+
+    return _write_ifd(ifd0, offset, next_offset) + block
+
+def ifds(ifd0: dict, tags: ImageTags | None, offset: int) -> bytes:
+    # A complete IFD0 (e.g. the image structure tags of a new TIFF file), plus
+    # `tags` with their EXIF and GPS IFDs, laid out at `offset`. The length
+    # depends only on which tags are present and their counts, not on their
+    # values, so offsets that point past the IFDs can be filled in afterwards.
+    return _layout(_entries(ifd0), tags if tags is not None else ImageTags(), offset)
+
+def _read_ifd(f, offset: int) -> tuple[list[_Entry], int]:
+    f.seek(offset)
+    (count,) = struct.unpack("<H", f.read(2))
+    data = f.read(IFD_ENTRY_LENGTH * count + 4)
+    entries = []
+    for i in range(count):
+        raw = data[IFD_ENTRY_LENGTH * i:IFD_ENTRY_LENGTH * (i + 1)]
+        entries.append(_Entry(struct.unpack_from("<H", raw)[0], raw=raw))
+    (next_offset,) = struct.unpack_from("<I", data, IFD_ENTRY_LENGTH * count)
+    return entries, next_offset
+
+def _pointer(entries: list[_Entry], tag_id: int) -> int | None:
+    for e in entries:
+        if e.tag_id == tag_id and e.raw is not None:
+            return struct.unpack_from("<I", e.raw, 8)[0]
+    return None
+
+def read_ifd_values(path: str, ifd: str = "ifd0") -> dict[int, tuple[int, int, bytes]]:
+    # {tag id: (type, count, value bytes)} of IFD0, or of its "exif" or "gps"
+    # sub-IFD. For checking what was written.
+    with open(path, "rb") as f:
+        header = f.read(8)
+        if header[:4] != TIFF_HEADER:
+            raise ValueError(f"{path}: not a little-endian TIFF file")
+        offset = struct.unpack_from("<I", header, 4)[0]
+        entries, _ = _read_ifd(f, offset)
+        if ifd != "ifd0":
+            offset = _pointer(entries, {"exif": ExifTag.ExifIFD, "gps": ExifTag.GPSIFD}[ifd][0])
+            if offset is None:
+                return {}
+            entries, _ = _read_ifd(f, offset)
+
+        result = {}
+        for e in entries:
+            tag_id, type_id, count, value = struct.unpack("<HHI4s", e.raw)
+            size = count * {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}.get(type_id, 1)
+            if size > 4:
+                f.seek(struct.unpack("<I", value)[0])
+                value = f.read(size)
+            result[tag_id] = (type_id, count, value[:size])
+        return result
+
+def patch_file(path: str, tags: ImageTags):
+    # Merge `tags` into the IFD0, EXIF and GPS IFDs of an existing image.
+    # Only appends to the file (replacing what an earlier patch appended),
+    # plus 4-byte writes to the header.
+    with open(path, "r+b") as f:
+        header = f.read(8)
+        if header[:4] != TIFF_HEADER:
+            raise ValueError(f"{path}: not a little-endian TIFF file")
+        current_offset = struct.unpack_from("<I", header, 4)[0]
+
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        original_end, ifd0_offset = end, current_offset
+        if end >= len(header) + TRAILER.size:
+            f.seek(end - TRAILER.size)
+            magic, trailer_end, trailer_offset = TRAILER.unpack(f.read(TRAILER.size))
+            if magic == TRAILER_MAGIC and trailer_end <= end - TRAILER.size and trailer_offset < trailer_end:
+                original_end, ifd0_offset = trailer_end, trailer_offset
+
+        ifd0, next_offset = _read_ifd(f, ifd0_offset)
+        exif_offset = _pointer(ifd0, ExifTag.ExifIFD[0])
+        gps_offset = _pointer(ifd0, ExifTag.GPSIFD[0])
+        exif = _read_ifd(f, exif_offset)[0] if exif_offset is not None else []
+        gps = _read_ifd(f, gps_offset)[0] if gps_offset is not None else []
+
+        base = (original_end + 3) & ~3
+        block = (bytes(base - original_end) + _layout(ifd0, tags, base, exif, gps, next_offset)
+                 + TRAILER.pack(TRAILER_MAGIC, original_end, ifd0_offset))
+        f.seek(original_end)
+        if current_offset == base and f.read() == block:
+            return
+
+        if original_end != end:
+            # Back to the original IFD0 before cutting off the earlier block,
+            # so an interrupted patch leaves a readable file.
+            f.seek(4)
+            f.write(struct.pack("<I", ifd0_offset))
+            f.flush()
+            f.truncate(original_end)
+        f.seek(original_end)
+        f.write(block)
+        f.flush()
+
+        # Only now point the header at the new IFD0, so an interrupted patch
+        # leaves the original tags in place.
+        f.seek(4)
+        f.write(struct.pack("<I", base))
+
+def _patch(path: str, tags: ImageTags) -> tuple[str, str | None]:
+    try:
+        patch_file(path, tags)
+    except Exception:
+        return path, traceback.format_exc()
+    return path, None
+
+def patch_files(items: list[tuple[str, ImageTags]], workers: int):
+    # Patches many files on a thread pool; the work is small reads and
+    # appends, so threads overlap the I/O. Yields (path, error) per file, in
+    # order, with error None on success.
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        yield from executor.map(lambda item: _patch(*item), items)
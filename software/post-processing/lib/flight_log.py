@@ -1,8 +1,11 @@
-from datetime import datetime, timedelta, timezone
+from datetime import datetime
 
-from pymavlink import mavutil
 import numpy
 
+from lib.cache import columns_load, columns_save
+from lib.dataflash import DataFlashLog
+from lib.orientation import euler_to_quaternion, quaternion_continuous, quaternion_slerp, quaternion_to_euler
+
 # Observed types in log from 2025/08/20 PM flight:
 #
 # 'AHR2', 'ARM', 'ATT', 'AUXF', 'BARO', 'BAT', 'CMD', 'CTRL', 'CTUN', 'D32', 'DCM',
@@ -13,128 +16,135 @@ import numpy
 # 'XKF1', 'XKF2', 'XKF3', 'XKF4', 'XKF5', 'XKFS', 'XKQ', 'XKT', 'XKV1', 'XKV2',
 # 'XKY0', 'XKY1'
 
-class FlightLog:
-    def __init__(self, log_path: str):
-        self._gpa = []
-        self._gps = []
-        self._attitudes = []
-        self._positions = []
-
-        self._handlers = {
-            'ATT': self._handle_att,
-            # 'MSG': self._handle_msg,
-            'GPA': self._handle_gpa,
-            # 'GPS': self._handle_gps,
-            'POS': self._handle_pos,
-        }
-
-        self._read(log_path)
-        self._process()
+# Columns read by FlightLog, per stream: the DataFlash message type, then
+# (column, field) pairs. Every stream also gets a "ts" column: seconds, UNIX
+# epoch, UTC. Bump CACHE_VERSION whenever columns change meaning, so existing
+# "<log>.npz" caches are rebuilt.
+CACHE_VERSION = 4
 
+STREAMS = {
     # ATT: Canonical vehicle attitude
-    def _handle_att(self, ts, d):
-        roll = d["Roll"]
-        pitch = d["Pitch"]
-        yaw = d["Yaw"]
-
-        self._attitudes.append({
-            "ts": ts,       # seconds, UNIX epoch, UTC
-            "roll": roll,   # degrees
-            "pitch": pitch, # degrees
-            "yaw": yaw      # degrees heading
-        })
+    "attitudes": ("ATT", (
+        ("roll", "Roll"),       # degrees
+        ("pitch", "Pitch"),     # degrees
+        ("yaw", "Yaw"),         # degrees heading
+    )),
+
+    # POS: Canonical vehicle position
+    "positions": ("POS", (
+        ("lat", "Lat"),         # degrees
+        ("lng", "Lng"),         # degrees
+        ("alt", "Alt"),         # meters (MSL, it seems. Must reference from terrain data at lift-off?)
+    )),
 
     # GPA: GPS accuracy information
-    def _handle_gpa(self, ts, d):
-        self._gpa.append({
-            "v_dop": d["VDop"],   # vertical dilution of precision
-            "h_acc": d["HAcc"],   # horizontal position accuracy, meters
-            "v_acc": d["VAcc"],   # vertical position accuracy, meters
-            "s_acc": d["SAcc"],   # speed accuracy, m/s
-            "y_acc": d["YAcc"],   # yaw accuracy, degrees
-            # "aei": d["AEI"],      # altitude above WGS-84 ellipsoid; INT32_MIN (-2147483648) if unknown, meters
-        })
+    "gpa": ("GPA", (
+        ("v_dop", "VDop"),      # vertical dilution of precision
+        ("h_acc", "HAcc"),      # horizontal position accuracy, meters
+        ("v_acc", "VAcc"),      # vertical position accuracy, meters
+        ("s_acc", "SAcc"),      # speed accuracy, m/s
+        ("y_acc", "YAcc"),      # yaw accuracy, degrees
+        # ("aei", "AEI"),       # altitude above WGS-84 ellipsoid; INT32_MIN (-2147483648) if unknown, meters
+    )),
 
     # GPS: Information received from GNSS systems attached to the autopilot
-    def _handle_gps(self, ts, d):
-        gms = d["GMS"]
-        gwk = d["GWk"]
-
-        # Produce datetime based on GPS epoch.
-        gps_datum = datetime(1980, 1, 6, 0, 0, 0, tzinfo=timezone.utc)
-        gps_week = gps_datum + timedelta(days=gwk * 7)
-        gps_datetime = gps_week + timedelta(milliseconds=gms)
-
-        # https://en.wikipedia.org/wiki/Leap_second
-        leap_seconds = 18
-        gps_datetime = gps_datetime + timedelta(seconds=-leap_seconds)
-
-        # print(f"{ts} gps {gms} {gwk} -> {gps_datetime}")
-        self._gps.append({
-            "ts": ts,
-            "gms": gms,
-            "gwk": gwk,
-            "h_dop": d["HDop"], # horizontal dilution of precision
-            "ground_speed": d["Spd"],   # ground speed, meters/second
-            "ground_course": d["GCrs"], # ground course, degrees heading
-            "vertical_speed": d["VZ"],  # vertical speed, meters/second
-            "yaw": d["Yaw"],            # vehicle yaw, degrees heading
-        })
-
-    # MSG: Textual messages
-    def _handle_msg(self, ts, d):
-        message_str = d["Message"]
-        print(f"{ts} msg \"{message_str}\"")
+    "gps": ("GPS", (
+        ("gms", "GMS"),                 # milliseconds since start of GPS week
+        ("gwk", "GWk"),                 # GPS week
+        ("h_dop", "HDop"),              # horizontal dilution of precision
+        ("ground_speed", "Spd"),        # ground speed, meters/second
+        ("ground_course", "GCrs"),      # ground course, degrees heading
+        ("vertical_speed", "VZ"),       # vertical speed, meters/second
+        ("yaw", "Yaw"),                 # vehicle yaw, degrees heading
+    )),
+}
+
+def interp_bracket(xp: numpy.ndarray, x: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    # Indices (i0, i1) of the samples of `xp` on either side of each `x`, and
+    # the weight of i1. Queries outside `xp` clamp to the end samples, as
+    # numpy.interp() does. `xp` must be sorted.
+    n = len(xp)
+    if n == 0:
+        raise ValueError("no samples to interpolate")
+    if n == 1:
+        zeros = numpy.zeros(len(x), dtype=numpy.intp)
+        return zeros, zeros, numpy.zeros(len(x), dtype=numpy.float64)
+
+    i1 = numpy.clip(numpy.searchsorted(xp, x, side="right"), 1, n - 1)
+    i0 = i1 - 1
+    x0 = xp[i0]
+    dx = xp[i1] - x0
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        w = numpy.where(dx > 0, (x - x0) / dx, 0.0)
+    return i0, i1, numpy.clip(w, 0.0, 1.0)
+
+def interp_apply(bracket: tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray], fp: numpy.ndarray) -> numpy.ndarray:
+    i0, i1, w = bracket
+    return fp[i0] + (fp[i1] - fp[i0]) * w
 
-    # POS: Canonical vehicle position
-    def _handle_pos(self, ts, d):
-        lat = d["Lat"]
-        lng = d["Lng"]
-        alt = d["Alt"]
+class FlightLog:
+    def __init__(self, log_path: str, use_cache: bool = True):
+        streams = ";".join(f"{stream}={type}:{','.join(field for _, field in fields)}" for stream, (type, fields) in STREAMS.items())
+        cache_tag = f"v{CACHE_VERSION}:{streams};messages=MSG:Message"
+        columns = columns_load(log_path, cache_tag) if use_cache else None
+        if columns is None:
+            columns = self._read(log_path)
+            if use_cache:
+                columns_save(log_path, cache_tag, columns)
+        self._assign(columns)
+
+    def _read(self, log_path: str) -> dict[str, numpy.ndarray]:
+        # Only the message types in STREAMS are decoded, straight into arrays.
+        log = DataFlashLog(log_path)
 
-        self._positions.append({
-            "ts": ts,       # seconds, UNIX epoch, UTC
-            "lat": lat,     # degrees
-            "lng": lng,     # degrees
-            "alt": alt,     # meters (MSL, it seems. Must reference from terrain data at lift-off?)
-        })
+        columns = {}
+        for stream, (type, fields) in STREAMS.items():
+            values = log.columns(type, tuple(field for _, field in fields))
+            columns[f"{stream}_ts"] = values["ts"] if values is not None else numpy.zeros(0)
+            for column, field in fields:
+                columns[f"{stream}_{column}"] = values[field] if values is not None else numpy.zeros(0)
 
-    def _read(self, log_path: str):
-        log = mavutil.mavlink_connection(log_path, notimestamps=False, robust_parsing=False)
+        # MSG: status texts, kept as raw bytes. Used to derive the time sync map.
+        messages = log.messages("MSG", ("TimeUS", "Message"))
+        columns["messages_ts"] = log.timestamps(messages["TimeUS"]) if messages is not None else numpy.zeros(0)
+        columns["messages_text"] = messages["Message"].copy() if messages is not None else numpy.zeros(0, dtype="S64")
 
-        while True:
-            message = log.recv_match()
-            if message is None:
-                break
+        # UNIX time at TimeUS = 0, to map flight computer boot times (TIMESYNC).
+        columns["timebase"] = numpy.array(log.timebase)
 
-            handler = self._handlers.get(message.get_type(), None)
-            if handler is not None:
-                ts_local = getattr(message, "_timestamp", None)
-                # ts_local = datetime.fromtimestamp(ts_local, tz=TZ_LOCAL)
+        # print("attitudes", min(columns["attitudes_ts"]), max(columns["attitudes_ts"]))
+        # print("positions", min(columns["positions_ts"]), max(columns["positions_ts"]))
 
-                d = message.to_dict()
-                handler(ts_local, d)
+        # assert(numpy.all(columns["positions_ts"] == sorted(columns["positions_ts"])))
 
-    def _process(self):
-        self._attitudes_ts = numpy.array([v["ts"   ] for v in self._attitudes], dtype=numpy.float64)
-        self._rolls        = numpy.array([v["roll" ] for v in self._attitudes], dtype=numpy.float64)
-        self._pitches      = numpy.array([v["pitch"] for v in self._attitudes], dtype=numpy.float64)
-        self._yaws         = numpy.array([v["yaw"  ] for v in self._attitudes], dtype=numpy.float64)
+        return columns
 
-        self._positions_ts = numpy.array([v["ts" ] for v in self._positions], dtype=numpy.float64)
-        self._latitudes    = numpy.array([v["lat"] for v in self._positions], dtype=numpy.float64)
-        self._longitudes   = numpy.array([v["lng"] for v in self._positions], dtype=numpy.float64)
-        self._altitudes    = numpy.array([v["alt"] for v in self._positions], dtype=numpy.float64)
+    def _assign(self, columns: dict[str, numpy.ndarray]):
+        self._columns = columns
 
-        # print("attitudes", min(self._attitudes_ts), max(self._attitudes_ts))
-        # print("positions", min(self._positions_ts), max(self._positions_ts))
+        self._attitudes_ts = columns["attitudes_ts"]
+        self._rolls        = columns["attitudes_roll"]
+        self._pitches      = columns["attitudes_pitch"]
+        self._yaws         = columns["attitudes_yaw"]
 
-        # assert(numpy.all(self._positions_ts == sorted(self._positions_ts)))
+        self._positions_ts = columns["positions_ts"]
+        self._latitudes    = columns["positions_lat"]
+        self._longitudes   = columns["positions_lng"]
+        self._altitudes    = columns["positions_alt"]
 
-        # print(self._positions_ts)
+        self._messages_ts = columns["messages_ts"]
+        self._messages_text = columns["messages_text"]
+
+        self._timebase = float(columns["timebase"])
+
+        self._attitude_quaternions = None
 
     # NOTE: attitudes are assumed sorted by increasing timestamp.
 
+    @property
+    def columns(self) -> dict[str, numpy.ndarray]:
+        return self._columns
+
     @property
     def attitudes_ts(self): # -> [float]:
         return self._attitudes_ts
@@ -167,15 +177,41 @@ class FlightLog:
     def altitudes(self): # -> list[float]:
         return self._altitudes
 
+    @property
+    def timebase(self) -> float:
+        # UNIX time of the flight computer's boot, i.e. TimeUS = 0.
+        return self._timebase
+
+    @property
+    def status_texts(self) -> tuple[numpy.ndarray, list[str]]:
+        # Timestamps and texts of the MSG messages, in log order.
+        texts = [text.decode("utf-8", errors="replace") for text in self._messages_text]
+        return self._messages_ts, texts
+
+    @property
+    def attitude_quaternions(self) -> numpy.ndarray:
+        # ATT samples as NED <- body quaternions, computed once and sign-aligned
+        # so that neighbouring samples interpolate the short way round.
+        if self._attitude_quaternions is None:
+            q = euler_to_quaternion(self._rolls, self._pitches, self._yaws)
+            self._attitude_quaternions = quaternion_continuous(q)
+        return self._attitude_quaternions
+
+    def attitudes_at(self, ts: numpy.ndarray) -> numpy.ndarray:
+        # Vehicle attitude quaternions at an array of timestamps (seconds,
+        # UNIX epoch, UTC), by spherical linear interpolation. Unlike
+        # interpolating roll/pitch/yaw, this is safe across the +/-180 wrap.
+        ts = numpy.asarray(ts, dtype=numpy.float64)
+        q = self.attitude_quaternions
+        i0, i1, w = interp_bracket(self._attitudes_ts, ts)
+        return quaternion_slerp(q[i0], q[i1], w)
+
     def attitude_interp(self, dt: datetime):
-        # TODO: Warning! These are angles, they wrap! Interpolation
-        # will potentially make a mess of these values if two adjacent
-        # values have wrapped.
-        ts = dt.timestamp()
+        roll, pitch, yaw = quaternion_to_euler(self.attitudes_at(numpy.array([dt.timestamp()]))[0])
         return {
-            "roll":  numpy.interp(ts, self._attitudes_ts, self._rolls),
-            "pitch": numpy.interp(ts, self._attitudes_ts, self._pitches),
-            "yaw":   numpy.interp(ts, self._attitudes_ts, self._yaws),
+            "roll":  roll,
+            "pitch": pitch,
+            "yaw":   yaw,
         }
 
     def position_interp(self, dt: datetime):
@@ -186,6 +222,27 @@ class FlightLog:
             "alt": numpy.interp(ts, self._positions_ts, self._altitudes),
         }
 
+    def poses_at(self, ts: numpy.ndarray) -> dict[str, numpy.ndarray]:
+        # Batched attitude_interp() and position_interp(): `ts` is an array of
+        # seconds, UNIX epoch, UTC. Each stream is searched once, and the
+        # bracketing indices and weights are shared by all of its channels.
+        # Attitude is interpolated as a quaternion, see attitudes_at().
+        ts = numpy.asarray(ts, dtype=numpy.float64)
+
+        attitude = self.attitudes_at(ts)
+        roll, pitch, yaw = quaternion_to_euler(attitude)
+        position = interp_bracket(self._positions_ts, ts)
+        return {
+            "ts":    ts,
+            "attitude": attitude,
+            "roll":  roll,
+            "pitch": pitch,
+            "yaw":   yaw,
+            "lat":   interp_apply(position, self._latitudes),
+            "lng":   interp_apply(position, self._longitudes),
+            "alt":   interp_apply(position, self._altitudes),
+        }
+
 # # RAD: Telemetry radio statistics
 # rssi_local = d["RSSI"]
 # rssi_remote = d["RemRSSI"]
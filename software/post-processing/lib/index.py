@@ -0,0 +1,174 @@
+import json
+import os
+import os.path
+import re
+import sqlite3
+
+import numpy
+
+# Persistent per-flight index of the raw and metadata files, stored as
+# "<flight_dir>/index.sqlite".
+#
+# Each indexed file has a row with its name, size, mtime, timestamp and camera
+# ordinal, parsed from the file name. Metadata files also keep their JSON text,
+# plus the fields in METADATA_FIELDS as typed columns. An update lists the
+# directory once with os.scandir() and only reads files that are new or whose
+# size or mtime changed, so a repeat run costs one directory listing and one
+# query per kind of file.
+
+INDEX_FILE_NAME = "index.sqlite"
+
+# Bump whenever the schema or the meaning of a column changes; the index is
+# then rebuilt from scratch.
+INDEX_VERSION = 2
+
+# Metadata fields kept as columns: (column, JSON key, SQL type). A (key, i)
+# tuple picks element i of a list value.
+METADATA_FIELDS = (
+    ("sensor_timestamp", "SensorTimestamp", "INTEGER"),     # ns, sensor clock
+    ("frame_wall_clock", "FrameWallClock", "INTEGER"),      # us, Pi clock, UNIX epoch
+    ("exposure_time", "ExposureTime", "INTEGER"),           # us
+    ("analogue_gain", "AnalogueGain", "REAL"),
+    ("digital_gain", "DigitalGain", "REAL"),
+    ("colour_gain_r", ("ColourGains", 0), "REAL"),
+    ("colour_gain_b", ("ColourGains", 1), "REAL"),
+    ("frame_duration", "FrameDuration", "INTEGER"),         # us
+)
+
+def _field(values: dict, key):
+    if isinstance(key, tuple):
+        key, i = key
+        value = values.get(key, None)
+        return value[i] if isinstance(value, list) and i < len(value) else None
+    return values.get(key, None)
+
+def metadata_fields(values: dict) -> list:
+    # The METADATA_FIELDS values of one parsed metadata file, None if absent.
+    return [_field(values, key) for _column, key, _type in METADATA_FIELDS]
+
+def _schema() -> list[str]:
+    metadata_columns = "".join(f", {column} {type}" for column, _key, type in METADATA_FIELDS)
+    return [
+        "CREATE TABLE files ("
+        " kind TEXT NOT NULL, name TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+        " ts REAL NOT NULL, cam INTEGER NOT NULL, data TEXT"
+        f"{metadata_columns},"
+        " PRIMARY KEY (kind, name)) WITHOUT ROWID",
+    ]
+
+class FlightIndex:
+    def __init__(self, path_flight: str, index_path: str | None = None):
+        if index_path is None:
+            index_path = os.path.join(path_flight, INDEX_FILE_NAME)
+        self._path = index_path
+
+        try:
+            self._db = self._open(index_path)
+        except sqlite3.Error as e:
+            # E.g. a read-only flight directory: index in memory for this run.
+            print(f"{index_path}: unable to open index: {e}")
+            self._db = self._open(":memory:")
+
+    @staticmethod
+    def _open(index_path: str) -> sqlite3.Connection:
+        db = sqlite3.connect(index_path)
+        (version,) = db.execute("PRAGMA user_version").fetchone()
+        if version != INDEX_VERSION:
+            with db:
+                db.execute("DROP TABLE IF EXISTS files")
+                for statement in _schema():
+                    db.execute(statement)
+                db.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        return db
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def update(self, kind: str, dir_path: str, re_file_name: str, read_data: bool = False,
+               extra: list[tuple[str, int, int, str | None]] | None = None) -> list[tuple]:
+        # Brings the rows of one kind of file up to date with `dir_path`, and
+        # returns (name, ts, cam, data) for all of them, sorted by name.
+        #
+        # `extra` lists (name, size, mtime_ns, data) of entries that are not
+        # files of their own, e.g. frames in segment files (lib/segment.py).
+        # They are indexed as if they were files in `dir_path`.
+        indexed = {name: (size, mtime_ns) for name, size, mtime_ns in
+                   self._db.execute("SELECT name, size, mtime_ns FROM files WHERE kind = ?", (kind,))}
+
+        seen = set()
+        changed = []
+        try:
+            entries = list(os.scandir(dir_path))
+        except FileNotFoundError:
+            entries = []
+
+        def read(path: str) -> str:
+            with open(path, "r") as f:
+                return f.read()
+
+        candidates = []
+        for entry in entries:
+            if re.fullmatch(re_file_name, entry.name) is None or not entry.is_file():
+                continue
+            stat = entry.stat()
+            candidates.append((entry.name, stat.st_size, stat.st_mtime_ns, lambda path=entry.path: read(path)))
+        for name, size, mtime_ns, data in extra or []:
+            candidates.append((name, size, mtime_ns, lambda data=data: data))
+
+        for name, size, mtime_ns, read_text in candidates:
+            match = re.fullmatch(re_file_name, name)
+            if match is None or name in seen:
+                continue
+            seen.add(name)
+            if indexed.get(name, None) == (size, mtime_ns):
+                continue
+
+            data = None
+            fields = [None] * len(METADATA_FIELDS)
+            if read_data:
+                data = read_text()
+                values = json.loads(data)
+                fields = metadata_fields(values)
+
+            changed.append((kind, name, size, mtime_ns,
+                            float(match["ts"]), int(match["cam"]), data, *fields))
+
+        removed = [(kind, name) for name in indexed.keys() - seen]
+
+        if changed or removed:
+            columns = ", ".join(column for column, _key, _type in METADATA_FIELDS)
+            placeholders = ", ".join("?" * (7 + len(METADATA_FIELDS)))
+            try:
+                with self._db:
+                    self._db.executemany(
+                        f"INSERT OR REPLACE INTO files (kind, name, size, mtime_ns, ts, cam, data, {columns}) VALUES ({placeholders})",
+                        changed)
+                    self._db.executemany("DELETE FROM files WHERE kind = ? AND name = ?", removed)
+            except sqlite3.Error as e:
+                # E.g. an index left in a directory that is now read-only.
+                print(f"{self._path}: unable to update index: {e}")
+                self._db.close()
+                self._db = self._open(":memory:")
+                return self.update(kind, dir_path, re_file_name, read_data, extra)
+
+        return self._db.execute("SELECT name, ts, cam, data FROM files WHERE kind = ? ORDER BY name", (kind,)).fetchall()
+
+    def metadata_columns(self, kind: str) -> dict[str, numpy.ndarray]:
+        # The typed metadata columns of one kind of file, plus "name", "ts" and
+        # "cam", sorted by name. Missing values are NaN in REAL columns and -1
+        # in INTEGER columns.
+        fields = [("ts", "REAL"), ("cam", "INTEGER")] + [(column, type) for column, _key, type in METADATA_FIELDS]
+        names = ["name"] + [column for column, _type in fields]
+        rows = self._db.execute(f"SELECT {', '.join(names)} FROM files WHERE kind = ? ORDER BY name", (kind,)).fetchall()
+
+        result = {"name": numpy.array([row[0] for row in rows], dtype=str)}
+        for i, (column, type) in enumerate(fields, start=1):
+            if type == "INTEGER":
+                result[column] = numpy.array([-1 if row[i] is None else row[i] for row in rows], dtype=numpy.int64)
+            else:
+                result[column] = numpy.array([numpy.nan if row[i] is None else row[i] for row in rows], dtype=numpy.float64)
+        return result
+
+    def close(self):
+        self._db.close()
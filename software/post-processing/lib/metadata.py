@@ -1,25 +1,131 @@
-import json
-import os
-import os.path
-import re
-from collections import defaultdict
-
 import numpy
 
+from lib.index import METADATA_FIELDS, metadata_fields
 from lib.path import Flight, MetadataFile
 
+# Per-flight frame metadata as one numpy structured array, one row per metadata
+# file, in the order of Flight.metadata_files. Row i describes files[i].
+#
+# Integer fields that a file lacks are -1; real fields are NaN.
+
+METADATA_DTYPE = numpy.dtype([
+    ("ts", numpy.float64),                  # s, from the file name (Pi clock)
+    ("cam", numpy.int64),
+    ("sensor_timestamp", numpy.int64),      # ns, sensor clock
+    ("frame_wall_clock", numpy.int64),      # us, Pi clock, UNIX epoch
+    ("exposure_time", numpy.int64),         # us
+    ("analogue_gain", numpy.float64),
+    ("digital_gain", numpy.float64),
+    ("colour_gain_r", numpy.float64),
+    ("colour_gain_b", numpy.float64),
+    ("frame_duration", numpy.int64),        # us
+])
+
+# Scale of each usable grouping clock to seconds.
+CLOCK_SCALE = {
+    "ts": 1.0,
+    "frame_wall_clock": 1.0e-6,
+    "sensor_timestamp": 1.0e-9,
+}
+
 class Metadata:
-    def __init__(self, flight_path: str, camera_names: dict[int, str]):
-        self._d = self._read_dir(flight_path, camera_names)
+    def __init__(self, flight: Flight, camera_names: dict[int, str]):
+        self._camera_names = camera_names
+        self._files = flight.metadata_files
+        self._table = self._read_table(flight)
 
-    def _read_dir(self, flight: Flight, camera_names: dict[int, str]) -> dict[list]:
-        result = defaultdict(list[MetadataFile])
-        for file in flight.metadata_files:
-            file.data["camera_name"] = camera_names[file.cam]
-            result[file.ts].append(file)
+    def _read_table(self, flight: Flight) -> numpy.ndarray:
+        table = numpy.empty(len(self._files), dtype=METADATA_DTYPE)
 
-        return result
+        if flight.index is not None:
+            # Straight from the index columns, without parsing any JSON.
+            columns = flight.index.metadata_columns("meta")
+            for name in METADATA_DTYPE.names:
+                table[name] = columns[name]
+            return table
+
+        table["ts"] = [f.ts for f in self._files]
+        table["cam"] = [f.cam for f in self._files]
+        for i, file in enumerate(self._files):
+            for (column, _key, _type), value in zip(METADATA_FIELDS, metadata_fields(file.data)):
+                if value is None:
+                    value = numpy.nan if table.dtype[column].kind == "f" else -1
+                table[column][i] = value
+        return table
+
+    @property
+    def table(self) -> numpy.ndarray:
+        return self._table
 
     @property
-    def timestamps(self) -> list[float]:
-        return numpy.array(sorted([v["ts"] for v in self._d]), dtype=numpy.float32)
+    def files(self) -> list[MetadataFile]:
+        return self._files
+
+    def camera_name(self, cam: int) -> str:
+        return self._camera_names[cam]
+
+    @property
+    def timestamps(self) -> numpy.ndarray:
+        # Distinct file name timestamps, sorted.
+        return numpy.unique(self._table["ts"])
+
+    def frame_sets(self, tolerance: float = 0.010, clock: str = "frame_wall_clock",
+                   clock_offsets: dict[int, float] | None = None, cams: list[int] | None = None) -> numpy.ndarray:
+        # Groups frames of all cameras into synchronized frame sets.
+        #
+        # Each frame's time is its `clock` column in seconds, plus the offset
+        # for its camera in `clock_offsets` (s), which puts cameras on
+        # different Pis on a common clock. Frames are sorted by that time and
+        # swept once: a frame joins the current set if it lies within
+        # `tolerance` of the set's first frame and its camera is not in the set
+        # yet; otherwise it starts a new set.
+        #
+        # Returns a structured array with one row per set: "ts", the mean time
+        # of its members; "members", the table row of each camera in `cams`
+        # order, -1 where that camera is missing; and "complete".
+        if clock_offsets is None:
+            clock_offsets = {}
+        if cams is None:
+            cams = sorted(int(cam) for cam in numpy.unique(self._table["cam"]))
+        result = numpy.empty(0, dtype=[
+            ("ts", numpy.float64),
+            ("members", numpy.int64, (len(cams),)),
+            ("complete", numpy.bool_),
+        ])
+        if not cams:
+            return result
+        cam_slot = {cam: slot for slot, cam in enumerate(cams)}
+
+        t = self._table[clock].astype(numpy.float64) * CLOCK_SCALE[clock]
+        if clock != "ts":
+            # Files without the clock field fall back to their file name time.
+            t = numpy.where(self._table[clock] < 0, self._table["ts"], t)
+        # Offsets may be given for cameras this flight doesn't have.
+        offsets = numpy.zeros(max(self._table["cam"].max(initial=0), max(cams, default=0)) + 1)
+        for cam, offset in clock_offsets.items():
+            if 0 <= cam < len(offsets):
+                offsets[cam] = offset
+        t = t + offsets[self._table["cam"]]
+
+        order = numpy.argsort(t, kind="stable")
+        keep = numpy.isin(self._table["cam"][order], cams)
+        order = order[keep]
+
+        members = []
+        set_start = None
+        current = None
+        for row, time, cam in zip(order.tolist(), t[order].tolist(), self._table["cam"][order].tolist()):
+            slot = cam_slot[cam]
+            if current is None or time - set_start > tolerance or current[slot] >= 0:
+                current = [-1] * len(cams)
+                members.append(current)
+                set_start = time
+            current[slot] = row
+
+        result = numpy.empty(len(members), dtype=result.dtype)
+        result["members"] = numpy.array(members, dtype=numpy.int64).reshape(-1, len(cams))
+        present = result["members"] >= 0
+        sums = numpy.where(present, t[numpy.maximum(result["members"], 0)], 0.0).sum(axis=1)
+        result["ts"] = sums / numpy.maximum(present.sum(axis=1), 1)
+        result["complete"] = present.all(axis=1)
+        return result
@@ -0,0 +1,179 @@
+import numpy
+
+# Vectorized rotation helpers. Quaternions are (..., 4) arrays, scalar first
+# (w, x, y, z); rotation matrices are (..., 3, 3) arrays. Angles in degrees
+# unless noted.
+#
+# Frames:
+#
+# * NED / FRD: the flight computer's world (north, east, down) and vehicle body
+#   (forward, right, down) frames. ATT roll/pitch/yaw give NED <- FRD.
+# * ENU / RFU: the same two frames with axes (east, north, up) and (right,
+#   forward, up). This is the rig frame of RIG_CAMERAS in log_extract.py.
+# * Camera: OpenSfM convention, x right, y down, z along the view direction.
+#   A rig camera's "rotation" is the angle-axis vector of camera <- rig.
+
+# Swaps the first two axes and flips the third: NED <-> ENU, FRD <-> RFU.
+NED_ENU = numpy.array([[0.0, 1.0, 0.0],
+                       [1.0, 0.0, 0.0],
+                       [0.0, 0.0, -1.0]])
+
+# Camera (x right, y down, z forward) -> photogrammetric image frame (x right,
+# y up, z backward).
+CAMERA_IMAGE = numpy.diag([1.0, -1.0, -1.0])
+
+def euler_to_quaternion(roll: numpy.ndarray, pitch: numpy.ndarray, yaw: numpy.ndarray) -> numpy.ndarray:
+    # Aerospace Z-Y-X sequence, world <- body = R_z(yaw) R_y(pitch) R_x(roll).
+    r = numpy.radians(numpy.asarray(roll, dtype=numpy.float64)) * 0.5
+    p = numpy.radians(numpy.asarray(pitch, dtype=numpy.float64)) * 0.5
+    y = numpy.radians(numpy.asarray(yaw, dtype=numpy.float64)) * 0.5
+    cr, sr = numpy.cos(r), numpy.sin(r)
+    cp, sp = numpy.cos(p), numpy.sin(p)
+    cy, sy = numpy.cos(y), numpy.sin(y)
+    return numpy.stack([
+        cr * cp * cy + sr * sp * sy,
+        sr * cp * cy - cr * sp * sy,
+        cr * sp * cy + sr * cp * sy,
+        cr * cp * sy - sr * sp * cy,
+    ], axis=-1)
+
+def quaternion_to_euler(q: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    # Inverse of euler_to_quaternion(). Yaw is returned in [0, 360), like ATT.
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    roll = numpy.arctan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + y * y))
+    pitch = numpy.arcsin(numpy.clip(2.0 * (w * y - z * x), -1.0, 1.0))
+    yaw = numpy.arctan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+    return numpy.degrees(roll), numpy.degrees(pitch), numpy.mod(numpy.degrees(yaw), 360.0)
+
+def quaternion_continuous(q: numpy.ndarray) -> numpy.ndarray:
+    # q and -q are the same rotation. Flip signs along the sequence so that
+    # neighbours are in the same hemisphere, and interpolation takes the short
+    # way round.
+    if len(q) < 2:
+        return q
+    dots = numpy.einsum("ij,ij->i", q[:-1], q[1:])
+    signs = numpy.concatenate([[1.0], numpy.cumprod(numpy.where(dots < 0.0, -1.0, 1.0))])
+    return q * signs[:, numpy.newaxis]
+
+def quaternion_slerp(q0: numpy.ndarray, q1: numpy.ndarray, w: numpy.ndarray) -> numpy.ndarray:
+    w = numpy.asarray(w, dtype=numpy.float64)[..., numpy.newaxis]
+    dot = numpy.einsum("...i,...i->...", q0, q1)[..., numpy.newaxis]
+    q1 = numpy.where(dot < 0.0, -q1, q1)
+    dot = numpy.abs(dot)
+
+    theta = numpy.arccos(numpy.clip(dot, -1.0, 1.0))
+    sin_theta = numpy.sin(theta)
+    # Nearly identical rotations: fall back to normalized linear interpolation.
+    small = sin_theta < 1.0e-6
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        a = numpy.where(small, 1.0 - w, numpy.sin((1.0 - w) * theta) / sin_theta)
+        b = numpy.where(small, w, numpy.sin(w * theta) / sin_theta)
+    q = a * q0 + b * q1
+    return q / numpy.linalg.norm(q, axis=-1, keepdims=True)
+
+def quaternion_to_matrix(q: numpy.ndarray) -> numpy.ndarray:
+    # Matrix of the rotation that maps body coordinates to world coordinates,
+    # for a quaternion from euler_to_quaternion().
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    m = numpy.empty(q.shape[:-1] + (3, 3), dtype=numpy.float64)
+    m[..., 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    m[..., 0, 1] = 2.0 * (x * y - w * z)
+    m[..., 0, 2] = 2.0 * (x * z + w * y)
+    m[..., 1, 0] = 2.0 * (x * y + w * z)
+    m[..., 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    m[..., 1, 2] = 2.0 * (y * z - w * x)
+    m[..., 2, 0] = 2.0 * (x * z - w * y)
+    m[..., 2, 1] = 2.0 * (y * z + w * x)
+    m[..., 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    return m
+
+def matrix_to_quaternion(m: numpy.ndarray) -> numpy.ndarray:
+    # Inverse of quaternion_to_matrix(), with w >= 0.
+    t = numpy.stack([
+        1.0 + m[..., 0, 0] + m[..., 1, 1] + m[..., 2, 2],
+        1.0 + m[..., 0, 0] - m[..., 1, 1] - m[..., 2, 2],
+        1.0 - m[..., 0, 0] + m[..., 1, 1] - m[..., 2, 2],
+        1.0 - m[..., 0, 0] - m[..., 1, 1] + m[..., 2, 2],
+    ], axis=-1)
+    # Take the square root of the largest diagonal term for stability.
+    largest = numpy.argmax(t, axis=-1)
+    s = numpy.sqrt(numpy.take_along_axis(t, largest[..., numpy.newaxis], axis=-1))[..., 0] * 2.0
+    q = numpy.empty(m.shape[:-2] + (4,), dtype=numpy.float64)
+
+    cases = [
+        (m[..., 2, 1] - m[..., 1, 2], m[..., 0, 2] - m[..., 2, 0], m[..., 1, 0] - m[..., 0, 1]),
+        (m[..., 2, 1] - m[..., 1, 2], m[..., 0, 1] + m[..., 1, 0], m[..., 0, 2] + m[..., 2, 0]),
+        (m[..., 0, 2] - m[..., 2, 0], m[..., 0, 1] + m[..., 1, 0], m[..., 1, 2] + m[..., 2, 1]),
+        (m[..., 1, 0] - m[..., 0, 1], m[..., 0, 2] + m[..., 2, 0], m[..., 1, 2] + m[..., 2, 1]),
+    ]
+    for case, (a, b, c) in enumerate(cases):
+        sel = largest == case
+        k = s[sel]
+        others = [a[sel] / k, b[sel] / k, c[sel] / k]
+        others.insert(case, 0.25 * k)
+        q[sel] = numpy.stack(others, axis=-1)
+
+    return q * numpy.where(q[..., :1] < 0.0, -1.0, 1.0)
+
+def rotation_vector_to_matrix(v) -> numpy.ndarray:
+    # Rodrigues' formula, for an angle-axis vector in radians.
+    v = numpy.asarray(v, dtype=numpy.float64)
+    theta = numpy.linalg.norm(v)
+    if theta < 1.0e-12:
+        return numpy.eye(3)
+    k = v / theta
+    K = numpy.array([[0.0, -k[2], k[1]],
+                     [k[2], 0.0, -k[0]],
+                     [-k[1], k[0], 0.0]])
+    return numpy.eye(3) + numpy.sin(theta) * K + (1.0 - numpy.cos(theta)) * K.dot(K)
+
+def matrix_to_opk(m: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    # Omega/phi/kappa of a world <- image rotation, m = R_x(omega) R_y(phi) R_z(kappa).
+    omega = numpy.arctan2(-m[..., 1, 2], m[..., 2, 2])
+    phi = numpy.arcsin(numpy.clip(m[..., 0, 2], -1.0, 1.0))
+    kappa = numpy.arctan2(-m[..., 0, 1], m[..., 0, 0])
+    return numpy.degrees(omega), numpy.degrees(phi), numpy.degrees(kappa)
+
+def matrix_to_ypr(m: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    # Yaw/pitch/roll of a world <- body rotation, m = R_z(yaw) R_y(pitch) R_x(roll).
+    yaw = numpy.arctan2(m[..., 1, 0], m[..., 0, 0])
+    pitch = -numpy.arcsin(numpy.clip(m[..., 2, 0], -1.0, 1.0))
+    roll = numpy.arctan2(m[..., 2, 1], m[..., 2, 2])
+    return numpy.degrees(yaw), numpy.degrees(pitch), numpy.degrees(roll)
+
+# One quarter turn counter-clockwise of the displayed image, as a rotation of
+# camera axes (new <- old): the old right edge becomes the top.
+CAMERA_QUARTER_TURN = numpy.array([[0.0, 1.0, 0.0],
+                                   [-1.0, 0.0, 0.0],
+                                   [0.0, 0.0, 1.0]])
+
+def camera_orientations(vehicle_q: numpy.ndarray, rig_rotation, image_turns: int = 0) -> dict[str, numpy.ndarray]:
+    # Orientation priors of one rig camera for every frame, from the vehicle
+    # attitude quaternions (NED <- FRD) at the frame times. `image_turns` is the
+    # number of quarter turns counter-clockwise that viewers apply to the image,
+    # e.g. 1 for EXIF orientation 8 ("Rotate 270 CW").
+    #
+    # Returns, per frame:
+    # * "quaternion": ENU <- camera (OpenSfM camera axes),
+    # * "omega", "phi", "kappa": photogrammetric angles, ENU <- image,
+    # * "yaw", "pitch", "roll": the camera angles ODM reads from geo.txt, where
+    #   (0, 0, 0) is a nadir camera with the top of the image pointing north.
+    ned_frd = quaternion_to_matrix(vehicle_q)
+    enu_rfu = NED_ENU @ ned_frd @ NED_ENU
+    enu_camera = enu_rfu @ rotation_vector_to_matrix(rig_rotation).T
+    enu_camera = enu_camera @ numpy.linalg.matrix_power(CAMERA_QUARTER_TURN, image_turns % 4).T
+    enu_image = enu_camera @ CAMERA_IMAGE
+
+    omega, phi, kappa = matrix_to_opk(enu_image)
+    # ODM's image -> body convention swaps x/y and flips z, like NED_ENU.
+    yaw, pitch, roll = matrix_to_ypr(NED_ENU @ enu_image @ NED_ENU)
+
+    return {
+        "quaternion": matrix_to_quaternion(enu_camera),
+        "omega": omega,
+        "phi": phi,
+        "kappa": kappa,
+        "yaw": yaw,
+        "pitch": pitch,
+        "roll": roll,
+    }
@@ -4,16 +4,38 @@ import glob
 import os.path
 import re
 
+import numpy
+
 from lib.flight_log import FlightLog
+from lib.index import FlightIndex
+from lib.raw import imx477_raw_read
+from lib.segment import SegmentFrame, read_segment
 
-FILESPEC_IMAGE_RAW = "*_c?.srggb16"
-RE_FILENAME_IMAGE_RAW = r"(?P<ts>\d+\.\d+)_c(?P<cam>\d+).srggb16"
+# Raw frames are "*.srggb16" as captured, or "*.srggb12p"/"*.srggb12z" when
+# c.py packs or compresses them (see lib/raw.py).
+FILESPEC_IMAGE_RAW = "*_c?.srggb1[62]*"
+RE_FILENAME_IMAGE_RAW = r"(?P<ts>\d+\.\d+)_c(?P<cam>\d+)\.(srggb16|srggb12p|srggb12z)"
 
 FILESPEC_METADATA = "*_c?.json"
 RE_FILENAME_METADATA = r"(?P<ts>\d+\.\d+)_c(?P<cam>\d+).json"
 
+# mavlink_record.py writes text, or with --tlog binary MAVLink (lib/tlog.py).
+FILESPEC_SYNC = "*_fc.txt"
+FILESPEC_SYNC_TLOG = "*_fc.tlog"
+# TIMESYNC samples from mavlink_record.py (see lib/time_map.py).
+FILESPEC_TIMESYNC = "*_fc.timesync"
+
+# IMU, pressure and SYNC edges from usb_rx.py (see lib/sensors.py).
+FILESPEC_SENSORS = "*_sensors.dat"
+
+# Segment files (lib/segment.py) live with the raw files. Their frames appear
+# as RawFile and MetadataFile objects like any other, with virtual paths named
+# as c.py would have named the frame's own files.
+FILESPEC_SEGMENT = "*_c?.seg"
+
 class RawFile:
-    def __init__(self, path: str):
+    # `segment` is set for a frame in a segment file.
+    def __init__(self, path: str, segment: SegmentFrame | None = None):
         _dir_path_raw, file_name = os.path.split(path)
         file_name_base, file_name_ext = os.path.splitext(file_name)
         match = re.fullmatch(RE_FILENAME_IMAGE_RAW, file_name)
@@ -22,6 +44,7 @@ class RawFile:
         self._path = path
         self._file_name = file_name
         self._file_name_base = file_name_base
+        self._segment = segment
 
     @property
     def ts(self) -> float:
@@ -47,8 +70,20 @@ class RawFile:
     def file_name_base(self) -> str:
         return self._file_name_base
 
+    @property
+    def segment(self) -> SegmentFrame | None:
+        return self._segment
+
+    def read(self, shape: tuple) -> numpy.ndarray:
+        # The frame's samples; see lib.raw.imx477_raw_read().
+        if self._segment is None:
+            return imx477_raw_read(self._path, shape)
+        return imx477_raw_read(self._segment.path, shape, offset=self._segment.offset, format=self._segment.format)
+
 class MetadataFile:
-    def __init__(self, path: str):
+    # `data_text` is the file's JSON, when already known (e.g. from the flight
+    # index). Otherwise the file is read on first access to `data`.
+    def __init__(self, path: str, data_text: str | None = None):
         _dir_path_raw, file_name = os.path.split(path)
         file_name_base, file_name_ext = os.path.splitext(file_name)
         match = re.fullmatch(RE_FILENAME_METADATA, file_name)
@@ -57,8 +92,8 @@ class MetadataFile:
         self._path = path
         self._file_name = file_name
         self._file_name_base = file_name_base
-        with open(path, "r") as f:
-            self._data = json.load(f)
+        self._data_text = data_text
+        self._data = None
 
     @property
     def ts(self) -> float:
@@ -86,20 +121,48 @@ class MetadataFile:
 
     @property
     def data(self) -> dict:
+        if self._data is None:
+            if self._data_text is not None:
+                self._data = json.loads(self._data_text)
+            else:
+                with open(self._path, "r") as f:
+                    self._data = json.load(f)
         return self._data
 
 class Flight:
-    def __init__(self, path_flight: str, file_name_log: str):
+    # File lists come from the flight index ("<flight_dir>/index.sqlite") and
+    # are built once per Flight. With use_index=False the directories are
+    # globbed instead, as before.
+    def __init__(self, path_flight: str, file_name_log: str, use_index: bool = True):
         self._path = path_flight
 
         path_log = os.path.join(path_flight, file_name_log)
         self._log = FlightLog(path_log)
 
+        self._index = FlightIndex(path_flight) if use_index else None
+        self._raw_files = None
+        self._metadata_files = None
+        self._metadata_by_base = None
+        self._raw_by_base = None
+        self._segment_frames = None
+
     def metadata_for_raw_file(self, raw_file: RawFile) -> MetadataFile:
+        if self._metadata_by_base is None:
+            self._metadata_by_base = {f.file_name_base: f for f in self.metadata_files}
+        metadata_file = self._metadata_by_base.get(raw_file.file_name_base, None)
+        if metadata_file is not None:
+            return metadata_file
+
         path = os.path.join(self.path_meta, raw_file.file_name_base + ".json")
         return MetadataFile(path)
 
     def raw_file_for_metadata(self, metadata_file: MetadataFile) -> RawFile:
+        if self._raw_by_base is None:
+            self._raw_by_base = {f.file_name_base: f for f in self.raw_files}
+        raw_file = self._raw_by_base.get(metadata_file.file_name_base, None)
+        if raw_file is not None:
+            return raw_file
+
         path = os.path.join(self.path_raw, metadata_file.file_name_base + ".srggb16")
         return RawFile(path)
 
@@ -115,14 +178,70 @@ class Flight:
     def path_raw(self) -> str:
         return os.path.join(self._path, "raw")
 
+    @property
+    def path_sync(self) -> str:
+        return os.path.join(self._path, "sync")
+
+    @property
+    def path_sensors(self) -> str:
+        return os.path.join(self._path, "sensors")
+
+    @property
+    def sensor_files(self) -> list[str]:
+        return sorted(glob.glob(os.path.join(self.path_sensors, FILESPEC_SENSORS)))
+
+    @property
+    def sync_files(self) -> list[str]:
+        paths = []
+        for filespec in (FILESPEC_SYNC, FILESPEC_SYNC_TLOG):
+            paths.extend(glob.glob(os.path.join(self.path_sync, filespec)))
+        return sorted(paths)
+
+    @property
+    def timesync_files(self) -> list[str]:
+        return sorted(glob.glob(os.path.join(self.path_sync, FILESPEC_TIMESYNC)))
+
+    @property
+    def index(self) -> FlightIndex | None:
+        return self._index
+
+    @property
+    def segment_frames(self) -> list[SegmentFrame]:
+        if self._segment_frames is None:
+            frames = []
+            for path in sorted(glob.glob(os.path.join(self.path_raw, FILESPEC_SEGMENT))):
+                frames.extend(read_segment(path))
+            self._segment_frames = frames
+        return self._segment_frames
+
     @property
     def raw_files(self) -> list[RawFile]:
-        filespec = os.path.join(self.path_raw, FILESPEC_IMAGE_RAW)
-        files = glob.glob(filespec)
-        return [RawFile(path) for path in sorted(files)]
+        if self._raw_files is None:
+            if self._index is not None:
+                rows = self._index.update("raw", self.path_raw, RE_FILENAME_IMAGE_RAW)
+                paths = [os.path.join(self.path_raw, name) for name, _ts, _cam, _data in rows]
+            else:
+                paths = sorted(glob.glob(os.path.join(self.path_raw, FILESPEC_IMAGE_RAW)))
+                paths = [path for path in paths if re.fullmatch(RE_FILENAME_IMAGE_RAW, os.path.basename(path))]
+            raw_files = [RawFile(path) for path in paths]
+            for frame in self.segment_frames:
+                raw_files.append(RawFile(os.path.join(self.path_raw, f"{frame.name}.{frame.format}"), frame))
+            self._raw_files = sorted(raw_files, key=lambda f: f.file_name)
+        return self._raw_files
 
     @property
     def metadata_files(self) -> list[MetadataFile]:
-        filespec = os.path.join(self.path_meta, FILESPEC_METADATA)
-        files = glob.glob(filespec)
-        return [MetadataFile(path) for path in sorted(files)]
+        if self._metadata_files is None:
+            if self._index is not None:
+                extra = []
+                for frame in self.segment_frames:
+                    extra.append((frame.name + ".json", len(frame.metadata_text), frame.mtime_ns, frame.metadata_text))
+                rows = self._index.update("meta", self.path_meta, RE_FILENAME_METADATA, read_data=True, extra=extra)
+                self._metadata_files = [MetadataFile(os.path.join(self.path_meta, name), data) for name, _ts, _cam, data in rows]
+            else:
+                paths = sorted(glob.glob(os.path.join(self.path_meta, FILESPEC_METADATA)))
+                metadata_files = [MetadataFile(path) for path in paths]
+                for frame in self.segment_frames:
+                    metadata_files.append(MetadataFile(os.path.join(self.path_meta, frame.name + ".json"), frame.metadata_text))
+                self._metadata_files = sorted(metadata_files, key=lambda f: f.file_name)
+        return self._metadata_files
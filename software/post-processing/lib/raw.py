@@ -1,9 +1,177 @@
+import os.path
+import struct
+import zlib
+
 import numpy
 
-def imx477_raw_read(file_path: str, shape: tuple) -> numpy.ndarray:
+# IMX477 full-resolution raw frames, as written by c.py: 3040 rows of 4064
+# uint16 samples. Only the first 4056 samples of each row are image; the rest
+# is a narrow black strip along the right side.
+#
+# With `c.py --format srggb12p` the strip is cropped and samples are packed
+# two to three bytes (see home/raw_pack.py in camera-computer). Those files
+# are unpacked on read into the same left-aligned uint16 samples.
+#
+# With `c.py --format srggb12z` frames are also compressed losslessly (see
+# home/raw_codec.py): per-colour deltas, zigzag-coded, byte-shuffled and
+# deflated. decode_compressed() undoes that.
+IMX477_STRIDE = 4064
+IMX477_WIDTH = 4056
+IMX477_HEIGHT = 3040
+
+RAW_FORMAT_PACKED = "srggb12p"
+RAW_FORMAT_COMPRESSED = "srggb12z"
+
+COMPRESSED_MAGIC = b"GDZ1"
+COMPRESSED_HEADER = struct.Struct("<4sHHI")         # magic, height, width, zlib stream size
+
+def imx477_raw_map(file_path: str, shape: tuple, width: int | None = IMX477_WIDTH, offset: int = 0) -> numpy.ndarray:
+    # Map the file read-only and return a (height, width) view of it. Cropping
+    # the black strip is just a narrower view, so nothing is copied; pages are
+    # only read from disk as rows are touched. `offset` is where the frame
+    # starts in the file, e.g. in a segment (lib/segment.py).
     stride, height = shape
 
-    data = numpy.fromfile(file_path, dtype=numpy.uint16)
-    data = data.reshape((height, stride))
+    data = numpy.memmap(file_path, dtype=numpy.uint16, mode="r", shape=(height, stride), offset=offset)
+    if width is not None and width < stride:
+        data = data[:, :width]
 
     return data
+
+def imx477_raw_read(file_path: str, shape: tuple, width: int | None = IMX477_WIDTH,
+                    offset: int = 0, format: str | None = None) -> numpy.ndarray:
+    # `shape` is (stride, height) of an unpacked frame. Packed and compressed
+    # frames have no strip to crop, so `width` is ignored for them. `format`
+    # ("srggb16", "srggb12p" or "srggb12z") goes by the file extension unless
+    # given.
+    if format is None:
+        format = os.path.splitext(file_path)[1][1:]
+    if format == RAW_FORMAT_PACKED:
+        return imx477_packed_read(file_path, shape[1], offset)
+    if format == RAW_FORMAT_COMPRESSED:
+        return imx477_compressed_read(file_path, offset)
+    return imx477_raw_map(file_path, shape, width, offset)
+
+def imx477_compressed_read(file_path: str, offset: int = 0) -> numpy.ndarray:
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        header = f.read(COMPRESSED_HEADER.size)
+        _magic, _height, _width, size = COMPRESSED_HEADER.unpack(header)
+        return decode_compressed(header + f.read(size))
+
+def decode_compressed(frame: bytes) -> numpy.ndarray:
+    # A "*.srggb12z" frame -> (height, width) uint16 samples, left-aligned
+    # like SRGGB16.
+    magic, height, width, size = COMPRESSED_HEADER.unpack_from(frame)
+    if magic != COMPRESSED_MAGIC:
+        raise ValueError("not a compressed raw frame")
+    planes = numpy.frombuffer(zlib.decompress(frame[COMPRESSED_HEADER.size:COMPRESSED_HEADER.size + size]), dtype=numpy.uint8)
+    zigzag = numpy.ascontiguousarray(planes.reshape(2, -1).T).view(numpy.uint16).reshape(height, width).astype(numpy.int32)
+    residuals = (zigzag >> 1) ^ -(zigzag & 1)
+
+    # Undo the deltas: down the first two columns, then along each row, one
+    # colour (every other column) at a time.
+    for row in range(2):
+        residuals[row::2, :2] = numpy.cumsum(residuals[row::2, :2], axis=0)
+    samples = numpy.empty((height, width), dtype=numpy.uint16)
+    for col in range(2):
+        samples[:, col::2] = numpy.cumsum(residuals[:, col::2], axis=1) << 4
+    return samples
+
+def imx477_packed_read(file_path: str, height: int = IMX477_HEIGHT, offset: int = 0) -> numpy.ndarray:
+    # Unpack a "*.srggb12p" frame into (height, IMX477_WIDTH) uint16 samples,
+    # left-aligned like SRGGB16.
+    row_bytes = IMX477_WIDTH // 2 * 3
+    packed = numpy.fromfile(file_path, dtype=numpy.uint8, count=height * row_bytes, offset=offset)
+    return unpack12(packed.reshape(height, row_bytes), 4)
+
+def pack12(data: numpy.ndarray, shift: int = 0, out: numpy.ndarray | None = None) -> numpy.ndarray:
+    # Pack pairs of 12-bit samples into three bytes, most significant bits
+    # first (the TIFF/DNG bit order). `shift` drops low-order bits first, so
+    # left-aligned SRGGB16 samples can be packed without a separate pass.
+    rows, width = data.shape
+    if out is None:
+        out = numpy.empty((rows, width // 2 * 3), dtype=numpy.uint8)
+
+    even = data[:, 0::2]
+    odd = data[:, 1::2]
+    if shift:
+        even = even >> shift
+        odd = odd >> shift
+
+    out[:, 0::3] = even >> 4
+    out[:, 1::3] = ((even & 0x0F) << 4) | (odd >> 8)
+    out[:, 2::3] = odd & 0xFF
+
+    return out
+
+def unpack12(packed: numpy.ndarray, shift: int = 0, out: numpy.ndarray | None = None) -> numpy.ndarray:
+    # Inverse of pack12(): (rows, width // 2 * 3) bytes -> (rows, width)
+    # samples, shifted left by `shift` bits (4 for left-aligned SRGGB16).
+    rows = packed.shape[0]
+    b0 = packed[:, 0::3].astype(numpy.uint16)
+    b1 = packed[:, 1::3].astype(numpy.uint16)
+    b2 = packed[:, 2::3].astype(numpy.uint16)
+    if out is None:
+        out = numpy.empty((rows, b0.shape[1] * 2), dtype=numpy.uint16)
+
+    b0 <<= 4 + shift
+    b2 <<= shift
+    b2 |= (b1 & 0x0F) << (8 + shift)
+    b1 >>= 4
+    if shift:
+        b1 <<= shift
+    b0 |= b1
+    out[:, 0::2] = b0
+    out[:, 1::2] = b2
+
+    return out
+
+class RawFrame:
+    def __init__(self, file_path: str, shape: tuple = (IMX477_STRIDE, IMX477_HEIGHT), width: int | None = IMX477_WIDTH):
+        self._path = file_path
+        self._data = imx477_raw_map(file_path, shape, width)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def data(self) -> numpy.ndarray:
+        return self._data
+
+    @property
+    def shape(self) -> tuple:
+        return self._data.shape
+
+    @property
+    def height(self) -> int:
+        return self._data.shape[0]
+
+    @property
+    def width(self) -> int:
+        return self._data.shape[1]
+
+    def band(self, row: int, rows: int) -> numpy.ndarray:
+        return self._data[row:row + rows]
+
+    def bands(self, rows: int):
+        # Yields (row, view) for consecutive bands of `rows` rows. Keep `rows`
+        # even so that every band starts on the same Bayer phase.
+        for row in range(0, self.height, rows):
+            yield row, self._data[row:row + rows]
+
+    def tiles(self, rows: int, cols: int):
+        # Yields (row, col, view) for a grid of tiles, row band by row band.
+        for row, band in self.bands(rows):
+            for col in range(0, self.width, cols):
+                yield row, col, band[:, col:col + cols]
+
+    def channel_means(self, rows: int = 64) -> numpy.ndarray:
+        # Mean of each of the four Bayer sites, as a 2x2 array in CFA order.
+        sums = numpy.zeros((2, 2), dtype=numpy.float64)
+        for _row, band in self.bands(rows):
+            for y in range(2):
+                for x in range(2):
+                    sums[y, x] += band[y::2, x::2].sum(dtype=numpy.uint64)
+        return sums / (self.height * self.width / 4)
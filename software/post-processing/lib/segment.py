@@ -0,0 +1,83 @@
+import os
+import struct
+
+# Reader for segment files written by `c.py --segment-size` (home/segment.py
+# in camera-computer): many frames of one camera in one "<ts>_c<cam>.seg"
+# file, each frame a record header with the frame's metadata JSON, followed
+# by its raw data. All offsets are multiples of the alignment in the file
+# header.
+
+SEGMENT_MAGIC = b"GDSEGMNT"
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct("<8sII")             # magic, version, alignment
+
+RECORD_MAGIC = b"GDFRAME\x00"
+RECORD = struct.Struct("<8s32s16sQQI")              # magic, name, format, data offset, data size, metadata size
+
+class SegmentFrame:
+    def __init__(self, path: str, mtime_ns: int, name: str, format: str, offset: int, size: int, metadata_text: str):
+        self._path = path
+        self._mtime_ns = mtime_ns
+        self._name = name
+        self._format = format
+        self._offset = offset
+        self._size = size
+        self._metadata_text = metadata_text
+
+    @property
+    def path(self) -> str:
+        # The segment file.
+        return self._path
+
+    @property
+    def mtime_ns(self) -> int:
+        # Of the segment file, when it was read.
+        return self._mtime_ns
+
+    @property
+    def name(self) -> str:
+        # What c.py would have named the frame's files, without extension,
+        # e.g. "1755721200.000_c0".
+        return self._name
+
+    @property
+    def format(self) -> str:
+        # "srggb16" or "srggb12p".
+        return self._format
+
+    @property
+    def offset(self) -> int:
+        return self._offset
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def metadata_text(self) -> str:
+        return self._metadata_text
+
+def read_segment(path: str) -> list[SegmentFrame]:
+    # The frames of a segment, in file order. Reading stops at the first
+    # record without a valid header: the unused tail of a segment, or a frame
+    # that was being written when capture stopped.
+    frames = []
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        file_size = stat.st_size
+        magic, version, align = SEGMENT_HEADER.unpack(f.read(SEGMENT_HEADER.size))
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+            print(f"{path}: not a segment file")
+            return frames
+
+        offset = align
+        while offset + RECORD.size <= file_size:
+            f.seek(offset)
+            magic, name, format, data_offset, data_size, metadata_size = RECORD.unpack(f.read(RECORD.size))
+            if magic != RECORD_MAGIC or data_offset + data_size > file_size:
+                break
+            metadata_text = f.read(metadata_size).decode("utf-8")
+            frames.append(SegmentFrame(path, stat.st_mtime_ns, name.rstrip(b"\0").decode("ascii"), format.rstrip(b"\0").decode("ascii"),
+                                       data_offset, data_size, metadata_text))
+            offset = (data_offset + data_size + align - 1) // align * align
+    return frames
@@ -0,0 +1,404 @@
+import os.path
+import re
+
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+
+from lib.dataflash import follow_chain
+
+# Vectorized decoder for "<ts>_sensors.dat", the stream usb_rx.py records
+# from the KB2040 data logger (firmware/data-logger-rs). usb_rx.py writes the
+# USB bulk packets as they arrive, with no framing of its own. The firmware
+# has sent two layouts:
+#
+# * "fifo" (the current firmware): the ICM-20948's FIFO, read out 64 bytes at
+#   a time from a FIFO reset at the start of streaming. Records of 12 bytes,
+#   accelerometer X, Y, Z then gyroscope X, Y, Z, big-endian int16, run
+#   across packet boundaries. There are no timestamps, and the sample rate is
+#   not known up front: the firmware disables both DLPFs, and then the
+#   sensor's sample rate dividers don't apply. usb_rx.py records the Pi time
+#   and byte count of each transfer in "<ts>_sensors.times" (TIMES_DTYPE); the
+#   rate is the record count between these times, and a lasting jump in the
+#   times against the byte count is a gap, e.g. a FIFO overflow. Files
+#   without a .times file are bracketed by the time in the file name and the
+#   file's modification time instead, and gaps go unnoticed. A copy that
+#   doesn't keep modification times breaks that bracket, so a rate further
+#   than MTIME_RATE_TOLERANCE from FIFO_RATE is replaced by FIFO_RATE, with a
+#   warning.
+#
+#   A FIFO overflow can also leave the records misaligned. Records are
+#   checked in windows of ALIGN_WINDOW: the median acceleration should be
+#   close to 1 g, and consecutive samples close to each other, which records
+#   cut at the wrong byte are not. From a window that fails, or one with a
+#   timing gap, every byte alignment is tried, and the window is dropped if
+#   none fits. Alignments a whole number of values apart only swap the axes,
+#   so of those that fit, the one closest to the last good window is taken.
+#   Such a shift without a timing gap goes unnoticed.
+#
+# * "tagged" (the firmware's sensor tasks, commented out in main.rs): a tag
+#   byte, the embassy tick count as 24-bit big-endian (1 MHz, wrapping every
+#   16.8 s), then a payload depending on the tag:
+#
+#     'I'  accelerometer X, Y, Z, gyroscope X, Y, Z; big-endian int16
+#     'A'  accelerometer X, Y, Z; big-endian int16
+#     'P'  BMP390 pressure (Pa), temperature (degrees C); big-endian float32
+#     '0'  SYNC input went low; no payload
+#     '1'  SYNC input went high; no payload
+#
+#   Records are found as in lib/dataflash.py: every tag byte is a candidate,
+#   and the chain of record lengths is followed from the start of the file.
+#   usb_rx.py pulls SYNC low just before it names the file, so the first '0'
+#   edge is taken to be at the time in the file name.
+#
+# A record cut short at the end of a file is dropped.
+
+FIFO_RECORD_LENGTH = 12
+FIFO_RATE = 1125.0                  # Hz, nominal; only for files with nothing to fit a rate to
+MTIME_RATE_TOLERANCE = 0.1          # of FIFO_RATE, for a rate from the modification time
+
+TIMES_DTYPE = numpy.dtype([("ts", "<f8"), ("bytes", "<u8")])    # Pi wall clock, s; bytes received so far
+
+# A lasting step of more than this in the transfer times, against the byte
+# count, is a gap.
+GAP_TOLERANCE = 0.05                # s
+
+ALIGN_WINDOW = 1024                 # records
+ALIGN_TOLERANCE = 0.5               # g, of the median acceleration from 1 g
+ALIGN_ROUGHNESS = 2.0               # g, median step between consecutive accelerometer samples
+
+# Tagged records: a step in the IMU ticks of more than this many times the
+# median step is a gap.
+TAGGED_GAP_FACTOR = 3.0
+
+ACCEL_RANGE = 16.0                  # g, acc_range(Gs16) in the firmware
+GYRO_RANGE = 1000.0                 # degrees/s, the icm20948-async default
+ACCEL_SCALE = ACCEL_RANGE / 32768.0                     # g per LSB
+GYRO_SCALE = numpy.radians(GYRO_RANGE) / 32768.0        # rad/s per LSB
+
+TAG_HEADER_LENGTH = 4
+TAG_PAYLOAD_LENGTHS = {
+    b"I": 12,
+    b"A": 6,
+    b"P": 8,
+    b"0": 0,
+    b"1": 0,
+}
+TICK_RATE = 1.0e6
+TICK_BITS = 24
+
+# Share of a file the tagged record chain must cover for "auto" to take the
+# file as tagged.
+TAGGED_COVERAGE = 0.9
+
+RE_FILENAME_SENSORS = re.compile(r"(?P<ts>\d+\.\d+)_sensors\.dat$")
+
+COLUMNS = {
+    "imu_ts": (0,),
+    "imu_gap": (0,),                # True: samples were lost before this one
+    "imu_accel": (0, 3),            # g
+    "imu_gyro": (0, 3),             # rad/s
+    "accel_ts": (0,),
+    "accel_accel": (0, 3),          # g
+    "pressure_ts": (0,),
+    "pressure_pa": (0,),            # Pa
+    "pressure_temperature": (0,),   # degrees C
+    "sync_ts": (0,),
+    "sync_level": (0,),             # True: high
+}
+
+def _empty_columns() -> dict[str, numpy.ndarray]:
+    columns = {name: numpy.zeros(shape) for name, shape in COLUMNS.items()}
+    columns["imu_gap"] = numpy.zeros(0, dtype=bool)
+    columns["sync_level"] = numpy.zeros(0, dtype=bool)
+    return columns
+
+def _start_time(path: str) -> float:
+    match = RE_FILENAME_SENSORS.search(os.path.basename(path))
+    return float(match["ts"]) if match else 0.0
+
+def _tagged_chain(data: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+    # Offsets and tags of the tagged records.
+    lengths = numpy.zeros(256, dtype=numpy.int64)
+    for tag, length in TAG_PAYLOAD_LENGTHS.items():
+        lengths[tag[0]] = TAG_HEADER_LENGTH + length
+
+    candidates = numpy.flatnonzero(lengths[data] > 0).astype(numpy.int64)
+    tags = data[candidates]
+    ends = candidates + lengths[tags]
+    keep = ends <= len(data)
+    candidates = candidates[keep]
+    tags = tags[keep]
+    ends = ends[keep]
+    on_chain = follow_chain(numpy.searchsorted(candidates, ends))
+    return candidates[on_chain], tags[on_chain]
+
+def _read_times(path: str) -> numpy.ndarray:
+    times_path = re.sub(r"\.dat$", ".times", path)
+    if times_path == path or not os.path.exists(times_path):
+        return numpy.zeros(0, dtype=TIMES_DTYPE)
+    with open(times_path, "rb") as f:
+        data = f.read()
+    return numpy.frombuffer(data[:len(data) // TIMES_DTYPE.itemsize * TIMES_DTYPE.itemsize], dtype=TIMES_DTYPE)
+
+def _fifo_stats(rows: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+    # For (windows, records, 6) samples: the median of each column, in g and
+    # rad/s, and whether the records look like accelerometer and gyroscope
+    # samples.
+    medians = numpy.median(rows, axis=1) * numpy.repeat([ACCEL_SCALE, GYRO_SCALE], 3)
+    fits = numpy.abs(numpy.sqrt((medians[:, 0:3] ** 2).sum(axis=1)) - 1.0) < ALIGN_TOLERANCE
+    if rows.shape[1] > 1:
+        steps = numpy.abs(numpy.diff(rows[:, :, 0:3].astype(numpy.int32), axis=1)).reshape(len(rows), -1)
+        fits &= numpy.median(steps, axis=1) * ACCEL_SCALE < ALIGN_ROUGHNESS
+    return medians, fits
+
+def _fifo_window(data: numpy.ndarray, window: int, phase: int) -> tuple[numpy.ndarray | None, bool]:
+    # _fifo_stats() of one window, with its records starting `phase` bytes in.
+    start = window * ALIGN_WINDOW * FIFO_RECORD_LENGTH + phase
+    count = min(ALIGN_WINDOW, (len(data) - start) // FIFO_RECORD_LENGTH)
+    if count <= 0:
+        return None, False
+    rows = numpy.asarray(data[start:start + count * FIFO_RECORD_LENGTH]).view(">i2").reshape(1, count, 6)
+    medians, fits = _fifo_stats(rows)
+    return medians[0], bool(fits[0])
+
+def _fifo_offsets(data: numpy.ndarray, breaks: numpy.ndarray,
+                  break_ends: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+    # Byte offsets of the FIFO records, realigned per window, and whether
+    # records were dropped just before each. `breaks` and `break_ends` bound
+    # the transfers with a timing gap.
+    window_bytes = ALIGN_WINDOW * FIFO_RECORD_LENGTH
+    window_count = (len(data) + window_bytes - 1) // window_bytes
+    phases = numpy.zeros(window_count, dtype=numpy.int64)
+
+    # All whole windows at once, as recorded; then the last one.
+    full = len(data) // window_bytes
+    rows = numpy.asarray(data[:full * window_bytes]).view(">i2").reshape(full, ALIGN_WINDOW, 6)
+    medians, valid = _fifo_stats(rows)
+    if full < window_count:
+        last_medians, last_fits = _fifo_window(data, full, 0)
+        medians = numpy.vstack([medians, [last_medians if last_medians is not None else numpy.full(6, numpy.nan)]])
+        valid = numpy.append(valid, last_fits)
+
+    # The windows of a gap, and the one after: the gap may come late in its
+    # window, too late to change that window's median.
+    recheck = numpy.zeros(window_count, dtype=bool)
+    gap_windows = (breaks // window_bytes).astype(numpy.int64)
+    recheck[numpy.minimum(numpy.concatenate([gap_windows, gap_windows + 1]), window_count - 1)] = True
+
+    # From the first window to recheck on, a window keeps the alignment of
+    # the one before while it fits. Rechecked windows, and those that don't
+    # fit, try every alignment and take, of those that fit, the one whose
+    # column medians are closest to the last window kept: alignments a whole
+    # number of values apart all look like 1 g, with the axes swapped, but the
+    # sensor's attitude hardly changes across a short gap.
+    if recheck.any() or not valid.all():
+        first = int(numpy.argmax(recheck | ~valid))
+        phase = 0
+        last = medians[first - 1] if first > 0 and valid[first - 1] else None
+        for window in range(first, window_count):
+            window_medians, fits = _fifo_window(data, window, phase)
+            if recheck[window] or not fits:
+                candidates = [_fifo_window(data, window, p) for p in range(FIFO_RECORD_LENGTH)]
+                fitting = [p for p, (_, f) in enumerate(candidates) if f]
+                if fitting and last is not None:
+                    phase = min(fitting, key=lambda p: numpy.abs(candidates[p][0] - last).sum())
+                elif fitting:
+                    phase = fitting[0]
+                window_medians, fits = candidates[phase]
+            phases[window] = phase
+            valid[window] = fits
+            if fits:
+                last = window_medians
+
+    # Windows are multiples of the record length, so an alignment is a byte
+    # offset modulo the record length. A window with the end of a gap's
+    # transfer in it is split there: its median follows whichever side has
+    # more of it, so the part before keeps the previous window's alignment,
+    # and the part after takes the next window's.
+    segments = []
+    for window in numpy.flatnonzero(valid):
+        start = window * window_bytes
+        end = min(start + window_bytes, len(data))
+        split = break_ends[(break_ends > start) & (break_ends < end)]
+        if len(split):
+            before = phases[window - 1] if window > 0 and valid[window - 1] else phases[window]
+            after = phases[window + 1] if window + 1 < window_count and valid[window + 1] else phases[window]
+            segments.append((start, int(split[-1]), before))
+            segments.append((int(split[-1]), end, after))
+        else:
+            segments.append((start, end, phases[window]))
+
+    # Segments bound where records start; a record may run into the next.
+    offsets = []
+    dropped = []
+    previous = None
+    for start, end, phase in segments:
+        first = start + (phase - start) % FIFO_RECORD_LENGTH
+        records = numpy.arange(first, min(end, len(data) - FIFO_RECORD_LENGTH + 1), FIFO_RECORD_LENGTH)
+        if len(records) == 0:
+            continue
+        offsets.append(records)
+        # Records lost between segments: a dropped window, or a new alignment.
+        follows = previous is not None and first == previous
+        dropped.append(numpy.concatenate([[not follows and (previous is not None or first != 0)],
+                                          numpy.zeros(len(records) - 1, dtype=bool)]))
+        previous = int(records[-1]) + FIFO_RECORD_LENGTH
+    if not offsets:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=bool)
+    return numpy.concatenate(offsets), numpy.concatenate(dropped)
+
+class _FifoTiming:
+    # Sample rate and time offset of each gap-free run of a FIFO file, from
+    # its .times file, or from the file name and modification time.
+    def __init__(self, path: str, start_time: float, length: int):
+        times = _read_times(path)
+        times = times[times["bytes"] > 0]
+        # Byte ranges of the transfers with a gap; the next run starts after
+        # each.
+        self.breaks = numpy.zeros(0, dtype=numpy.int64)
+        self.break_ends = numpy.zeros(0, dtype=numpy.int64)
+        self._run_offsets = numpy.array([start_time])
+
+        if len(times) < 2:
+            elapsed = os.path.getmtime(path) - start_time
+            rate = length / FIFO_RECORD_LENGTH / elapsed if elapsed > 0.0 else 0.0
+            if abs(rate / FIFO_RATE - 1.0) > MTIME_RATE_TOLERANCE:
+                print(f"{path}: no .times file, and the modification time gives an implausible"
+                      f" {rate:.0f} Hz; using {FIFO_RATE:g} Hz")
+                rate = FIFO_RATE
+            self.rate = rate
+            return
+
+        t = times["ts"]
+        n = times["bytes"] / FIFO_RECORD_LENGTH
+        dt = numpy.diff(t)
+        dn = numpy.diff(n)
+        usable = (dt > 0.0) & (dn > 0.0)
+        rate = numpy.median(dn[usable] / dt[usable]) if usable.any() else FIFO_RATE
+
+        # t - n / rate is the time of record 0 implied by each transfer, plus
+        # the transfer's latency. Latency comes and goes; lost samples shift
+        # it for good, which shows as a step in its minimum over all later
+        # transfers.
+        floor = numpy.minimum.accumulate((t - n / rate)[::-1])[::-1]
+        starts = numpy.flatnonzero(numpy.diff(floor) > GAP_TOLERANCE) + 1
+        runs = numpy.split(numpy.arange(len(t)), starts)
+
+        # The rate over the gap-free runs, from the record count between
+        # their first and last transfer.
+        spans = numpy.array([(n[run[-1]] - n[run[0]], t[run[-1]] - t[run[0]]) for run in runs])
+        if spans[:, 1].sum() > 0.0:
+            rate = spans[:, 0].sum() / spans[:, 1].sum()
+        self.rate = rate
+
+        # Samples were lost somewhere in the transfer that shows the gap, so
+        # its data can't be placed in time; each run's offset is the lower
+        # bound of its implied times.
+        implied = t - n / rate
+        self.breaks = times["bytes"][starts - 1].astype(numpy.int64)
+        self.break_ends = times["bytes"][starts].astype(numpy.int64)
+        self._run_offsets = numpy.array([implied[run].min() for run in runs])
+
+    def times(self, offsets: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        # Time of each record at `offsets`, whether a timing gap came just
+        # before it, and whether it is in a transfer with a gap.
+        run = numpy.searchsorted(self.break_ends, offsets, side="right")
+        gaps = numpy.concatenate([[False], numpy.diff(run) != 0])
+        ends = (offsets + FIFO_RECORD_LENGTH) / FIFO_RECORD_LENGTH
+        inside = numpy.searchsorted(self.breaks, offsets + FIFO_RECORD_LENGTH, side="left") > run
+        return self._run_offsets[run] + ends / self.rate, gaps, inside
+
+def _decode_fifo(path: str, data: numpy.ndarray, start_time: float) -> dict[str, numpy.ndarray]:
+    timing = _FifoTiming(path, start_time, len(data))
+    offsets, dropped = _fifo_offsets(data, timing.breaks, timing.break_ends)
+    ts, gaps, inside = timing.times(offsets)
+    # The first record kept after those in a gap's transfer follows the gap.
+    gaps |= numpy.concatenate([[False], inside[:-1]])
+    keep = ~inside
+    offsets, ts, gaps, dropped = offsets[keep], ts[keep], gaps[keep], dropped[keep]
+    samples = sliding_window_view(data, FIFO_RECORD_LENGTH)[offsets]
+    samples = numpy.ascontiguousarray(samples).view(">i2").reshape(-1, 6)
+
+    columns = _empty_columns()
+    columns["imu_ts"] = ts
+    columns["imu_gap"] = dropped | gaps
+    columns["imu_accel"] = samples[:, 0:3] * ACCEL_SCALE
+    columns["imu_gyro"] = samples[:, 3:6] * GYRO_SCALE
+    return columns
+
+def _decode_tagged(data: numpy.ndarray, offsets: numpy.ndarray, tags: numpy.ndarray,
+                   start_time: float) -> dict[str, numpy.ndarray]:
+    columns = _empty_columns()
+    if len(offsets) == 0:
+        return columns
+
+    # Tick differences are taken as signed 24-bit, so records slightly out of
+    # order between the firmware's tasks don't read as a wrap.
+    ticks = ((data[offsets + 1].astype(numpy.int64) << 16)
+             | (data[offsets + 2].astype(numpy.int64) << 8)
+             | data[offsets + 3].astype(numpy.int64))
+    half = 1 << (TICK_BITS - 1)
+    steps = (numpy.diff(ticks) + half) % (1 << TICK_BITS) - half
+    ticks = numpy.concatenate([[0], numpy.cumsum(steps)])
+
+    falling = numpy.flatnonzero(tags == ord("0"))
+    ticks_start = ticks[falling[0]] if len(falling) else ticks[0]
+    ts = start_time + (ticks - ticks_start) / TICK_RATE
+
+    def payloads(tag: bytes, dtype: str, count: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+        selected = tags == tag[0]
+        size = TAG_HEADER_LENGTH + TAG_PAYLOAD_LENGTHS[tag]
+        rows = sliding_window_view(data, size)[offsets[selected]][:, TAG_HEADER_LENGTH:]
+        return ts[selected], numpy.ascontiguousarray(rows).view(dtype).reshape(-1, count)
+
+    imu_ts, imu = payloads(b"I", ">i2", 6)
+    columns["imu_ts"] = imu_ts
+    steps = numpy.diff(imu_ts)
+    if len(steps):
+        columns["imu_gap"] = numpy.concatenate([[False], steps > TAGGED_GAP_FACTOR * numpy.median(steps)])
+    else:
+        columns["imu_gap"] = numpy.zeros(len(imu_ts), dtype=bool)
+    columns["imu_accel"] = imu[:, 0:3] * ACCEL_SCALE
+    columns["imu_gyro"] = imu[:, 3:6] * GYRO_SCALE
+
+    accel_ts, accel = payloads(b"A", ">i2", 3)
+    columns["accel_ts"] = accel_ts
+    columns["accel_accel"] = accel * ACCEL_SCALE
+
+    pressure_ts, pressure = payloads(b"P", ">f4", 2)
+    columns["pressure_ts"] = pressure_ts
+    columns["pressure_pa"] = pressure[:, 0].astype(numpy.float64)
+    columns["pressure_temperature"] = pressure[:, 1].astype(numpy.float64)
+
+    sync = (tags == ord("0")) | (tags == ord("1"))
+    columns["sync_ts"] = ts[sync]
+    columns["sync_level"] = tags[sync] == ord("1")
+    return columns
+
+def read_sensors(path: str, format: str = "auto") -> dict[str, numpy.ndarray]:
+    # Columns of one file, see COLUMNS; "*_ts" are seconds, UNIX epoch, on
+    # the Pi clock. `format` is "fifo", "tagged" or "auto".
+    if format not in ("auto", "fifo", "tagged"):
+        raise ValueError(f"unknown sensors format: {format}")
+    if os.path.getsize(path) == 0:
+        return _empty_columns()
+
+    data = numpy.memmap(path, dtype=numpy.uint8, mode="r")
+    start_time = _start_time(path)
+    if format != "fifo":
+        offsets, tags = _tagged_chain(data)
+        if format == "tagged":
+            return _decode_tagged(data, offsets, tags, start_time)
+        covered = sum(int(numpy.count_nonzero(tags == tag[0])) * (TAG_HEADER_LENGTH + length)
+                      for tag, length in TAG_PAYLOAD_LENGTHS.items())
+        if len(offsets) and offsets[0] == 0 and covered >= TAGGED_COVERAGE * len(data):
+            return _decode_tagged(data, offsets, tags, start_time)
+    return _decode_fifo(path, data, start_time)
+
+def read_sensor_files(paths: list[str], format: str = "auto") -> dict[str, numpy.ndarray]:
+    # Columns of several files (e.g. usb_rx.py restarted during a flight),
+    # concatenated in file order.
+    parts = [read_sensors(path, format) for path in paths]
+    if not parts:
+        return _empty_columns()
+    return {name: numpy.concatenate([part[name] for part in parts]) for name in COLUMNS}
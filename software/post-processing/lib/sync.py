@@ -0,0 +1,101 @@
+from collections import Counter
+import re
+
+import numpy
+
+from lib.time_map import fit_clock
+from lib.tlog import TlogReader
+
+# Derives the Raspberry Pi <-> flight computer time sync map automatically.
+#
+# The flight computer logs every status text it sends as a DataFlash MSG
+# message, and mavlink_record.py on the Pi writes every STATUSTEXT it receives
+# to "<ts>_fc.txt" (or, with --tlog, "<ts>_fc.tlog"), stamped with the Pi
+# clock. A text seen exactly once on each side gives one (pi, fc) sync point.
+# Texts seen more than once on either side ("Mission: 2 WP" on every lap,
+# repeated PreArm warnings) are ambiguous and are left out.
+
+# STATUSTEXT text is at most 50 characters; longer DataFlash messages arrive
+# truncated (or chunked) on the Pi.
+STATUSTEXT_LENGTH = 50
+
+# A line of mavlink_record.py output, e.g.
+#   1755721062.198 STATUSTEXT {severity : 6, text : Mission: 1 Takeoff, id : 0, chunk_seq : 0}
+# MAVLink 1 messages have no id/chunk_seq fields. The text itself may contain
+# commas, so it is everything up to those trailing fields.
+RE_STATUSTEXT = re.compile(
+    rb"^(?P<ts>\d+\.\d+) STATUSTEXT \{severity : \d+, text : (?P<text>.*?)(?:, id : \d+, chunk_seq : \d+)?\}\r?$",
+    re.MULTILINE,
+)
+
+# Pairs whose offset lies further than this from the fitted clock line are
+# dropped as coincidental matches. The Pi-side receive latency is a few ms.
+MAX_RESIDUAL = 0.050
+
+def _key(text: str) -> str:
+    return text.strip()[:STATUSTEXT_LENGTH]
+
+def read_pi_status_texts(paths: list[str]) -> tuple[numpy.ndarray, list[str]]:
+    # Receive timestamps and texts of every STATUSTEXT in the Pi recordings.
+    # Only STATUSTEXT lines are decoded; everything else is skipped by the
+    # regular expression engine without creating Python objects.
+    ts = []
+    texts = []
+    for path in paths:
+        if path.endswith(".tlog"):
+            messages = TlogReader(path).messages("STATUSTEXT")
+            ts.extend(messages["ts"].tolist())
+            texts.extend(text.decode("utf-8", errors="replace") for text in messages["text"])
+            continue
+        with open(path, "rb") as f:
+            content = f.read()
+        for match in RE_STATUSTEXT.finditer(content):
+            ts.append(float(match["ts"]))
+            texts.append(match["text"].decode("utf-8", errors="replace"))
+    return numpy.array(ts, dtype=numpy.float64), texts
+
+def match_status_texts(pi_ts: numpy.ndarray, pi_texts: list[str],
+                       fc_ts: numpy.ndarray, fc_texts: list[str]) -> list[tuple[float, float, str]]:
+    # Hash join of the two sides on their text. Returns (pi_ts, fc_ts, text)
+    # for texts that occur exactly once on each side, sorted by time.
+    pi_keys = [_key(text) for text in pi_texts]
+    fc_keys = [_key(text) for text in fc_texts]
+    pi_counts = Counter(pi_keys)
+    fc_counts = Counter(fc_keys)
+
+    fc_index = {key: i for i, key in enumerate(fc_keys) if fc_counts[key] == 1}
+
+    pairs = []
+    for i, key in enumerate(pi_keys):
+        if not key or pi_counts[key] != 1:
+            continue
+        j = fc_index.get(key, None)
+        if j is not None:
+            pairs.append((float(pi_ts[i]), float(fc_ts[j]), key))
+
+    pairs.sort()
+    return pairs
+
+def reject_outliers(pairs: list[tuple[float, float, str]], max_residual: float = MAX_RESIDUAL) -> tuple[list, list]:
+    # Splits pairs into (kept, rejected) by their distance from a robust clock
+    # fit, so a text that happens to repeat across unrelated events cannot bend
+    # the map.
+    if len(pairs) < 3:
+        return pairs, []
+
+    x = numpy.array([p[0] for p in pairs], dtype=numpy.float64)
+    y = numpy.array([p[1] for p in pairs], dtype=numpy.float64)
+    x_ref, offset, drift = fit_clock(x, y)
+    residuals = y - (x + offset + drift * (x - x_ref))
+
+    kept = [p for p, r in zip(pairs, residuals) if abs(r) <= max_residual]
+    rejected = [p for p, r in zip(pairs, residuals) if abs(r) > max_residual]
+    return kept, rejected
+
+def derive_sync_map(pi_paths: list[str], fc_ts: numpy.ndarray, fc_texts: list[str],
+                    max_residual: float = MAX_RESIDUAL) -> tuple[list, list]:
+    # Returns (kept, rejected) lists of (pi_ts, fc_ts, text). The kept pairs,
+    # without the text, are a TimeSync map.
+    pi_ts, pi_texts = read_pi_status_texts(pi_paths)
+    pairs = match_status_texts(pi_ts, pi_texts, fc_ts, fc_texts)
+    return reject_outliers(pairs, max_residual)
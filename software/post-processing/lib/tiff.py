@@ -0,0 +1,82 @@
+import struct
+
+import numpy
+
+from pidng.core import Tag
+from pidng.defs import PhotometricInterpretation
+
+from .exif import ImageTags, ifds
+
+# Tiled, uncompressed, 16-bit RGB TIFF writer.
+#
+# Every tile has the same size (edge tiles are padded, as TIFF requires), so
+# all tile offsets are known before any pixel is written. The file is laid out
+# as header, IFD0 with its EXIF/GPS IFDs, then the tiles in row-major order,
+# and is written in a single pass as bands of rows arrive.
+
+TIFF_TILE_SIZE = 256
+
+PLANAR_CONFIGURATION_CHUNKY = 1
+COMPRESSION_NONE = 1
+SAMPLE_FORMAT_UINT = 1
+SAMPLE_FORMAT = (339, Tag.BitsPerSample[1])
+
+def write_tiff(file_path: str, width: int, height: int, bands, image_tags: ImageTags | None = None,
+               tile: int = TIFF_TILE_SIZE):
+    # `bands` yields (row, rgb) with rgb a (rows, width, 3) uint16 array, in
+    # row order, e.g. lib.develop.develop_bands(). Bands need not line up with
+    # tiles; rows are collected until a full row of tiles is available.
+    tiles_across = (width + tile - 1) // tile
+    tiles_down = (height + tile - 1) // tile
+    tile_bytes = tile * tile * 3 * 2
+
+    def structure(tile_offsets: list[int]) -> dict:
+        return {
+            Tag.NewSubfileType: [0],
+            Tag.ImageWidth: [width],
+            Tag.ImageLength: [height],
+            Tag.BitsPerSample: [16, 16, 16],
+            Tag.Compression: [COMPRESSION_NONE],
+            Tag.PhotometricInterpretation: [PhotometricInterpretation.RGB],
+            Tag.SamplesPerPixel: [3],
+            Tag.PlanarConfiguration: [PLANAR_CONFIGURATION_CHUNKY],
+            Tag.Software: "log_extract",
+            Tag.TileWidth: [tile],
+            Tag.TileLength: [tile],
+            Tag.TileOffsets: tile_offsets,
+            Tag.TileByteCounts: [tile_bytes] * (tiles_across * tiles_down),
+            SAMPLE_FORMAT: [SAMPLE_FORMAT_UINT] * 3,
+        }
+
+    # The IFDs' length doesn't depend on the offset values, so lay them out
+    # once with placeholders to find where the tiles start.
+    count = tiles_across * tiles_down
+    data_offset = 8 + len(ifds(structure([0] * count), image_tags, 8))
+    data_offset = (data_offset + 15) & ~15
+    tile_offsets = [data_offset + i * tile_bytes for i in range(count)]
+    header = struct.pack("<2sHI", b"II", 42, 8) + ifds(structure(tile_offsets), image_tags, 8)
+
+    with open(file_path, "wb") as f:
+        f.write(header)
+        f.write(bytes(data_offset - len(header)))
+
+        band_tiles = numpy.zeros((tile, tiles_across * tile, 3), dtype=numpy.uint16)
+        pending = 0
+        for _row, rgb in bands:
+            n = rgb.shape[0]
+            while n:
+                take = min(n, tile - pending)
+                start = rgb.shape[0] - n
+                band_tiles[pending:pending + take, :width] = rgb[start:start + take]
+                pending += take
+                n -= take
+                if pending == tile:
+                    _write_tile_row(f, band_tiles, tiles_across, tile)
+                    pending = 0
+        if pending:
+            band_tiles[pending:] = 0
+            _write_tile_row(f, band_tiles, tiles_across, tile)
+
+def _write_tile_row(f, band_tiles: numpy.ndarray, tiles_across: int, tile: int):
+    for col in range(tiles_across):
+        f.write(numpy.ascontiguousarray(band_tiles[:, col * tile:(col + 1) * tile]).data)
@@ -1,6 +1,7 @@
 from datetime import datetime
 
 import numpy
+from numpy.lib.stride_tricks import sliding_window_view
 
 # with open(sys.argv[2], "r") as f:
 #     for line in f:
@@ -15,28 +16,204 @@ import numpy
 #             tc1_datetime = datetime.fromtimestamp(tc1, tz=timezone.utc)
 #             print(tc1_datetime, ts1)
 
+# Huber tuning constant: 95% efficiency for normally distributed residuals.
+HUBER_K = 1.345
+
+# TIMESYNC samples, "<ts>_fc.timesync", appended by mavlink_record.py
+# (home/clock_sync.py in camera-computer) once per exchange with the flight
+# computer: the Pi wall clock at the midpoint of the round trip, the flight
+# computer's clock (ns since its boot, as DataFlash TimeUS) and the round trip
+# time, all ns.
+TIMESYNC_DTYPE = numpy.dtype([("pi_ns", "<i8"), ("fc_ns", "<i8"), ("rtt_ns", "<i8")])
+
+# A sample is used while its round trip is within this factor of the shortest
+# among its TIMESYNC_WINDOW neighbours. Its error is at most half the round
+# trip beyond the shortest.
+TIMESYNC_RTT_FACTOR = 1.5
+TIMESYNC_WINDOW = 64
+
+def read_timesync(paths: list[str]) -> numpy.ndarray:
+    # All samples of the files, sorted by Pi time. A sample cut short by the
+    # end of a file is ignored.
+    samples = []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        count = len(data) // TIMESYNC_DTYPE.itemsize
+        samples.append(numpy.frombuffer(data, dtype=TIMESYNC_DTYPE, count=count))
+    samples = numpy.concatenate(samples) if samples else numpy.zeros(0, dtype=TIMESYNC_DTYPE)
+    return samples[numpy.argsort(samples["pi_ns"], kind="stable")]
+
+def filter_timesync(samples: numpy.ndarray, rtt_factor: float = TIMESYNC_RTT_FACTOR,
+                    window: int = TIMESYNC_WINDOW) -> numpy.ndarray:
+    # Samples whose round trip is close to the shortest nearby, as the Pi's
+    # own estimate does. Slow round trips happen when either side was busy,
+    # and leave the flight computer's time anywhere within them.
+    rtt = samples["rtt_ns"]
+    if len(rtt) == 0:
+        return samples
+    window = min(window, len(rtt))
+    padded = numpy.pad(rtt, (window // 2, window - 1 - window // 2), mode="edge")
+    rtt_min = sliding_window_view(padded, window).min(axis=1)
+    return samples[rtt <= rtt_factor * rtt_min]
+
+def fit_clock(x: numpy.ndarray, y: numpy.ndarray, iterations: int = 20) -> tuple[float, float, float]:
+    # Robust fit of y - x = offset + drift * (x - x_ref), i.e. a clock offset
+    # plus a constant rate error, by iteratively reweighted least squares with
+    # Huber weights. Mismatched sync points get down-weighted instead of
+    # dragging the whole line. Returns (x_ref, offset, drift).
+    x_ref = float(numpy.median(x))
+    dx = x - x_ref
+    d = y - x
+
+    if len(x) < 2 or numpy.ptp(x) == 0.0:
+        return x_ref, float(numpy.median(d)), 0.0
+
+    A = numpy.stack([numpy.ones_like(dx), dx], axis=1)
+    w = numpy.ones_like(dx)
+    for _ in range(iterations):
+        sw = numpy.sqrt(w)
+        (offset, drift), *_ = numpy.linalg.lstsq(A * sw[:, numpy.newaxis], d * sw, rcond=None)
+        r = d - (offset + drift * dx)
+        scale = 1.4826 * numpy.median(numpy.abs(r - numpy.median(r)))
+        if scale == 0.0:
+            break
+        k = HUBER_K * scale
+        w_new = numpy.where(numpy.abs(r) <= k, 1.0, k / numpy.maximum(numpy.abs(r), k))
+        if numpy.allclose(w_new, w):
+            break
+        w = w_new
+
+    return x_ref, float(offset), float(drift)
+
+class _ClockMap:
+    # One direction of a TimeSync: x -> y.
+    def __init__(self, x: numpy.ndarray, y: numpy.ndarray, piecewise: bool):
+        order = numpy.argsort(x, kind="stable")
+        self._x = x[order]
+        self._y = y[order]
+        self._piecewise = piecewise
+        self._x_ref, self._offset, self._drift = fit_clock(self._x, self._y)
+        self._residuals = self._y - self.model(self._x)
+
+    def model(self, ts: numpy.ndarray) -> numpy.ndarray:
+        return ts + self._offset + self._drift * (ts - self._x_ref)
+
+    def map(self, ts: numpy.ndarray, extrapolate: bool) -> numpy.ndarray:
+        result = self.model(ts)
+        if self._piecewise:
+            # Pass exactly through the sync points. Beyond the ends, this keeps
+            # the end residual, so the mapping stays continuous.
+            result += numpy.interp(ts, self._x, self._residuals)
+        if not extrapolate:
+            result = numpy.where((ts < self._x[0]) | (ts > self._x[-1]), numpy.nan, result)
+        return result
+
+    @property
+    def span(self) -> tuple[float, float]:
+        return float(self._x[0]), float(self._x[-1])
+
+    @property
+    def drift(self) -> float:
+        return self._drift
+
+    @property
+    def residuals(self) -> numpy.ndarray:
+        return self._residuals
+
 class TimeSync:
-    def __init__(self, map: dict[float, float]):
-        self._from = [v[0] for v in map]
-        self._from_min_max = (min(self._from), max(self._from))
+    # Maps timestamps (seconds, UNIX epoch) from one clock to another, given
+    # (from, to) pairs of the same events seen by both clocks.
+    #
+    # Both directions are modelled as an offset plus a drift rate, fit robustly
+    # to all pairs. With model="piecewise" (the default) the mapping also
+    # passes through every pair, as linear interpolation between hand-picked
+    # points always did; model="linear" uses the fitted line alone, which is
+    # better for many noisy pairs. With extrapolate=True timestamps outside the
+    # span of the pairs are mapped with the fitted drift; otherwise they map to
+    # None (or NaN, for arrays).
+    def __init__(self, map: list[tuple[float, float]], model: str = "piecewise", extrapolate: bool = True):
+        if model not in ("piecewise", "linear"):
+            raise ValueError(f"unknown time sync model: {model}")
+
+        pairs = numpy.asarray(map, dtype=numpy.float64).reshape(-1, 2)
+        if len(pairs) == 0:
+            raise ValueError("time sync map is empty")
+
+        self._from = pairs[:, 0]
+        self._from_min_max = (self._from.min(), self._from.max())
+
+        self._to = pairs[:, 1]
+        self._to_min_max = (self._to.min(), self._to.max())
+
+        piecewise = model == "piecewise"
+        self._forward = _ClockMap(self._from, self._to, piecewise)
+        self._reverse = _ClockMap(self._to, self._from, piecewise)
+        self._extrapolate = extrapolate
+
+    @classmethod
+    def from_timesync(cls, samples: numpy.ndarray, fc_timebase: float, model: str = "linear",
+                      extrapolate: bool = True) -> "TimeSync":
+        # Pi -> flight computer map from TIMESYNC samples (see read_timesync()
+        # and filter_timesync()). `fc_timebase` is the UNIX time of the flight
+        # computer's boot, FlightLog.timebase, so that the map leads to the
+        # same timestamps as the flight log. Samples are many and noisy, so
+        # the fitted line is used alone by default.
+        pi = samples["pi_ns"].astype(numpy.float64) * 1e-9
+        fc = fc_timebase + samples["fc_ns"].astype(numpy.float64) * 1e-9
+        return cls(numpy.stack([pi, fc], axis=1), model, extrapolate)
+
+    def forward_ts(self, ts: numpy.ndarray) -> numpy.ndarray:
+        return self._forward.map(numpy.asarray(ts, dtype=numpy.float64), self._extrapolate)
 
-        self._to = [v[1] for v in map]
-        self._to_min_max = (min(self._to), max(self._to))
+    def reverse_ts(self, ts: numpy.ndarray) -> numpy.ndarray:
+        return self._reverse.map(numpy.asarray(ts, dtype=numpy.float64), self._extrapolate)
 
     def forward(self, dt: datetime) -> datetime | None:
-        ts = dt.timestamp()
-        if ts < self._from_min_max[0] or ts > self._from_min_max[1]:
+        result = float(self.forward_ts(dt.timestamp()))
+        if numpy.isnan(result):
             return None
-        result = numpy.interp(ts, self._from, self._to)
         return datetime.fromtimestamp(result)
 
     def reverse(self, dt: datetime) -> datetime | None:
-        ts = dt.timestamp()
-        if ts < self._to_min_max[0] or ts > self._to_min_max[1]:
+        result = float(self.reverse_ts(dt.timestamp()))
+        if numpy.isnan(result):
             return None
-        result = numpy.interp(ts, self._to, self._from)
         return datetime.fromtimestamp(result)
 
+    @property
+    def from_ts(self) -> numpy.ndarray:
+        return self._from
+
+    @property
+    def to_ts(self) -> numpy.ndarray:
+        return self._to
+
+    def offset_at(self, ts: numpy.ndarray) -> numpy.ndarray:
+        # Fitted seconds to add to "from" timestamps, ignoring the residuals.
+        ts = numpy.asarray(ts, dtype=numpy.float64)
+        return self._forward.model(ts) - ts
+
+    @property
+    def drift(self) -> float:
+        # Rate error of the "to" clock relative to the "from" clock, s/s.
+        return self._forward.drift
+
+    @property
+    def residuals(self) -> numpy.ndarray:
+        # Per pair, in seconds: how far each pair lies from the fitted line,
+        # sorted by "from" timestamp. Large values point at mismatched pairs.
+        return self._forward.residuals
+
+    def summary(self) -> str:
+        r = self.residuals
+        x_min, x_max = self._forward.span
+        x_mid = (x_min + x_max) / 2
+        offset_mid = float(self.offset_at(x_mid))
+        return (f"time sync: {len(r)} points over {x_max - x_min:.1f} s, "
+                f"offset {offset_mid:+.6f} s at midpoint, drift {self.drift * 1e6:+.2f} ppm, "
+                f"residual rms {numpy.sqrt(numpy.mean(r * r)) * 1e3:.3f} ms, max {numpy.max(numpy.abs(r)) * 1e3:.3f} ms")
+
 # test_ts_rpi = [1755721161.019, 1755721299.223, 1755721105.043]
 # result_ts_fc = ts_rpi_to_fc(test_ts_rpi)
 # print(f"{result_ts_fc[0]} {result_ts_fc[1]} {result_ts_fc[2]}")
@@ -0,0 +1,183 @@
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+
+from lib.dataflash import follow_chain
+
+# Vectorized reader for MAVLink telemetry logs (.tlog), as written by
+# `mavlink_record.py --tlog` on the Raspberry Pi (and by MAVProxy, QGC, ...).
+#
+# A tlog is a stream of records: the receive time, microseconds since the UNIX
+# epoch as a big-endian uint64, then one MAVLink 1 or 2 frame as received.
+# As for DataFlash logs (see lib/dataflash.py), the records are found by
+# locating every frame start candidate with numpy and following the chain of
+# record lengths from the start of the file. Only the requested message types
+# are then checked (CRC) and decoded, straight into numpy arrays.
+
+TIMESTAMP_LENGTH = 8
+STX_V1 = 0xFE
+STX_V2 = 0xFD
+HEADER_LENGTH_V1 = 6
+HEADER_LENGTH_V2 = 10
+CRC_LENGTH = 2
+SIGNATURE_LENGTH = 13
+INCOMPAT_FLAG_SIGNED = 0x01
+
+# Messages decoded by TlogReader: id, CRC_EXTRA, then the fields in wire
+# order (by descending type size, extension fields last). MAVLink 2 drops
+# trailing zero bytes of a payload; they are restored, so fields missing from
+# a frame, e.g. extension fields sent by older firmware, read as zero.
+MESSAGES = {
+    "SYSTEM_TIME": (2, 137, (
+        ("time_unix_usec", "<u8"),
+        ("time_boot_ms", "<u4"),
+    )),
+    "GPS_RAW_INT": (24, 24, (
+        ("time_usec", "<u8"),
+        ("lat", "<i4"),
+        ("lon", "<i4"),
+        ("alt", "<i4"),
+        ("eph", "<u2"),
+        ("epv", "<u2"),
+        ("vel", "<u2"),
+        ("cog", "<u2"),
+        ("fix_type", "u1"),
+        ("satellites_visible", "u1"),
+        ("alt_ellipsoid", "<i4"),
+        ("h_acc", "<u4"),
+        ("v_acc", "<u4"),
+        ("vel_acc", "<u4"),
+        ("hdg_acc", "<u4"),
+        ("yaw", "<u2"),
+    )),
+    "TIMESYNC": (111, 34, (
+        ("tc1", "<i8"),
+        ("ts1", "<i8"),
+        ("target_system", "u1"),
+        ("target_component", "u1"),
+    )),
+    "STATUSTEXT": (253, 83, (
+        ("severity", "u1"),
+        ("text", "S50"),
+        ("id", "<u2"),
+        ("chunk_seq", "u1"),
+    )),
+}
+
+def _gather(data: numpy.ndarray, offsets: numpy.ndarray, size: int) -> numpy.ndarray:
+    # `size` bytes at each offset, as an (n, size) array; zero past the end of
+    # the file.
+    rows = numpy.zeros((len(offsets), size), dtype=numpy.uint8)
+    fits = offsets + size <= len(data)
+    if fits.any():
+        rows[fits] = sliding_window_view(data, size)[offsets[fits]]
+    for i in numpy.flatnonzero(~fits):
+        tail = data[offsets[i]:]
+        rows[i, :len(tail)] = tail
+    return rows
+
+def _x25_crc(rows: numpy.ndarray, lengths: numpy.ndarray, crc_extra: int) -> numpy.ndarray:
+    # MAVLink's CRC-16/MCRF4XX over the first `lengths[i]` bytes of each row,
+    # then CRC_EXTRA; one vectorized step per byte position.
+    crc = numpy.full(len(rows), 0xFFFF, dtype=numpy.uint32)
+
+    def accumulate(crc, b):
+        tmp = (b ^ crc) & 0xFF
+        tmp = (tmp ^ (tmp << 4)) & 0xFF
+        return ((crc >> 8) ^ (tmp << 8) ^ (tmp << 3) ^ (tmp >> 4)) & 0xFFFF
+
+    for j in range(rows.shape[1]):
+        crc = numpy.where(j < lengths, accumulate(crc, rows[:, j].astype(numpy.uint32)), crc)
+    return accumulate(crc, numpy.uint32(crc_extra))
+
+class TlogReader:
+    def __init__(self, path: str):
+        self._path = path
+        self._data = numpy.memmap(path, dtype=numpy.uint8, mode="r")
+        self._offsets, self._ids = self._follow_records()
+
+    def _follow_records(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+        data = self._data
+        if len(data) < TIMESTAMP_LENGTH + HEADER_LENGTH_V1 + CRC_LENGTH:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+
+        # Record candidates: every STX byte could start a frame, 8 bytes into
+        # a record.
+        frame_bytes = data[TIMESTAMP_LENGTH:]
+        stx = numpy.flatnonzero((frame_bytes == STX_V1) | (frame_bytes == STX_V2)).astype(numpy.int64)
+        stx = stx[stx + TIMESTAMP_LENGTH + HEADER_LENGTH_V2 <= len(data)]
+        frames = stx + TIMESTAMP_LENGTH
+        candidates = stx
+
+        v2 = data[frames] == STX_V2
+        payload_lengths = data[frames + 1].astype(numpy.int64)
+        signed = v2 & ((data[frames + 2] & INCOMPAT_FLAG_SIGNED) != 0)
+        frame_lengths = (numpy.where(v2, HEADER_LENGTH_V2, HEADER_LENGTH_V1) + payload_lengths + CRC_LENGTH
+                         + numpy.where(signed, SIGNATURE_LENGTH, 0))
+        ends = frames + frame_lengths
+
+        # After a record, continue at the next candidate at or after its end,
+        # skipping any bad bytes in between.
+        keep = ends <= len(data)
+        candidates = candidates[keep]
+        frames = frames[keep]
+        v2 = v2[keep]
+        ends = ends[keep]
+        on_chain = follow_chain(numpy.searchsorted(candidates, ends))
+
+        frames = frames[on_chain]
+        v2 = v2[on_chain]
+        ids = numpy.where(v2,
+                          data[frames + 7].astype(numpy.int64)
+                          | (data[frames + 8].astype(numpy.int64) << 8)
+                          | (data[frames + 9].astype(numpy.int64) << 16),
+                          data[frames + 5].astype(numpy.int64))
+        return candidates[on_chain], ids
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def id_counts(self) -> dict[int, int]:
+        ids, counts = numpy.unique(self._ids, return_counts=True)
+        return {int(id): int(count) for id, count in zip(ids, counts)}
+
+    def messages(self, name: str) -> numpy.ndarray:
+        # All messages of one type in MESSAGES with a valid CRC, as a numpy
+        # structured array of the message's fields plus "ts": the receive
+        # time, seconds since the UNIX epoch.
+        if name not in MESSAGES:
+            raise ValueError(f"no message definition for {name}")
+        id, crc_extra, fields = MESSAGES[name]
+        dtype = numpy.dtype(list(fields))
+
+        data = self._data
+        offsets = self._offsets[self._ids == id]
+        frames = offsets + TIMESTAMP_LENGTH
+        v2 = data[frames] == STX_V2
+        header_lengths = numpy.where(v2, HEADER_LENGTH_V2, HEADER_LENGTH_V1)
+        payload_lengths = numpy.minimum(data[frames + 1].astype(numpy.int64), dtype.itemsize)
+
+        # The CRC covers the header after STX, and the payload as sent.
+        crc_lengths = header_lengths - 1 + data[frames + 1].astype(numpy.int64)
+        crc_rows = _gather(data, frames + 1, int(crc_lengths.max(initial=0)))
+        crc_ends = frames + 1 + crc_lengths
+        crc_sent = data[crc_ends].astype(numpy.uint32) | (data[crc_ends + 1].astype(numpy.uint32) << 8)
+        valid = _x25_crc(crc_rows, crc_lengths, crc_extra) == crc_sent
+
+        offsets = offsets[valid]
+        payloads = _gather(data, (frames + header_lengths)[valid], dtype.itemsize)
+        payloads[numpy.arange(dtype.itemsize) >= payload_lengths[valid][:, numpy.newaxis]] = 0
+
+        records = numpy.zeros(len(offsets), dtype=numpy.dtype(list(fields) + [("ts", "<f8")]))
+        decoded = payloads.view(dtype).reshape(-1)
+        for field, _ in fields:
+            records[field] = decoded[field]
+        records["ts"] = self.timestamps(offsets)
+        return records
+
+    def timestamps(self, offsets: numpy.ndarray) -> numpy.ndarray:
+        # Receive times of the records at `offsets`, seconds since the UNIX
+        # epoch.
+        rows = _gather(self._data, offsets, TIMESTAMP_LENGTH)
+        return rows.view(">u8").reshape(-1).astype(numpy.float64) * 1.0e-6
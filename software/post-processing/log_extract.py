@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
 from fractions import Fraction
+import argparse
+import csv
+import importlib.util
 import sys
 import os
 import re
@@ -10,12 +13,14 @@ from collections import defaultdict
 from zoneinfo import ZoneInfo
 import numpy
 
-from lib.dng import write_dng
+from lib.convert import FrameJob, convert_frames
+from lib.exif import image_tags_from_exiftool_row, patch_files
 import lib.flight_log as flight_log
 from lib.path import Flight
-from lib.raw import imx477_raw_read
 import lib.time_map as time_map
+from lib.sync import derive_sync_map
 import lib.metadata as metadata
+from lib.orientation import camera_orientations
 
 CAMERA_NAMES = {
     0: "v2 sony imx477c0 4056 3032 brown 0.6203",
@@ -66,8 +71,9 @@ TIME_SYNC_MAP = [
     # These are Raspberry Pi #1 timestamps vs. flight computer timestamps, when matching
     # status text messages in both logs.
 
-    # TODO: Find an automated, or better way to generat this data, or... just improve
-    # the synchronization process.
+    # Normally the map is derived from the flight's sync/*_fc.txt recordings
+    # (see lib/sync.py and sync_map.py). These hand-picked points from the
+    # 2025/08/20 flight are only used when that finds too few matches.
 
     (1755721057.556, 1755721058.342287), # "EKF3 IMU1 MAG0 in-flight yaw alignment complete"
     (1755721062.198, 1755721062.984508), # "Mission: 1 Takeoff"
@@ -85,52 +91,156 @@ TIME_SYNC_MAP = [
 
 TZ_LOCAL = ZoneInfo("America/Los_Angeles")
 
-# def process_images(flight: Flight, shape: tuple, format: str, dir_path_out: str):
-#     for file_raw in flight.raw_files:
-#         metadata_file = flight.metadata_for_raw_file(file_raw)
-
-#         data = imx477_raw_read(file_raw.path, shape)
-#         write_dng(file_raw.datetime, file_raw.cam, data, format, file_path_dng, metadata_file)
-
-#         row = (file_name_dng, )
-
-path_flight = sys.argv[1]
-file_flight_log = sys.argv[2]
-path_odm = sys.argv[3]
-
-write_dngs = False
-write_extension = ".tif"
+EXIFTOOL_COLUMN_NAMES = [
+    'SourceFile',
+    "Directory",
+    "FileName",
 
-flight = Flight(path_flight, file_flight_log)
+    "DateTime",
+    "SubSecTime",
+    "OffsetTime",
+    "DateTimeOriginal",
+    "SubSecTimeOriginal",
+    "OffsetTimeOriginal",
 
-images_path = os.path.join(path_odm, "images")
-opensfm_path = os.path.join(path_odm, "opensfm")
-geo_txt_path = os.path.join(path_odm, "geo.txt")
+    "GPSLatitude",
+    "GPSLatitudeRef",
+    "GPSLongitude",
+    "GPSLongitudeRef",
+    "GPSAltitude",
+    "GPSAltitudeRef",
 
-time_map_pi_to_fc = time_map.TimeSync(TIME_SYNC_MAP)
+    "Make",
+    "Model",
 
-exif_metadata = []
+    "Aperture",
+    "ExifImageWidth",
+    "ExifImageHeight",
+    "ExposureTime",
+    "ShutterSpeedValue",
+    "ShutterSpeed",
+    "FNumber",
+    "FocalLength",
+    "ISO",
+]
 
-for metadata_file in flight.metadata_files:
-    meta = metadata_file.data
-    dt_pi = metadata_file.datetime
-    dt_fc = time_map_pi_to_fc.forward(dt_pi)
-    if dt_fc is not None:
-        vehicle_attitude = flight.log.attitude_interp(dt_fc)
-        vehicle_position = flight.log.position_interp(dt_fc)
+def camera_priors(attitudes: numpy.ndarray, cams: numpy.ndarray, image_turns: dict[int, int]) -> dict[str, numpy.ndarray]:
+    # Orientation priors for every frame: the vehicle attitude composed with
+    # each camera's rig rotation, in one vectorized pass per camera.
+    priors = {k: numpy.zeros(len(cams)) for k in ("yaw", "pitch", "roll", "omega", "phi", "kappa")}
+    for cam in numpy.unique(cams):
+        sel = cams == cam
+        rig_camera = RIG_CAMERAS[CAMERA_NAMES[int(cam)]]
+        o = camera_orientations(attitudes[sel], rig_camera["rotation"], image_turns.get(int(cam), 0))
+        for k in priors:
+            priors[k][sel] = o[k]
+    return priors
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="log_extract",
+        description="Geocene Drone image and flight log extraction",
+    )
+    parser.add_argument("path_flight", help="flight directory")
+    parser.add_argument("file_flight_log", help="file name of the flight computer log, inside the flight directory")
+    parser.add_argument("path_odm", help="ODM project directory")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--dng", action='store_true', default=False, help="convert raw frames to DNG images")
+    output.add_argument("--tif", action='store_true', default=False, help="develop raw frames into 16-bit RGB TIFF images")
+    parser.add_argument("--compress", action='store_true', default=False, help="write lossless-compressed, tiled DNG images (needs imagecodecs)")
+    parser.add_argument("--demosaic", choices=("bilinear", "malvar"), default="bilinear", help="demosaicing method for --tif")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="number of frame conversion processes")
+    args = parser.parse_args()
+    if args.compress and not args.dng:
+        parser.error("--compress only applies to --dng")
+    if args.compress and importlib.util.find_spec("imagecodecs") is None:
+        parser.error("--compress needs the imagecodecs package")
+
+    path_flight = args.path_flight
+    file_flight_log = args.file_flight_log
+    path_odm = args.path_odm
+
+    write_dngs = args.dng
+    write_tifs = args.tif
+    write_extension = ".tif"
+
+    flight = Flight(path_flight, file_flight_log)
+
+    images_path = os.path.join(path_odm, "images")
+    opensfm_path = os.path.join(path_odm, "opensfm")
+    geo_txt_path = os.path.join(path_odm, "geo.txt")
+
+    # TIMESYNC samples measured by mavlink_record.py, if there are any and the
+    # flight log has a GPS timebase; otherwise, matching status texts.
+    timesync_samples = time_map.read_timesync(flight.timesync_files)
+    timesync_used = time_map.filter_timesync(timesync_samples)
+    if len(timesync_used) >= 2 and flight.log.timebase != 0.0:
+        print(f"time sync: {len(timesync_used)} of {len(timesync_samples)} TIMESYNC samples used")
+        time_map_pi_to_fc = time_map.TimeSync.from_timesync(timesync_used, flight.log.timebase)
+    else:
+        sync_points, sync_rejected = derive_sync_map(flight.sync_files, *flight.log.status_texts)
+        if len(sync_points) >= 2:
+            print(f"time sync: {len(sync_points)} status texts matched, {len(sync_rejected)} rejected")
+            sync_map = [(ts_pi, ts_fc) for ts_pi, ts_fc, _text in sync_points]
+        else:
+            print(f"time sync: too few status texts matched in {flight.path_sync}, using TIME_SYNC_MAP")
+            sync_map = TIME_SYNC_MAP
+        time_map_pi_to_fc = time_map.TimeSync(sync_map)
+    print(time_map_pi_to_fc.summary())
+
+    # Rows and conversion jobs are built in the parent, in metadata file order.
+    # Only the raw -> DNG conversion is handed to the worker pool.
+    exif_metadata = []
+    jobs = []
+    existing_images = []
+    # Compressed DNG tiles are encoded on threads; share the cores between
+    # the worker processes. With the default of one worker per core that is
+    # one thread each, so tiles are only encoded in parallel with fewer
+    # workers, e.g. `--workers 1` when converting a few frames.
+    compress_threads = max(1, os.cpu_count() // max(1, args.workers))
+
+    # Map every frame time to the flight computer clock in one call. Frames
+    # outside the hand-picked sync points are extrapolated with the fitted
+    # drift; only frames outside the flight log itself are dropped.
+    metadata_files = flight.metadata_files
+    ts_fc = time_map_pi_to_fc.forward_ts(numpy.array([f.ts for f in metadata_files], dtype=numpy.float64))
+    positions_ts = flight.log.positions_ts
+    if len(positions_ts) == 0:
+        print(f"{os.path.join(path_flight, file_flight_log)}: no position messages, so no frame can be placed",
+              file=sys.stderr)
+        sys.exit(1)
+    in_log = numpy.isfinite(ts_fc) & (ts_fc >= positions_ts[0]) & (ts_fc <= positions_ts[-1])
+
+    frames = [(metadata_files[i], datetime.fromtimestamp(ts_fc[i])) for i in numpy.flatnonzero(in_log)]
+
+    # One batched pose query for all frames.
+    poses = flight.log.poses_at(ts_fc[in_log])
+
+    # Camera 2 images are tagged "Rotate 270 CW" (below) unless writing DNGs,
+    # so viewers turn them a quarter turn counter-clockwise.
+    image_turns = {} if write_dngs else {2: 1}
+    priors = camera_priors(poses["attitude"], numpy.array([f.cam for f, _ in frames], dtype=numpy.int64), image_turns)
+    geo_rows = []
+
+    for n, (metadata_file, dt_fc) in enumerate(frames):
+        meta = metadata_file.data
+        vehicle_attitude = {
+            "roll": poses["roll"][n],
+            "pitch": poses["pitch"][n],
+            "yaw": poses["yaw"][n],
+        }
+        vehicle_position = {
+            "lat": poses["lat"][n],
+            "lng": poses["lng"][n],
+            "alt": poses["alt"][n],
+        }
         if vehicle_position['alt'] < 190:
             continue
 
         file_name_raw = flight.raw_file_for_metadata(metadata_file)
         file_name_out = None
         if write_dngs:
-            file_name_dng = file_name_raw.file_name_base + ".dng"
-            file_path_dng = os.path.join(images_path, file_name_dng)
-            shape_dng = (4064, 3040)
-            format_dng = "SRGGB12"
-            data = imx477_raw_read(file_name_raw.path, shape_dng)
-            write_dng(dt_fc, file_name_raw.cam, data, format_dng, file_path_dng, metadata_file)
-            file_name_out = file_name_dng
+            file_name_out = file_name_raw.file_name_base + ".dng"
         else:
             file_name_out = file_name_raw.file_name_base + write_extension
 
@@ -179,53 +289,78 @@ for metadata_file in flight.metadata_files:
 
         exif_metadata.append(d)
 
+        # The same tags go into each image as it is written, so there is no
+        # second pass over the images with exiftool.
+        image_tags = image_tags_from_exiftool_row(d)
+        if write_dngs or write_tifs:
+            file_path_out = os.path.join(images_path, file_name_out)
+            shape_raw = (4064, 3040)
+            format_raw = "SRGGB12"
+            jobs.append(FrameJob(file_name_raw, shape_raw, format_raw, file_path_out, dt_fc, file_name_raw.cam, metadata_file, image_tags, args.demosaic,
+                                 args.compress, compress_threads))
+        else:
+            file_path_out = os.path.join(images_path, file_name_out)
+            if os.path.exists(file_path_out):
+                existing_images.append((file_path_out, image_tags))
+
+        # ODM geo.txt: image_name geo_x geo_y geo_z yaw pitch roll
+        geo_rows.append(f"{file_name_out} {vehicle_position['lng']:.8f} {vehicle_position['lat']:.8f} {vehicle_position['alt']:.3f} "
+                        f"{priors['yaw'][n]:.3f} {priors['pitch'][n]:.3f} {priors['roll'][n]:.3f}")
+
         # print(dt_pi, vehicle_position)
         # for camera in sorted(metadata, key=lambda d: d["cam"]):
         #     camera_ordinal = camera['cam']
         #     camera_attitude = vehicle_attitude.copy()
 
-import csv
-
-exiftool_column_names = [
-    'SourceFile',
-    "Directory",
-    "FileName",
-
-    "DateTime",
-    "SubSecTime",
-    "OffsetTime",
-    "DateTimeOriginal",
-    "SubSecTimeOriginal",
-    "OffsetTimeOriginal",
-
-    "GPSLatitude",
-    "GPSLatitudeRef",
-    "GPSLongitude",
-    "GPSLongitudeRef",
-    "GPSAltitude",
-    "GPSAltitudeRef",
-
-    "Make",
-    "Model",
-
-    "Aperture",
-    "ExifImageWidth",
-    "ExifImageHeight",
-    "ExposureTime",
-    "ShutterSpeedValue",
-    "ShutterSpeed",
-    "FNumber",
-    "FocalLength",
-    "ISO",
-]
-if write_dngs == False:
-    exiftool_column_names.append("Orientation")
-
-path_exiftool_csv = os.path.join(path_odm, 'exiftool.csv')
-with open(path_exiftool_csv, 'w') as f:
-    writer = csv.DictWriter(f, fieldnames=exiftool_column_names)
-    writer.writeheader()
-    writer.writerows(exif_metadata)
-
-# To update the images with metadata from the above CSV file:
-# Run `exiftool -csv=exiftool.csv images`
+    if write_dngs or write_tifs:
+        os.makedirs(images_path, exist_ok=True)
+
+        # Results come back in job order, which is also row order. Drop the rows
+        # of frames that failed to convert, but keep going.
+        converted = []
+        converted_geo = []
+        failures = 0
+        for result in convert_frames(jobs, args.workers):
+            if result.ok:
+                converted.append(exif_metadata[result.index])
+                converted_geo.append(geo_rows[result.index])
+            else:
+                failures += 1
+                print(f"{result.job.raw_path}: conversion failed", file=sys.stderr)
+                print(result.error, file=sys.stderr)
+        exif_metadata = converted
+        geo_rows = converted_geo
+
+        print(f"converted {len(jobs) - failures} of {len(jobs)} frames, {failures} failed")
+    elif existing_images:
+        # Images produced earlier: patch their tags in place.
+        failures = 0
+        for path, error in patch_files(existing_images, args.workers):
+            if error is not None:
+                failures += 1
+                print(f"{path}: tagging failed", file=sys.stderr)
+                print(error, file=sys.stderr)
+        print(f"tagged {len(existing_images) - failures} of {len(existing_images)} existing images, {failures} failed")
+
+    exiftool_column_names = list(EXIFTOOL_COLUMN_NAMES)
+    if write_dngs == False:
+        exiftool_column_names.append("Orientation")
+
+    path_exiftool_csv = os.path.join(path_odm, 'exiftool.csv')
+    with open(path_exiftool_csv, 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=exiftool_column_names)
+        writer.writeheader()
+        writer.writerows(exif_metadata)
+
+    # Position and camera orientation priors for ODM.
+    with open(geo_txt_path, 'w') as f:
+        f.write("EPSG:4326\n")
+        for row in geo_rows:
+            f.write(row + "\n")
+
+    # The images are tagged directly (above); exiftool.csv is a record of the
+    # same tags. For images produced elsewhere, it can still be applied with:
+    # Run `exiftool -csv=exiftool.csv images`
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+import argparse
+from datetime import datetime
+
+from lib.path import Flight
+from lib.sync import MAX_RESIDUAL, derive_sync_map
+from lib.time_map import TimeSync, filter_timesync, read_timesync
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="sync_map",
+        description="Derive the Raspberry Pi to flight computer time sync map from matching status texts",
+    )
+    parser.add_argument("path_flight", help="flight directory")
+    parser.add_argument("file_flight_log", help="file name of the flight computer log, inside the flight directory")
+    parser.add_argument("--max-residual", type=float, default=MAX_RESIDUAL, help="reject pairs further than this from the fitted clock line, seconds")
+    args = parser.parse_args()
+
+    flight = Flight(args.path_flight, args.file_flight_log)
+    sync_files = flight.sync_files
+    kept, rejected = derive_sync_map(sync_files, *flight.log.status_texts, max_residual=args.max_residual)
+
+    # Printed in the same form as TIME_SYNC_MAP in log_extract.py.
+    print(f"# {len(sync_files)} sync file(s) in {flight.path_sync}")
+    print("TIME_SYNC_MAP = [")
+    for ts_pi, ts_fc, text in kept:
+        print(f"    ({ts_pi:.3f}, {ts_fc:.6f}), # {text!r}")
+    print("]")
+
+    for ts_pi, ts_fc, text in rejected:
+        print(f"# rejected: ({ts_pi:.3f}, {ts_fc:.6f}) {text!r}, {datetime.fromtimestamp(ts_pi)}")
+
+    if len(kept) >= 2:
+        print("# " + TimeSync([(ts_pi, ts_fc) for ts_pi, ts_fc, _ in kept]).summary())
+
+    # log_extract.py prefers the TIMESYNC samples, if there are any.
+    timesync_files = flight.timesync_files
+    if timesync_files:
+        samples = read_timesync(timesync_files)
+        used = filter_timesync(samples)
+        print(f"# {len(timesync_files)} TIMESYNC file(s): {len(used)} of {len(samples)} samples used")
+        if len(used) >= 2 and flight.log.timebase != 0.0:
+            print("# " + TimeSync.from_timesync(used, flight.log.timebase).summary())
+
+if __name__ == "__main__":
+    main()